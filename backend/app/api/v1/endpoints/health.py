@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response, status
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.session import get_db
+from app.core.dependencies import get_service_registry
+from app.services.registry import ServiceRegistry
 
 router = APIRouter()
 
@@ -18,3 +20,14 @@ async def health_check_db(db: AsyncSession = Depends(get_db)):
         return {"status": "ok", "db_response": value}
     except Exception as e:
         return {"status": "error", "detail": str(e)}
+
+@router.get("/ready")
+async def readiness_check(response: Response, registry: ServiceRegistry = Depends(get_service_registry)):
+    """
+    Report whether the shared services were built and warmed at startup.
+    Returns 503 until the ChatService is available.
+    """
+    state = registry.status()
+    if not state["ready"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "ready" if state["ready"] else "not_ready", **state}
@@ -1,14 +1,98 @@
+from pathlib import Path
+
+from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# Relative cache paths are resolved against the backend directory, not the working directory
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+
 class Settings(BaseSettings):
     DATABASE_URL: str
     CHROMA_PERSIST_DIRECTORY: str = "chroma_data"
+    CHROMA_COLLECTION_REVALIDATE_SECONDS: float = 30  # Re-resolve cached collection handles after this long
+    CHROMA_VERSION_GRACE_SECONDS: float = 3600  # Keep retired collection versions queryable this long after a swap
     RAG_CONFIDENCE_THRESHOLD: float = 0.7
+    # Relevance cut-off on Chroma's squared L2 distance (1.0 is cosine 0.5 for unit-length embeddings);
+    # chunks further than RAG_DISTANCE_MARGIN from the best match are dropped. None disables either rule.
+    RAG_MAX_DISTANCE: float | None = 1.0
+    RAG_DISTANCE_MARGIN: float | None = 0.35
+    # Near-duplicate filtering of retrieved chunks (None disables a threshold rule)
+    RAG_DEDUP_EXACT: bool = True
+    RAG_DEDUP_SUBSTRING: bool = True
+    RAG_DEDUP_JACCARD_THRESHOLD: float | None = 0.60
+    RAG_DEDUP_FIRST_SENTENCE: bool = True
+    RAG_DEDUP_COSINE_THRESHOLD: float | None = 0.95
+    CHAT_SINGLE_PASS_STREAMING: bool = True  # False restores the structured run + streamed run
+    # SSE token coalescing: flush after N chars or N ms (0/0 sends every model delta as its own frame)
+    STREAM_COALESCE_MIN_CHARS: int = 24
+    STREAM_COALESCE_INTERVAL_MS: int = 50
     REDIS_URL: str = "redis://localhost:6379/0"
     RATE_LIMIT_PER_MINUTE: str = "60/minute"
     LOG_LEVEL: str = "INFO"
     LOGFIRE_TOKEN: str | None = None
 
+    # Query embedding client
+    EMBEDDING_MODEL: str = "models/text-embedding-004"
+    EMBEDDING_BACKEND: str = "gemini"  # "gemini" or "fake" (offline load testing)
+    EMBEDDING_MAX_CONCURRENCY: int = 8
+    EMBEDDING_TIMEOUT_SECONDS: float = 10.0
+    EMBEDDING_FAKE_LATENCY_MS: int = 0
+
+    # Query embedding cache (memory LRU + TTL, optional SQLite tier)
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 2048
+    EMBEDDING_CACHE_TTL_SECONDS: float = 86400
+    EMBEDDING_CACHE_SQLITE_PATH: str | None = None
+
+    # Ingestion embedding stage (fixed-size batches across pages, rate limited, retried)
+    INGEST_EMBEDDING_BATCH_SIZE: int = 100
+    INGEST_EMBEDDING_CONCURRENCY: int = 4
+    INGEST_EMBEDDING_REQUESTS_PER_MINUTE: float = 1500
+    INGEST_EMBEDDING_MAX_RETRIES: int = 5
+    INGEST_EMBEDDING_BACKOFF_SECONDS: float = 1.0
+    INGEST_EMBEDDING_MAX_BACKOFF_SECONDS: float = 60.0
+    # How long a partial batch of submitted page texts waits for the texts of other pages
+    INGEST_EMBEDDING_LINGER_SECONDS: float = 0.1
+    # Streaming ingestion: chunks written to Chroma per flush, pages buffered between pipeline stages
+    INGEST_FLUSH_SIZE: int = 256
+    INGEST_QUEUE_PAGES: int = 16
+    # HTML extraction: worker processes (0 extracts in a thread instead) and BeautifulSoup parser
+    # ('lxml' falls back to 'html.parser' if it isn't installed; both extract the same text, but
+    # can split malformed HTML into blocks differently, so every extraction path uses this one)
+    INGEST_EXTRACT_WORKERS: int = 2
+    INGEST_HTML_PARSER: str = "lxml"
+    # Tiered fetch: try a plain HTTP request first and render with Playwright only if the content isn't in the HTML
+    INGEST_STATIC_FETCH: bool = True
+    INGEST_HTTP_TIMEOUT_SECONDS: float = 10.0
+    INGEST_HTTP_MAX_CONNECTIONS: int = 8
+    # Per-URL HTTP validators and gzip-compressed HTML snapshots of crawled pages (empty disables)
+    INGEST_CRAWL_CACHE_PATH: str | None = "crawl_cache/pages.sqlite3"
+    # Crawl browser profile: aborted resource types and tracker requests, navigation wait,
+    # content selector timeout and navigations before a page is replaced
+    INGEST_BROWSER_BLOCKED_RESOURCES: list[str] = ["image", "media", "font"]
+    INGEST_BROWSER_BLOCK_TRACKERS: bool = True
+    INGEST_BROWSER_WAIT_UNTIL: str = "commit"
+    INGEST_BROWSER_TIMEOUT_MS: int = 10000
+    INGEST_BROWSER_PAGE_MAX_USES: int = 100
+    # Chunking: "structured" (StructuredChunker, sized in tokens) or "character" (the 2000/400 character splitter)
+    INGEST_CHUNKER: str = "structured"
+    INGEST_CHUNK_MAX_TOKENS: int = 384
+    INGEST_CHUNK_MIN_TOKENS: int = 64
+    INGEST_CHUNK_OVERLAP_TOKENS: int = 32
+    # Content-addressed SQLite store of document embeddings reused across ingestion runs (empty disables)
+    INGEST_EMBEDDING_CACHE_PATH: str | None = "embedding_cache/documents.sqlite3"
+
+    # Full-response answer cache (exact match, optional embedding similarity match)
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 512
+    ANSWER_CACHE_TTL_SECONDS: float = 3600
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float | None = None  # e.g. 0.97 to enable approximate matching
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
+    @field_validator("EMBEDDING_CACHE_SQLITE_PATH", "INGEST_CRAWL_CACHE_PATH", "INGEST_EMBEDDING_CACHE_PATH")
+    @classmethod
+    def _resolve_cache_path(cls, value: str | None) -> str | None:
+        return str(BACKEND_DIR / value) if value else None
+
 settings = Settings()
@@ -1,6 +1,7 @@
 from fastapi import Request
 from chromadb.api import ClientAPI
 from app.services.chat_service import ChatService
+from app.services.registry import ServiceRegistry
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,11 +16,23 @@ def get_chroma_client(request: Request) -> ClientAPI:
         raise ValueError("ChromaDB client is not initialized in app state.")
     return client
 
-def get_chat_service() -> ChatService:
+def get_service_registry(request: Request) -> ServiceRegistry:
     """
-    Dependency to retrieve a ChatService instance.
-    This can be expanded to manage service lifecycle if needed.
+    Dependency to retrieve the process-wide ServiceRegistry from the app state.
     """
-    # This is a simple factory for now.
-    # In a real app, you might have connection pooling or other setup here.
-    return ChatService()
+    registry = getattr(request.app.state, "services", None)
+    if registry is None:
+        logger.error("ServiceRegistry is NOT initialized in app state!")
+        raise ValueError("ServiceRegistry is not initialized in app state.")
+    return registry
+
+def get_chat_service(request: Request) -> ChatService:
+    """
+    Dependency to retrieve the shared ChatService instance.
+    The service is built once in the app lifespan and reused for every request.
+    """
+    registry = get_service_registry(request)
+    if registry.chat_service is None:
+        logger.error(f"ChatService is not available: {registry.error}")
+        raise ValueError("ChatService is not initialized.")
+    return registry.chat_service
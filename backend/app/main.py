@@ -13,6 +13,8 @@ from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
 from app.middleware.rate_limit import limiter
+from app.services.registry import ServiceRegistry
+from app.rag.vector_store import get_vector_store
 import logfire
 
 import logging # Add import
@@ -22,7 +24,8 @@ from app.core.logging import configure_logging # Add import
 async def lifespan(app: FastAPI):
     """
     Context Manager for managing the lifespan of the FastAPI application.
-    Initializes and cleans up resources like the ChromaDB client and DB tables.
+    Initializes and cleans up resources like the ChromaDB client, DB tables
+    and the shared service registry.
     """
     # Initialize Logfire
     if settings.LOGFIRE_TOKEN:
@@ -35,15 +38,23 @@ async def lifespan(app: FastAPI):
 
     # Startup event
     app.state.chroma_client = chromadb.PersistentClient(path=settings.CHROMA_PERSIST_DIRECTORY)
+    app.state.vector_store = get_vector_store(app.state.chroma_client)
     logging.info("ChromaDB client initialized.") # Use standard logging
 
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     logfire.info("Database tables created.")
 
+    # Build long-lived services once so the first request doesn't pay for it
+    app.state.services = ServiceRegistry()
+    app.state.services.start()
+
     yield
     # Shutdown event
+    app.state.services.shutdown()
     # PersistentClient generally doesn't need explicit closing
+    app.state.vector_store.invalidate()
+    app.state.vector_store = None
     app.state.chroma_client = None
     logfire.info("ChromaDB client shutdown.")
 
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.rag.embedding_cache import DocumentEmbeddingCache
+from app.rag.embeddings import EmbeddingClient
+from app.rag.incremental import IngestionManifest, chunks_needing_embedding
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Async token bucket: refills at rate tokens per second up to capacity,
+    and acquire() waits until enough tokens are available.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        # Waiters are served in order: the lock is held while sleeping for the refill
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+class BatchEmbedder:
+    """
+    Embedding stage for ingestion.
+
+    Texts from all pages are embedded in fixed-size batches, with up to
+    max_concurrency batches in flight (across all concurrent embed() calls)
+    and request starts limited by a token bucket (requests_per_minute). A failed batch is retried with jittered
+    exponential backoff. Items whose batch still fails are put on the dead
+    letter list, which is retried item by item once everything else is done,
+    so a single bad text can't fail its whole batch. Items that fail even
+    then stay in dead_letter and get an empty embedding.
+
+    Pages that each have only a few chunks submit() them instead: their texts
+    go on a shared queue, and one worker fills batches of batch_size from the
+    texts of every page submitted meanwhile (waiting up to linger_seconds for
+    more once the queue is empty, and forming a batch only once one of the
+    concurrent batches is free). A submitted text whose batch fails after
+    its retries gets an empty embedding without being retried alone; the
+    embed() or embed_chunks() call at the end of the run embeds it again.
+
+    With a DocumentEmbeddingCache, texts embedded before are taken from it
+    and only the rest is sent to the client. The cache is read and written in
+    a worker thread.
+    """
+
+    def __init__(
+        self,
+        client: EmbeddingClient,
+        batch_size: int = settings.INGEST_EMBEDDING_BATCH_SIZE,
+        max_concurrency: int = settings.INGEST_EMBEDDING_CONCURRENCY,
+        requests_per_minute: float = settings.INGEST_EMBEDDING_REQUESTS_PER_MINUTE,
+        max_retries: int = settings.INGEST_EMBEDDING_MAX_RETRIES,
+        backoff_seconds: float = settings.INGEST_EMBEDDING_BACKOFF_SECONDS,
+        max_backoff_seconds: float = settings.INGEST_EMBEDDING_MAX_BACKOFF_SECONDS,
+        linger_seconds: float = settings.INGEST_EMBEDDING_LINGER_SECONDS,
+        task_type: str = "retrieval_document",
+        cache: Optional[DocumentEmbeddingCache] = None,
+    ):
+        self.client = client
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.bucket = TokenBucket(requests_per_minute / 60, capacity=self.max_concurrency)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.linger_seconds = linger_seconds
+        self.task_type = task_type
+        self.cache = cache
+        self.dead_letter: List[str] = []
+        # Submitted texts waiting for a batch, each with the future its page awaits
+        self._queue: "asyncio.Queue[Tuple[str, asyncio.Future]]" = asyncio.Queue()
+        self._batcher: Optional[asyncio.Task] = None
+        self._batches: Set[asyncio.Task] = set()
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": spreads out the retries of batches that failed together
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+
+    async def _embed_batch(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """Embeds one batch, retrying failures. Returns None once retries are exhausted."""
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                embeddings = await self.client.embed_many(texts, task_type=self.task_type)
+                if len(embeddings) != len(texts) or not all(embeddings):
+                    raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+                return embeddings
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Embedding batch of {len(texts)} texts failed after {attempt + 1} attempts: {e}")
+                    return None
+                delay = self._backoff(attempt)
+                logger.warning(f"Embedding batch of {len(texts)} texts failed ({e}); retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+
+    async def _run(self, texts: List[str], indices: List[int], batch_size: int, results: List[List[float]]) -> List[int]:
+        """Embeds texts[i] for i in indices into results and returns the indices that failed."""
+        failed: List[int] = []
+
+        async def run_batch(batch: List[int]) -> None:
+            async with self._semaphore:
+                embeddings = await self._embed_batch([texts[i] for i in batch])
+            if embeddings is None:
+                failed.extend(batch)
+                return
+            for i, embedding in zip(batch, embeddings):
+                results[i] = embedding
+
+        batches = [indices[start:start + batch_size] for start in range(0, len(indices), batch_size)]
+        await asyncio.gather(*(run_batch(batch) for batch in batches))
+        return sorted(failed)
+
+    async def _batch_queued(self) -> None:
+        """Forms batches from the queue until it is empty; submit() restarts it."""
+        loop = asyncio.get_running_loop()
+        while not self._queue.empty():
+            # Texts keep queueing while every batch is in flight, so the next one fills up
+            await self._semaphore.acquire()
+            batch = [self._queue.get_nowait()]
+            deadline = loop.time() + self.linger_seconds
+            while len(batch) < self.batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._run_queued(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_queued(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            embeddings = await self._embed_batch([text for text, _ in batch])
+        finally:
+            self._semaphore.release()
+        if embeddings is None:
+            embeddings = [[] for _ in batch]
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done(): # Its page may have been cancelled
+                future.set_result(embedding)
+
+    async def submit(self, texts: List[str]) -> List[List[float]]:
+        """
+        Returns one embedding per text, in order, embedding them in batches
+        shared with the texts other pages submit meanwhile; an empty list for
+        texts whose batch failed (they are not dead-lettered here).
+        """
+        results: List[List[float]] = [[] for _ in texts]
+        if not texts:
+            return results
+        pending = list(range(len(texts)))
+        if self.cache is not None:
+            for i, embedding in enumerate(await asyncio.to_thread(self.cache.get_many, texts)):
+                if embedding is not None:
+                    results[i] = embedding
+            pending = [i for i in pending if not results[i]]
+        if not pending:
+            return results
+
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in pending]
+        for i, future in zip(pending, futures):
+            self._queue.put_nowait((texts[i], future))
+        if self._batcher is None or self._batcher.done():
+            self._batcher = asyncio.create_task(self._batch_queued())
+        for i, embedding in zip(pending, await asyncio.gather(*futures)):
+            results[i] = embedding
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put_many, [texts[i] for i in pending], [results[i] for i in pending])
+        return results
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Returns one embedding per text, in order; an empty list for texts that failed."""
+        results: List[List[float]] = [[] for _ in texts]
+        if not texts:
+            return results
+        pending = list(range(len(texts)))
+        if self.cache is not None:
+            for i, embedding in enumerate(await asyncio.to_thread(self.cache.get_many, texts)):
+                if embedding is not None:
+                    results[i] = embedding
+            pending = [i for i in pending if not results[i]]
+            logger.info(f"{len(texts) - len(pending)} of {len(texts)} texts found in the embedding cache.")
+
+        failed = await self._run(texts, pending, self.batch_size, results)
+        if failed:
+            logger.warning(f"Retrying {len(failed)} dead-lettered texts one by one.")
+            failed = await self._run(texts, failed, 1, results)
+        if failed:
+            logger.error(f"{len(failed)} of {len(texts)} texts could not be embedded.")
+            self.dead_letter.extend(texts[i] for i in failed)
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put_many, [texts[i] for i in pending], [results[i] for i in pending])
+        return results
+
+    async def embed_chunks(self, chunks: List[Dict[str, Any]], manifest: Optional[IngestionManifest] = None) -> int:
+        """
+        Fills in chunk['embedding'] for the chunks that need one (see
+        chunks_needing_embedding) and returns how many could not be embedded.
+        """
+        pending = chunks_needing_embedding(chunks, manifest)
+        if not pending:
+            return 0
+        logger.info(f"Embedding {len(pending)} chunks in batches of {self.batch_size}...")
+        embeddings = await self.embed([chunk["content"] for chunk in pending])
+        missing = 0
+        for chunk, embedding in zip(pending, embeddings):
+            chunk["embedding"] = embedding
+            if not embedding:
+                missing += 1
+                logger.error(f"No embedding for chunk {chunk['chunk_id']}; it will not be stored.")
+        return missing
@@ -0,0 +1,83 @@
+import logging
+from collections import Counter
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import urlparse
+
+from playwright.async_api import Browser, BrowserContext, Route
+from playwright.sync_api import Browser as SyncBrowser, BrowserContext as SyncBrowserContext, Route as SyncRoute
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Analytics and tag managers; never needed to render documentation text
+TRACKER_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "hotjar.com",
+    "clarity.ms",
+    "facebook.net",
+    "segment.io",
+    "siteimprove.com",
+    "siteimproveanalytics.com",
+)
+
+class BrowserProfile:
+    """
+    Crawl-optimized Playwright context settings.
+
+    Contexts made by new_context() abort requests the text extractor never
+    needs: resource types such as images, media and fonts, and requests to
+    tracker hosts. Service workers are blocked so every request goes through
+    the route handler. Crawlers replace a page after page_max_uses navigations
+    (0 never does), so a long crawl's memory stays bounded.
+    """
+
+    def __init__(
+        self,
+        blocked_resource_types: Iterable[str] = settings.INGEST_BROWSER_BLOCKED_RESOURCES,
+        blocked_hosts: Optional[Iterable[str]] = None,
+        page_max_uses: int = settings.INGEST_BROWSER_PAGE_MAX_USES,
+        context_options: Optional[Dict[str, Any]] = None,
+    ):
+        self.blocked_resource_types = frozenset(blocked_resource_types)
+        if blocked_hosts is None:
+            blocked_hosts = TRACKER_HOSTS if settings.INGEST_BROWSER_BLOCK_TRACKERS else ()
+        self.blocked_hosts = tuple(blocked_hosts)
+        self.page_max_uses = max(0, page_max_uses)
+        self.context_options = {"service_workers": "block", **(context_options or {})}
+        self.stats: Counter = Counter() # blocked, allowed
+
+    def should_block(self, resource_type: str, url: str) -> bool:
+        if resource_type in self.blocked_resource_types:
+            return True
+        host = (urlparse(url).hostname or "").lower()
+        return any(host == blocked or host.endswith("." + blocked) for blocked in self.blocked_hosts)
+
+    async def _route(self, route: Route) -> None:
+        if self.should_block(route.request.resource_type, route.request.url):
+            self.stats["blocked"] += 1
+            await route.abort()
+        else:
+            self.stats["allowed"] += 1
+            await route.continue_()
+
+    def _route_sync(self, route: SyncRoute) -> None:
+        if self.should_block(route.request.resource_type, route.request.url):
+            self.stats["blocked"] += 1
+            route.abort()
+        else:
+            self.stats["allowed"] += 1
+            route.continue_()
+
+    async def new_context(self, browser: Browser) -> BrowserContext:
+        context = await browser.new_context(**self.context_options)
+        await context.route("**/*", self._route)
+        return context
+
+    def new_context_sync(self, browser: SyncBrowser) -> SyncBrowserContext:
+        """new_context() for the sync Playwright API."""
+        context = browser.new_context(**self.context_options)
+        context.route("**/*", self._route_sync)
+        return context
@@ -0,0 +1,171 @@
+import re
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+# A structural unit of a page's text: (heading level 1-6, or 0 for body text, text); see extract_blocks
+Block = Tuple[int, str]
+
+# Joins a chunk's heading path in its text and in Chroma metadata
+HEADING_PATH_SEPARATOR = " > "
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = re.compile(r"(?<=[.!?:;])\s+")
+
+def approximate_token_count(text: str) -> int:
+    """
+    Offline estimate of an embedding model's token count: one token per
+    punctuation mark and per started 4 characters of a word, which is how
+    subword tokenizers behave on average. Counts of texts joined by
+    whitespace add up.
+    """
+    return sum((len(token) + 3) // 4 for token in _TOKEN_PATTERN.findall(text))
+
+class TextChunk(NamedTuple):
+    text: str
+    heading_path: List[str] # Headings the whole chunk is under, outermost first
+
+class StructuredChunker:
+    """
+    Token-aware chunking along a page's heading and block structure.
+
+    Blocks (see extract_blocks) are packed into chunks of at most max_tokens
+    (unless a single word is longer).
+    A chunk ends at the next heading once it has min_tokens, so sections
+    are not mixed unless they are too small to stand alone, and a heading
+    always starts the chunk with its section. Blocks that don't fit into one
+    chunk are split at sentence ends, or at word boundaries as a last resort.
+    Every chunk under a heading starts with a line of its heading path (in
+    place of the heading itself, if the chunk starts with one), so each
+    chunk carries the context of its section. Only when a section continues
+    in the next chunk does that chunk repeat the last sentences of the
+    previous one (up to overlap_tokens).
+
+    token_counter defaults to approximate_token_count; any callable whose
+    counts roughly add up over whitespace-joined text works. Sizes left as
+    None come from the INGEST_CHUNK_* settings, which are only loaded then,
+    so scripts that pass all three don't need the backend's configuration.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        min_tokens: Optional[int] = None,
+        overlap_tokens: Optional[int] = None,
+        token_counter: Callable[[str], int] = approximate_token_count,
+    ):
+        if max_tokens is None or min_tokens is None or overlap_tokens is None:
+            from app.core.config import settings
+
+            max_tokens = settings.INGEST_CHUNK_MAX_TOKENS if max_tokens is None else max_tokens
+            min_tokens = settings.INGEST_CHUNK_MIN_TOKENS if min_tokens is None else min_tokens
+            overlap_tokens = settings.INGEST_CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("overlap_tokens must be at least 0 and less than max_tokens.")
+        self.max_tokens = max_tokens
+        self.min_tokens = min(min_tokens, max_tokens)
+        self.overlap_tokens = overlap_tokens
+        self.count_tokens = token_counter
+
+    def _pieces(self, text: str, limit: int) -> List[Tuple[str, int]]:
+        """Splits text into (piece, tokens) pieces of at most limit tokens each."""
+        tokens = self.count_tokens(text)
+        if tokens <= limit:
+            return [(text, tokens)]
+        pieces: List[Tuple[str, int]] = []
+        for sentence in _SENTENCE_END.split(text):
+            tokens = self.count_tokens(sentence)
+            if tokens <= limit:
+                pieces.append((sentence, tokens))
+                continue
+            words: List[str] = []
+            size = 0
+            for word in sentence.split():
+                word_tokens = self.count_tokens(word)
+                if words and size + word_tokens > limit:
+                    pieces.append((" ".join(words), size))
+                    words, size = [], 0
+                words.append(word)
+                size += word_tokens
+            if words:
+                pieces.append((" ".join(words), size))
+        return pieces
+
+    def _tail(self, text: str) -> Optional[Tuple[str, int]]:
+        """The last sentences of text that fit into overlap_tokens, if any."""
+        sentences: List[str] = []
+        size = 0
+        for sentence in reversed(_SENTENCE_END.split(text)):
+            tokens = self.count_tokens(sentence)
+            if size + tokens > self.overlap_tokens:
+                break
+            sentences.insert(0, sentence)
+            size += tokens
+        return (" ".join(sentences), size) if sentences else None
+
+    def split(self, blocks: Sequence[Block]) -> List[TextChunk]:
+        """Chunks a page's blocks; see extract_blocks. Plain text can be passed as [(0, text)]."""
+        chunks: List[TextChunk] = []
+        headings: List[Tuple[int, str]] = []
+        # The current chunk's (text, tokens, heading path, is_heading) pieces
+        pieces: List[Tuple[str, int, List[str], bool]] = []
+        size = 0
+
+        def emit() -> None:
+            nonlocal pieces, size
+            if pieces:
+                chunks.append(self._chunk(pieces))
+            pieces, size = [], 0
+
+        def add(text: str, tokens: int, path: List[str], is_heading: bool) -> None:
+            nonlocal size
+            if not pieces and path:
+                # The heading path leads the chunk, replacing a leading heading (the path's last entry)
+                size += self.count_tokens(HEADING_PATH_SEPARATOR.join(path)) - (tokens if is_heading else 0)
+            pieces.append((text, tokens, path, is_heading))
+            size += tokens
+
+        for level, text in blocks:
+            if level:
+                if size >= self.min_tokens:
+                    emit()
+                while headings and headings[-1][0] >= level:
+                    headings.pop()
+                headings.append((level, text))
+            path = [heading for _, heading in headings]
+            # Leaves room for the heading path line that leads a continued section
+            path_tokens = self.count_tokens(HEADING_PATH_SEPARATOR.join(path)) if path else 0
+            limit = self.max_tokens if level else max(1, self.max_tokens - path_tokens)
+
+            for piece, tokens in self._pieces(text, limit):
+                if pieces and size + tokens > self.max_tokens:
+                    # Headings at the end of the full chunk move on with their section
+                    leading = []
+                    while pieces and pieces[-1][3]:
+                        leading.insert(0, pieces.pop())
+                    overlap = None
+                    if pieces and not leading and self.overlap_tokens and pieces[-1][2] == path:
+                        overlap = self._tail(pieces[-1][0])
+                    emit()
+                    for heading_piece in leading:
+                        add(*heading_piece)
+                    if overlap is not None and path_tokens + overlap[1] + tokens <= self.max_tokens:
+                        add(*overlap, path, False)
+                add(piece, tokens, path, bool(level))
+        emit()
+        return chunks
+
+    @staticmethod
+    def _chunk(pieces: List[Tuple[str, int, List[str], bool]]) -> TextChunk:
+        # The chunk is under the headings all of its pieces share
+        path = pieces[0][2]
+        for _, _, piece_path, _ in pieces[1:]:
+            common = 0
+            while common < min(len(path), len(piece_path)) and path[common] == piece_path[common]:
+                common += 1
+            path = path[:common]
+        lines = [text for text, _, _, _ in pieces]
+        first_path, first_is_heading = pieces[0][2], pieces[0][3]
+        if first_is_heading:
+            lines[0] = HEADING_PATH_SEPARATOR.join(first_path)
+        elif first_path:
+            lines.insert(0, HEADING_PATH_SEPARATOR.join(first_path))
+        return TextChunk("\n".join(lines), path)
@@ -0,0 +1,134 @@
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from chromadb.api import ClientAPI
+
+from app.rag.dedup import EmbeddingDeduplicator
+from app.rag.incremental import content_hash
+from app.rag.vector_store import SOURCE_URL_SEPARATOR, get_vector_store
+
+class CorpusDedupIndex:
+    """
+    Ingestion-time de-duplication across every page of a run.
+
+    Boilerplate paragraphs repeated on many pages are stored once: a chunk is
+    dropped if its whitespace-normalized text hashes to an already kept chunk,
+    or if its embedding is a near-duplicate of one (see EmbeddingDeduplicator,
+    which switches to an LSH index for large corpora). The URLs of the pages a
+    kept chunk was found on are collected in source_urls. Only ids and URLs
+    are kept, not the chunks, so kept chunks can be stored before the run
+    ends; their source URLs are applied afterwards (apply_source_urls or
+    update_source_urls).
+
+    filter() is thread-safe; with concurrent crawling, which page keeps a
+    shared chunk depends on the order pages finish in.
+
+    The index lives in memory. A resumed run restore()s it from the chunks
+    the interrupted run already stored, plus the source URLs it checkpointed
+    (see source_urls_snapshot).
+    """
+
+    def __init__(self, threshold: float = 0.95, deduplicator: Optional[EmbeddingDeduplicator] = None):
+        self.deduplicator = deduplicator or EmbeddingDeduplicator(threshold)
+        self._lock = threading.Lock()
+        self._by_hash: Dict[str, Tuple[str, str]] = {} # Text hash -> (chunk_id, url) of the kept chunk
+        self._by_row: List[Tuple[str, str]] = [] # Kept (chunk_id, url), by EmbeddingDeduplicator position
+        self.source_urls: Dict[str, List[str]] = {} # chunk_id -> URLs, for kept chunks found on several pages
+        self.dropped = 0
+
+    def _merge(self, kept: Tuple[str, str], duplicate: Dict[str, Any]) -> None:
+        chunk_id, url = kept
+        urls = self.source_urls.setdefault(chunk_id, [url])
+        if duplicate["url"] not in urls:
+            urls.append(duplicate["url"])
+
+    def filter(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Returns the chunks (of one page) that aren't duplicates of chunks seen
+        before, in order. Chunks without an embedding are only matched by text.
+        """
+        with self._lock:
+            candidates: List[Tuple[str, Dict[str, Any]]] = []
+            for chunk in chunks:
+                key = content_hash(" ".join(chunk["content"].lower().split()))
+                kept = self._by_hash.get(key)
+                if kept is not None:
+                    self._merge(kept, chunk)
+                    continue
+                self._by_hash[key] = (chunk["chunk_id"], chunk["url"])
+                candidates.append((key, chunk))
+
+            embedded = [(key, chunk) for key, chunk in candidates if chunk.get("embedding")]
+            duplicates = set()
+            if embedded:
+                keep, matches = self.deduplicator.add_with_matches([chunk["embedding"] for _, chunk in embedded])
+                for (key, chunk), kept, match in zip(embedded, keep, matches):
+                    if kept:
+                        self._by_row.append((chunk["chunk_id"], chunk["url"]))
+                    else:
+                        self._merge(self._by_row[match], chunk)
+                        self._by_hash[key] = self._by_row[match]
+                        duplicates.add(id(chunk))
+
+            unique = [chunk for _, chunk in candidates if id(chunk) not in duplicates]
+            self.dropped += len(chunks) - len(unique)
+            return unique
+
+    def source_urls_snapshot(self) -> Dict[str, List[str]]:
+        """A copy of source_urls, safe to serialize while other threads filter pages."""
+        with self._lock:
+            return {chunk_id: list(urls) for chunk_id, urls in self.source_urls.items()}
+
+    def restore(
+        self,
+        client: ClientAPI,
+        collection_name: str,
+        urls: Iterable[str],
+        source_urls: Optional[Dict[str, List[str]]] = None,
+    ) -> int:
+        """
+        Adds the chunks of urls stored in the collection (pages an interrupted
+        run finished) as kept chunks, so the pages still to come are
+        de-duplicated against them, and merges in the source_urls that run
+        recorded. Returns how many chunks were restored.
+        """
+        urls = set(urls)
+        stored = get_vector_store(client).get_collection(collection_name).get(
+            include=["documents", "embeddings", "metadatas"]
+        )
+        pages: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        embeddings = stored["embeddings"] if stored["embeddings"] is not None else [None] * len(stored["ids"])
+        for chunk_id, document, embedding, metadata in zip(stored["ids"], stored["documents"], embeddings, stored["metadatas"]):
+            url = (metadata or {}).get("url")
+            if url in urls:
+                embedding = np.asarray(embedding).tolist() if embedding is not None else []
+                pages[url].append({"chunk_id": chunk_id, "url": url, "content": document or "", "embedding": embedding})
+
+        dropped = self.dropped
+        for chunks in pages.values():
+            self.filter(chunks)
+        self.dropped = dropped # These were kept once already; only new drops count
+        with self._lock:
+            for chunk_id, recorded in (source_urls or {}).items():
+                merged = self.source_urls.setdefault(chunk_id, [])
+                merged.extend(url for url in recorded if url not in merged)
+        return sum(len(chunks) for chunks in pages.values())
+
+    def apply_source_urls(self, chunks: List[Dict[str, Any]]) -> None:
+        """Sets 'source_urls' on the chunks that were found on several pages, before they are stored."""
+        for chunk in chunks:
+            if chunk["chunk_id"] in self.source_urls:
+                chunk["source_urls"] = self.source_urls[chunk["chunk_id"]]
+
+    def update_source_urls(self, client: ClientAPI, collection_name: str) -> int:
+        """Writes source_urls into the metadata of chunks already stored in the collection."""
+        if not self.source_urls:
+            return 0
+        ids = sorted(self.source_urls)
+        get_vector_store(client).get_collection(collection_name).update(
+            ids=ids,
+            metadatas=[{"source_urls": SOURCE_URL_SEPARATOR.join(self.source_urls[chunk_id])} for chunk_id in ids],
+        )
+        return len(ids)
@@ -0,0 +1,112 @@
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+from app.rag.incremental import content_hash
+
+logger = logging.getLogger(__name__)
+
+class CachedPage(NamedTuple):
+    html: str
+    page_title: str
+    hrefs: List[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body_hash: str
+
+class CrawlCache:
+    """
+    On-disk cache of crawled pages backed by SQLite: per URL, the HTTP
+    validators (ETag/Last-Modified) of the last response and a gzip-compressed
+    snapshot of the HTML the page was extracted from, with its page title and
+    hrefs.
+
+    The StaticFetcher uses the validators for conditional requests, and a 304
+    or an identical body hash marks a page as unchanged. The snapshots also
+    let a crawl be replayed offline (AsyncCrawler with from_cache=True).
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body_hash TEXT NOT NULL, "
+            "html BLOB NOT NULL, page_title TEXT NOT NULL, hrefs TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT html, page_title, hrefs, etag, last_modified, body_hash FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        html, page_title, hrefs, etag, last_modified, body_hash = row
+        return CachedPage(gzip.decompress(html).decode("utf-8"), page_title, json.loads(hrefs), etag, last_modified, body_hash)
+
+    def put(
+        self,
+        url: str,
+        html: str,
+        page_title: str,
+        hrefs: List[str],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """Stores (or replaces) the snapshot of url."""
+        row = (
+            url, etag, last_modified, content_hash(html), gzip.compress(html.encode("utf-8")),
+            page_title, json.dumps(hrefs), time.time(),
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(url, etag, last_modified, body_hash, html, page_title, hrefs, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            self._conn.commit()
+
+    def is_unchanged(self, url: str, html: str) -> bool:
+        """True if the stored snapshot of url has exactly this HTML."""
+        with self._lock:
+            row = self._conn.execute("SELECT body_hash FROM pages WHERE url = ?", (url,)).fetchone()
+        return row is not None and row[0] == content_hash(html)
+
+    def update(
+        self,
+        url: str,
+        html: str,
+        page_title: str,
+        hrefs: List[str],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> bool:
+        """put() that returns is_unchanged() from before the update, for callers that need both."""
+        unchanged = self.is_unchanged(url, html)
+        self.put(url, html, page_title, hrefs, etag, last_modified)
+        return unchanged
+
+    def urls(self) -> List[str]:
+        """Every cached URL, least recently stored first."""
+        with self._lock:
+            return [url for (url,) in self._conn.execute("SELECT url FROM pages ORDER BY rowid")]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
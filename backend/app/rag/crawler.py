@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+
+from app.core.config import settings
+from app.rag.batch_embedder import BatchEmbedder
+from app.rag.browser_profile import BrowserProfile
+from app.rag.crawl_cache import CrawlCache
+from app.rag.extraction import HTMLExtractor
+from app.rag.fetcher import FetchedPage, StaticFetcher
+from app.rag.frontier import CrawlFrontier
+from app.rag.ingestion import ALL_HREFS_SCRIPT, HMSREGDocumentationScraper
+
+logger = logging.getLogger(__name__)
+
+class _HostLimiter:
+    """
+    Per-host politeness: at most max_concurrency requests in flight to a host,
+    and at least min_delay seconds between the starts of two requests to it.
+    """
+
+    def __init__(self, max_concurrency: int, min_delay: float):
+        self.max_concurrency = max_concurrency
+        self.min_delay = min_delay
+        self._semaphores: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(self.max_concurrency))
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._last_start: Dict[str, float] = {}
+
+    async def acquire(self, host: str) -> None:
+        await self._semaphores[host].acquire()
+        if self.min_delay <= 0:
+            return
+        async with self._locks[host]:
+            wait = self._last_start.get(host, float("-inf")) + self.min_delay - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_start[host] = time.monotonic()
+
+    def release(self, host: str) -> None:
+        self._semaphores[host].release()
+
+class AsyncCrawler:
+    """
+    Concurrent crawl engine on the async Playwright API.
+
+    A fixed pool of pages, spread over a few browser contexts, bounds how many
+    pages load at once; workers share one frontier and reuse their pages across
+    URLs. With a BrowserProfile, contexts abort requests for images, fonts,
+    trackers and the like, and pages are replaced after profile.page_max_uses
+    navigations. With a StaticFetcher, each URL is first fetched with a plain HTTP
+    request and only rendered in a page if its HTML lacks the content selector.
+    Title and content are extracted from the raw HTML by an HTMLExtractor
+    (in a process pool if it has workers; by default in a thread); chunking and
+    embedding then run in a worker thread through the scraper, so the chunk dicts
+    are the same as HMSREGDocumentationScraper.scrape_site produces, returned in
+    discovery order. With a BatchEmbedder, every page submits the texts it needs
+    de-duplication embeddings for to it instead, so the chunks of concurrent
+    pages share its batches, rate limit and retries.
+
+    With a CrawlCache, every fetched page is snapshotted. In incremental runs a
+    page whose HTML is unchanged since the snapshot (a 304 or an identical body)
+    and whose chunks are stored is skipped before extraction. With from_cache
+    the crawl is replayed from the snapshots without a browser or network.
+    """
+
+    def __init__(
+        self,
+        scraper: HMSREGDocumentationScraper,
+        browser: Optional[Browser],
+        concurrency: int = 4,
+        contexts: int = 2,
+        per_host_concurrency: int = 4,
+        per_host_delay: float = 0.0,
+        wait_selector: str = 'div[data-object-id="dsProcedure"]',
+        timeout_ms: int = settings.INGEST_BROWSER_TIMEOUT_MS,
+        wait_until: str = settings.INGEST_BROWSER_WAIT_UNTIL,
+        profile: Optional[BrowserProfile] = None,
+        extractor: Optional[HTMLExtractor] = None,
+        static_fetcher: Optional[StaticFetcher] = None,
+        crawl_cache: Optional[CrawlCache] = None,
+        from_cache: bool = False,
+        embedder: Optional[BatchEmbedder] = None,
+    ):
+        if from_cache and crawl_cache is None:
+            raise ValueError("from_cache needs a crawl_cache to replay.")
+        self.scraper = scraper
+        self.extractor = extractor or HTMLExtractor(max_workers=0)
+        self.static_fetcher = static_fetcher
+        self.crawl_cache = crawl_cache
+        self.from_cache = from_cache
+        self.browser = browser
+        self.concurrency = max(1, concurrency)
+        self.contexts = max(1, min(contexts, self.concurrency))
+        self.host_limiter = _HostLimiter(per_host_concurrency, per_host_delay)
+        self.wait_selector = wait_selector
+        self.timeout_ms = timeout_ms
+        self.wait_until = wait_until
+        self.profile = profile
+        self.embedder = embedder
+        self._navigations: Dict[Page, int] = defaultdict(int)
+
+    async def _new_context(self) -> BrowserContext:
+        if self.profile is not None:
+            return await self.profile.new_context(self.browser)
+        return await self.browser.new_context()
+
+    async def _recycle(self, context: BrowserContext, page: Page) -> Page:
+        """Replaces page with a fresh one once it has served page_max_uses navigations."""
+        max_uses = self.profile.page_max_uses if self.profile is not None else 0
+        if not max_uses or self._navigations[page] < max_uses:
+            return page
+        self._navigations.pop(page, None)
+        await page.close()
+        return await context.new_page()
+
+    async def _fetch(self, page: Optional[Page], url: str, follow_links: bool) -> Optional[FetchedPage]:
+        """
+        Fetches url, over plain HTTP if the static fetcher can or else by loading it
+        in page, and returns the page (hrefs only with follow_links), or None on failure.
+        """
+        if self.from_cache:
+            cached = await asyncio.to_thread(self.crawl_cache.get, url)
+            if cached is None:
+                logger.error(f"Not in the crawl cache: {url}")
+                return None
+            return FetchedPage(cached.html, cached.page_title, cached.hrefs if follow_links else [])
+
+        host = urlparse(url).netloc
+        await self.host_limiter.acquire(host)
+        try:
+            if self.static_fetcher is not None:
+                fetched = await self.static_fetcher.fetch(url)
+                if fetched is not None:
+                    return fetched if follow_links else fetched._replace(hrefs=[])
+            logger.info(f"Fetching: {url} using Playwright")
+            self._navigations[page] += 1
+            # Waiting for the content selector is what matters; the navigation wait can be short
+            await page.goto(url, wait_until=self.wait_until)
+            # Explicitly wait for the main content div to appear
+            await page.wait_for_selector(self.wait_selector, state='visible', timeout=self.timeout_ms)
+            html = await page.content()
+            page_title = await page.title()
+            # Snapshots always keep the links, so a replay can follow them to any depth
+            hrefs = await page.evaluate(ALL_HREFS_SCRIPT) if follow_links or self.crawl_cache is not None else []
+            unchanged = False
+            if self.crawl_cache is not None:
+                unchanged = await asyncio.to_thread(self.crawl_cache.update, url, html, page_title, hrefs)
+            return FetchedPage(html, page_title, hrefs if follow_links else [], unchanged)
+        except Exception as e:
+            logger.error(f"Error fetching {url} with Playwright: {e}")
+            return None
+        finally:
+            self.host_limiter.release(host)
+
+    async def _process(self, url: str, html: str, page_title: str) -> List[Dict[str, Any]]:
+        title, content, blocks = await self.extractor.extract(html)
+        if not content:
+            logger.warning(f"No significant content extracted from: {url}")
+            return []
+        article_title = title or page_title or "No Title"
+        if self.embedder is None or not self.scraper.has_api_key:
+            # Splitting, de-duplication and embedding calls are blocking
+            return await asyncio.to_thread(self.scraper._build_chunks, url, article_title, content, blocks)
+        split = await asyncio.to_thread(self.scraper._split_page, url, article_title, content, blocks)
+        if split is None:
+            return []
+        current_page_hash, texts, heading_paths = split
+        embeddings = await self.embedder.submit(texts)
+
+        def assemble() -> List[Dict[str, Any]]:
+            kept = self.scraper._dedup_chunks(texts, embeddings)
+            return self.scraper._assemble_chunks(url, article_title, current_page_hash, texts, heading_paths, kept)
+
+        return await asyncio.to_thread(assemble)
+
+    async def iter_pages(
+        self,
+        start_urls: Iterable[str],
+        max_depth: int = 0,
+        frontier: Optional[CrawlFrontier] = None,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_every: int = 25,
+        max_pending_pages: int = 0,
+        mark_done: bool = True,
+    ) -> AsyncIterator[Tuple[int, str, List[Dict[str, Any]]]]:
+        """
+        Crawls like crawl(), but yields (discovery order, url, chunks) for every
+        page as soon as it is processed (chunks is empty for failed pages).
+
+        At most max_pending_pages processed pages wait for the consumer (0 means
+        unbounded); beyond that the workers pause, so a slow consumer throttles
+        the crawl instead of buffering the site in memory. With mark_done=False
+        the consumer calls frontier.mark_done(url) itself once the page's chunks
+        are stored, so checkpoints never count a page as done too early.
+        """
+        if frontier is None:
+            frontier = CrawlFrontier(max_depth=max_depth)
+        # One token per queued URL; workers block on the tokens and pop the frontier (FIFO)
+        tokens: "asyncio.Queue[None]" = asyncio.Queue()
+        processed: "asyncio.Queue[Optional[Tuple[int, str, List[Dict[str, Any]]]]]" = asyncio.Queue(maxsize=max_pending_pages)
+        discovery_order: Dict[str, int] = {}
+        pages_since_checkpoint = 0
+
+        def enqueue(url: str, depth: int) -> None:
+            if frontier.add(url, depth):
+                tokens.put_nowait(None)
+
+        for _ in range(len(frontier)): # Resumed URLs
+            tokens.put_nowait(None)
+        for url in start_urls:
+            enqueue(url, 0)
+
+        if self.from_cache:
+            contexts, slots = [], [(None, None)] * self.concurrency
+        else:
+            contexts = [await self._new_context() for _ in range(self.contexts)]
+            slots = []
+            for i in range(self.concurrency):
+                context = contexts[i % len(contexts)]
+                slots.append((context, await context.new_page()))
+
+        async def worker(context: Optional[BrowserContext], page: Optional[Page]) -> None:
+            nonlocal pages_since_checkpoint
+            while True:
+                await tokens.get()
+                url, depth = frontier.pop()
+                order = discovery_order.setdefault(url, len(discovery_order))
+                chunks: List[Dict[str, Any]] = []
+                try:
+                    if url in self.scraper.visited_urls:
+                        continue
+                    self.scraper.visited_urls.add(url)
+                    if page is not None:
+                        page = await self._recycle(context, page)
+                    fetched = await self._fetch(page, url, follow_links=depth < max_depth)
+                    if fetched is None:
+                        logger.error(f"Failed to fetch or parse: {url}")
+                        continue
+                    html, page_title, hrefs, unchanged = fetched
+                    for link in self.scraper._filter_links(hrefs):
+                        enqueue(link, depth + 1)
+                    manifest = self.scraper.manifest
+                    if unchanged and manifest is not None and manifest.mark_unchanged(url, self.scraper.chunker_signature()):
+                        logger.info(f"Unchanged since the last crawl, skipping: {url}")
+                        continue
+                    chunks = await self._process(url, html, page_title)
+                except Exception as e:
+                    logger.error(f"Error processing {url}: {e}")
+                finally:
+                    # Handed over before task_done, so every page is queued once the crawl is finished
+                    await processed.put((order, url, chunks))
+                    if mark_done:
+                        frontier.mark_done(url)
+                    pages_since_checkpoint += 1
+                    if checkpoint_path and pages_since_checkpoint >= checkpoint_every:
+                        frontier.save(checkpoint_path)
+                        pages_since_checkpoint = 0
+                    tokens.task_done()
+
+        async def finish() -> None:
+            await tokens.join()
+            await processed.put(None)
+
+        tasks = [asyncio.create_task(worker(context, page)) for context, page in slots]
+        tasks.append(asyncio.create_task(finish()))
+        try:
+            while (item := await processed.get()) is not None:
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for context in contexts:
+                await context.close()
+            if checkpoint_path:
+                frontier.save(checkpoint_path)
+
+    async def crawl(
+        self,
+        start_urls: Iterable[str],
+        max_depth: int = 0,
+        frontier: Optional[CrawlFrontier] = None,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_every: int = 25,
+    ) -> List[Dict[str, Any]]:
+        """
+        Crawls start_urls and the internal links found on them, up to max_depth
+        links away, and returns the processed chunk dicts of every page.
+
+        As with HMSREGDocumentationScraper.scrape_site, a restored frontier resumes
+        an interrupted crawl and checkpoint_path receives periodic frontier snapshots.
+        """
+        results: Dict[int, List[Dict[str, Any]]] = {}
+        async for order, _, chunks in self.iter_pages(start_urls, max_depth, frontier, checkpoint_path, checkpoint_every):
+            results[order] = chunks
+        all_chunks = [chunk for order in sorted(results) for chunk in results[order]]
+        if self.scraper.corpus_index is not None:
+            self.scraper.corpus_index.apply_source_urls(all_chunks)
+        return all_chunks
+
+async def crawl_site(
+    scraper: HMSREGDocumentationScraper,
+    start_urls: Iterable[str],
+    max_depth: int = 0,
+    **crawler_options: Any,
+) -> List[Dict[str, Any]]:
+    """Launches Chromium, runs an AsyncCrawler over start_urls and closes the browser again."""
+    async with async_playwright() as p:
+        browser = await p.chromium.launch()
+        try:
+            return await AsyncCrawler(scraper, browser, **crawler_options).crawl(start_urls, max_depth)
+        finally:
+            await browser.close()
@@ -0,0 +1,273 @@
+import threading
+from typing import List, Optional, Sequence, FrozenSet, Tuple
+
+import numpy as np
+
+def normalize_embeddings(embeddings) -> np.ndarray:
+    """
+    Returns the embeddings as a float32 matrix with L2-normalized rows.
+    Zero vectors stay zero, so their similarity to everything is 0.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class EmbeddingDeduplicator:
+    """
+    Greedy keep-first semantic de-duplication over a stream of embeddings.
+
+    Each add() call (e.g. one page's chunks) is checked against everything
+    kept so far, so the same instance de-duplicates across a whole corpus.
+    Rows are L2-normalized once and compared block by block with matrix
+    products: a row is dropped if its cosine similarity to an earlier kept
+    row is above threshold.
+
+    Once approximate_after rows have been kept, earlier rows are no longer
+    compared exhaustively. Instead a random-hyperplane LSH index (num_tables
+    tables of num_bits bits) proposes candidate pairs, which are then scored
+    exactly. Pairs above ~0.97 cosine are found almost surely, pairs just above
+    0.95 with high probability. Rows within the same block are always compared
+    exactly. add() is thread-safe.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        block_size: int = 256,
+        approximate_after: Optional[int] = 2048,
+        num_tables: int = 20,
+        num_bits: int = 16,
+        seed: int = 0,
+    ):
+        self.threshold = threshold
+        self.block_size = max(1, block_size)
+        self.approximate_after = approximate_after
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._buffer: Optional[np.ndarray] = None # Kept rows, grown by doubling
+        self._size = 0
+        self._planes: Optional[np.ndarray] = None
+        self._tables: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None # Per table: (sorted keys, kept row of each key)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def approximate(self) -> bool:
+        """Whether earlier rows are looked up in the LSH index instead of compared exhaustively."""
+        return self._tables is not None
+
+    def _kept_matrix(self) -> np.ndarray:
+        return self._buffer[:self._size]
+
+    def _append(self, rows: np.ndarray) -> None:
+        if self._buffer is None:
+            self._buffer = np.empty((max(len(rows), self.block_size), rows.shape[1]), dtype=np.float32)
+        elif self._size + len(rows) > len(self._buffer):
+            grown = np.empty((max(2 * len(self._buffer), self._size + len(rows)), rows.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._kept_matrix()
+            self._buffer = grown
+        self._buffer[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+
+    def _hash(self, matrix: np.ndarray) -> np.ndarray:
+        bits = (matrix @ self._planes > 0).reshape(len(matrix), self.num_tables, self.num_bits)
+        return bits.astype(np.int64) @ (1 << np.arange(self.num_bits, dtype=np.int64))
+
+    def _start_index(self) -> None:
+        """Switches to approximate lookups, indexing every row kept so far."""
+        self._planes = self._rng.standard_normal((self._buffer.shape[1], self.num_tables * self.num_bits)).astype(np.float32)
+        empty = np.empty(0, dtype=np.int64)
+        self._tables = [(empty, empty)] * self.num_tables
+        self._index(0, self._hash(self._kept_matrix()))
+
+    def _index(self, first_row: int, new_keys: np.ndarray) -> None:
+        """Adds the LSH keys of rows stored from kept row first_row on to the tables."""
+        new_ids = np.arange(first_row, first_row + len(new_keys), dtype=np.int64)
+        for table, (keys, ids) in enumerate(self._tables):
+            order = np.argsort(new_keys[:, table])
+            # Merge the sorted new keys in, instead of re-sorting the whole table
+            positions = np.searchsorted(keys, new_keys[order, table])
+            self._tables[table] = (np.insert(keys, positions, new_keys[order, table]), np.insert(ids, positions, new_ids[order]))
+
+    def _candidate_pairs(self, block_keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(block row, kept row) pairs that share an LSH bucket in at least one table."""
+        block_rows, kept_rows = [], []
+        for table, (keys, ids) in enumerate(self._tables):
+            left = np.searchsorted(keys, block_keys[:, table], side="left")
+            counts = np.searchsorted(keys, block_keys[:, table], side="right") - left
+            total = int(counts.sum())
+            if not total:
+                continue
+            # Expand each block row's bucket range [left, left + count) into individual positions
+            offsets = np.repeat(np.cumsum(counts) - counts, counts)
+            positions = np.repeat(left, counts) + np.arange(total) - offsets
+            block_rows.append(np.repeat(np.arange(len(block_keys)), counts))
+            kept_rows.append(ids[positions])
+        if not block_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(block_rows), np.concatenate(kept_rows)
+
+    def _matches_in_kept(self, block: np.ndarray, block_keys: Optional[np.ndarray]) -> np.ndarray:
+        """For each row of block, the kept row it is a near-duplicate of (the most similar one), or -1."""
+        matches = np.full(len(block), -1, dtype=np.int64)
+        if not self._size:
+            return matches
+        kept = self._kept_matrix()
+        if not self.approximate:
+            similarities = block @ kept.T
+            best = similarities.argmax(axis=1)
+            duplicates = similarities[np.arange(len(block)), best] > self.threshold
+            matches[duplicates] = best[duplicates]
+            return matches
+        block_rows, kept_rows = self._candidate_pairs(block_keys)
+        similarities = np.einsum("ij,ij->i", block[block_rows], kept[kept_rows])
+        # Assign in ascending similarity, so each row ends up with its best match
+        order = np.argsort(similarities)
+        order = order[similarities[order] > self.threshold]
+        matches[block_rows[order]] = kept_rows[order]
+        return matches
+
+    def add(self, embeddings) -> List[bool]:
+        """
+        De-duplicates the rows of embeddings against each other and everything
+        kept before, keeps the survivors, and returns one keep flag per row.
+        """
+        return self.add_with_matches(embeddings)[0]
+
+    def add_with_matches(self, embeddings) -> Tuple[List[bool], List[int]]:
+        """
+        Like add, but also returns for every row the position of the kept row
+        it maps to, counting all rows kept so far: its own position if it was
+        kept, else the position of the kept row it duplicates.
+        """
+        matrix = normalize_embeddings(embeddings)
+        keep = np.ones(len(matrix), dtype=bool)
+        matches = np.full(len(matrix), -1, dtype=np.int64)
+        with self._lock:
+            if self._size and matrix.shape[1] != self._buffer.shape[1]:
+                raise ValueError(f"Expected embeddings of dimension {self._buffer.shape[1]}, got {matrix.shape[1]}")
+            for start in range(0, len(matrix), self.block_size):
+                block = matrix[start:start + self.block_size]
+                # Views, updated in place
+                block_keep = keep[start:start + self.block_size]
+                block_matches = matches[start:start + self.block_size]
+                block_keys = self._hash(block) if self.approximate else None
+                block_matches[:] = self._matches_in_kept(block, block_keys)
+                block_keep &= block_matches < 0
+
+                # Greedy pass within the block, only over rows that have a later near-duplicate
+                similarities = np.triu(block @ block.T, k=1) > self.threshold
+                kept_by = np.full(len(block), -1, dtype=np.int64)
+                for i in np.flatnonzero(similarities.any(axis=1)):
+                    if block_keep[i]:
+                        kept_by[block_keep & similarities[i]] = i
+                        block_keep &= ~similarities[i]
+
+                first_row = self._size
+                positions = first_row + np.cumsum(block_keep) - 1
+                block_matches[block_keep] = positions[block_keep]
+                within = kept_by >= 0
+                block_matches[within] = positions[kept_by[within]]
+
+                kept_rows = block[block_keep]
+                if not len(kept_rows):
+                    continue
+                self._append(kept_rows)
+                if self.approximate:
+                    self._index(first_row, block_keys[block_keep])
+                elif self.approximate_after is not None and self._size >= self.approximate_after:
+                    self._start_index()
+        return keep.tolist(), matches.tolist()
+
+def greedy_dedup(embeddings, threshold: float = 0.95, block_size: int = 256) -> List[int]:
+    """
+    Returns the indices of the embeddings to keep, in order: each row is dropped
+    if its cosine similarity to an earlier kept row is above threshold.
+    """
+    if len(embeddings) == 0:
+        return []
+    keep = EmbeddingDeduplicator(threshold, block_size=block_size).add(embeddings)
+    return [i for i, kept in enumerate(keep) if kept]
+
+class _PreparedChunk:
+    """A chunk normalized once, with everything the text rules compare precomputed."""
+
+    __slots__ = ("normalized", "words", "first_sentence")
+
+    def __init__(self, text: str):
+        self.normalized = text.lower().strip()
+        self.words: FrozenSet[str] = frozenset(self.normalized.split())
+        sentences = (s.strip() for s in self.normalized.split('.'))
+        self.first_sentence: Optional[str] = next((s for s in sentences if s), None)
+
+class ChunkDeduplicator:
+    """
+    Greedy keep-first near-duplicate filter for retrieved chunks.
+
+    A chunk is dropped if it matches an already kept chunk by any enabled rule:
+    exact match, substring containment, word-set Jaccard overlap, identical
+    first sentence, or cosine similarity of the embeddings. Each chunk is
+    normalized once, and all pairwise cosine similarities come from a single
+    matrix product.
+    """
+
+    def __init__(
+        self,
+        exact: bool = True,
+        substring: bool = True,
+        jaccard_threshold: Optional[float] = 0.60,
+        first_sentence: bool = True,
+        cosine_threshold: Optional[float] = None,
+    ):
+        self.exact = exact
+        self.substring = substring
+        self.jaccard_threshold = jaccard_threshold
+        self.first_sentence = first_sentence
+        self.cosine_threshold = cosine_threshold
+
+    def _is_text_duplicate(self, chunk: _PreparedChunk, kept: _PreparedChunk) -> bool:
+        if self.exact and chunk.normalized == kept.normalized:
+            return True
+        if self.substring and (chunk.normalized in kept.normalized or kept.normalized in chunk.normalized):
+            return True
+        if self.jaccard_threshold is not None and chunk.words and kept.words:
+            overlap = len(chunk.words & kept.words) / len(chunk.words | kept.words)
+            if overlap > self.jaccard_threshold:
+                return True
+        if self.first_sentence and chunk.first_sentence is not None and chunk.first_sentence == kept.first_sentence:
+            return True
+        return False
+
+    def select(
+        self,
+        documents: Sequence[str],
+        embeddings: Optional[Sequence[Sequence[float]]] = None,
+        limit: Optional[int] = None,
+    ) -> List[int]:
+        """
+        Returns the indices of the documents to keep, in their original order.
+        Stops once limit chunks have been kept.
+        """
+        prepared = [_PreparedChunk(doc) for doc in documents]
+
+        similarities = None
+        if self.cosine_threshold is not None and embeddings is not None and len(embeddings) == len(documents):
+            matrix = normalize_embeddings(embeddings)
+            similarities = matrix @ matrix.T
+
+        kept: List[int] = []
+        for i, chunk in enumerate(prepared):
+            if limit is not None and len(kept) >= limit:
+                break
+            if similarities is not None and kept and similarities[i, kept].max() > self.cosine_threshold:
+                continue
+            if any(self._is_text_duplicate(chunk, prepared[j]) for j in kept):
+                continue
+            kept.append(i)
+        return kept
@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import logfire
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_cache_hits = logfire.metric_counter("embedding_cache_hits", description="Embedding cache hits")
+_cache_misses = logfire.metric_counter("embedding_cache_misses", description="Embedding cache misses")
+
+def normalize_text(text: str) -> str:
+    """Lowercases and collapses whitespace so trivially different queries share a key."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def make_cache_key(text: str, model: str, task_type: str, normalize: bool = True) -> str:
+    """
+    Builds a content-addressed key from the model, task type and text.
+    Query text is normalized; document text should be hashed as-is (normalize=False).
+    """
+    if normalize:
+        text = normalize_text(text)
+    return hashlib.sha256(f"{model}\x00{task_type}\x00{text}".encode("utf-8")).hexdigest()
+
+class SQLiteEmbeddingStore:
+    """
+    On-disk embedding tier backed by SQLite, so cached vectors survive restarts.
+    Vectors are stored as float32 blobs keyed by make_cache_key().
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[List[float]]:
+        """Returns the stored vector, or None if missing or older than max_age seconds."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector, created_at FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        vector, created_at = row
+        if max_age is not None and time.time() - created_at > max_age:
+            return None
+        return np.frombuffer(vector, dtype=np.float32).tolist()
+
+    def get_many(self, keys: List[str], max_age: Optional[float] = None) -> Dict[str, List[float]]:
+        """Returns the stored vectors of the given keys that exist and are fresh enough."""
+        rows = []
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # Stay well below SQLite's limit on bound parameters
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                rows.extend(self._conn.execute(
+                    f"SELECT key, vector, created_at FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall())
+        now = time.time()
+        return {
+            key: np.frombuffer(vector, dtype=np.float32).tolist()
+            for key, vector, created_at in rows
+            if max_age is None or now - created_at <= max_age
+        }
+
+    def put(self, key: str, vector: List[float]) -> None:
+        """Stores (or replaces) the vector for key."""
+        self.put_many([(key, vector)])
+
+    def put_many(self, items: List[Tuple[str, List[float]]]) -> None:
+        """Stores (or replaces) several vectors in one transaction."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class EmbeddingCache:
+    """
+    Bounded in-memory LRU cache with TTL, optionally backed by a SQLiteEmbeddingStore.
+
+    Lookups check memory first, then the disk tier; disk hits are promoted to memory.
+    Vectors are kept as float32 values in both tiers, so a hit is the same vector
+    wherever it comes from. Async callers use aget_many/aput_many, which read and
+    write the disk tier in a worker thread instead of on the event loop.
+    Hit/miss counts are kept on the instance and reported as logfire metrics.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl_seconds: Optional[float] = 86400,
+        store: Optional[SQLiteEmbeddingStore] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._entries: "OrderedDict[str, Tuple[List[float], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """Returns the cached vector for key, or None on a miss."""
+        vector = self._get_memory(key)
+        if vector is None and self.store is not None:
+            vector = self._promote(self.store.get_many([key], max_age=self.ttl_seconds)).get(key)
+        if vector is None:
+            self._count_misses(1)
+        return vector
+
+    async def aget_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """get() for several keys, with one disk tier read in a worker thread."""
+        vectors = [self._get_memory(key) for key in keys]
+        missing = [key for key, vector in zip(keys, vectors) if vector is None]
+        if missing and self.store is not None:
+            found = self._promote(await asyncio.to_thread(self.store.get_many, missing, self.ttl_seconds))
+            vectors = [found.get(key) if vector is None else vector for key, vector in zip(keys, vectors)]
+        self._count_misses(sum(vector is None for vector in vectors))
+        return vectors
+
+    def put(self, key: str, vector: List[float]) -> List[float]:
+        """Stores vector in memory and, if configured, on disk. Returns it as stored."""
+        vector = self._remember(key, vector)
+        if self.store is not None:
+            self.store.put(key, vector)
+        return vector
+
+    async def aput_many(self, items: List[Tuple[str, List[float]]]) -> List[List[float]]:
+        """put() for several vectors, with one disk tier write in a worker thread."""
+        vectors = [self._remember(key, vector) for key, vector in items]
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put_many, [(key, vector) for (key, _), vector in zip(items, vectors)])
+        return vectors
+
+    def _get_memory(self, key: str) -> Optional[List[float]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            vector, expires_at = entry
+            if expires_at < now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        _cache_hits.add(1, {"tier": "memory"})
+        return vector
+
+    def _promote(self, found: Dict[str, List[float]]) -> Dict[str, List[float]]:
+        """Moves disk hits into memory and counts them."""
+        for key, vector in found.items():
+            self._remember(key, vector)
+        if found:
+            with self._lock:
+                self.hits += len(found)
+            _cache_hits.add(len(found), {"tier": "disk"})
+        return found
+
+    def _count_misses(self, count: int) -> None:
+        if count:
+            with self._lock:
+                self.misses += count
+            _cache_misses.add(count)
+
+    def _remember(self, key: str, vector: List[float]) -> List[float]:
+        # The same float32 precision as the disk tier
+        vector = np.asarray(vector, dtype=np.float32).tolist()
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else float("inf")
+        with self._lock:
+            self._entries[key] = (vector, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return vector
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit/miss counters and the current memory size."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def clear(self) -> None:
+        """Empties the memory tier (the disk tier is left untouched)."""
+        with self._lock:
+            self._entries.clear()
+
+class DocumentEmbeddingCache:
+    """
+    Content-addressed embedding store for ingestion, so re-running ingestion
+    only pays for chunks whose text actually changed.
+
+    Keys are make_cache_key(text, model, task_type) over the exact chunk text
+    (normalize=False): a document embedding must match its text byte for byte.
+    Entries don't expire, since the same text and model always embed the same.
+    """
+
+    def __init__(self, store: SQLiteEmbeddingStore, model: str, task_type: str = "retrieval_document"):
+        self.store = store
+        self.model = model
+        self.task_type = task_type
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return make_cache_key(text, self.model, self.task_type, normalize=False)
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Returns the stored embedding of each text, or None where there is none."""
+        found = self.store.get_many([self._key(text) for text in texts])
+        embeddings = [found.get(self._key(text)) for text in texts]
+        hits = sum(embedding is not None for embedding in embeddings)
+        self.hits += hits
+        self.misses += len(texts) - hits
+        return embeddings
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]) -> None:
+        """Stores the embeddings of texts; empty (failed) embeddings are skipped."""
+        self.store.put_many([(self._key(text), embedding) for text, embedding in zip(texts, embeddings) if embedding])
+
+    def embed(self, texts: List[str], embed: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        Returns one embedding per text, calling embed() only for the texts that
+        aren't stored yet, and stores what it returns.
+        """
+        embeddings = self.get_many(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            fresh = embed([texts[i] for i in missing])
+            if len(fresh) != len(missing):
+                raise ValueError(f"Expected {len(missing)} embeddings, got {len(fresh)}")
+            self.put_many([texts[i] for i in missing], fresh)
+            for i, embedding in zip(missing, fresh):
+                embeddings[i] = embedding
+        logger.info(f"Document embedding cache: {len(texts) - len(missing)} of {len(texts)} texts already embedded.")
+        return embeddings
@@ -0,0 +1,192 @@
+import asyncio
+import functools
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import google.generativeai as genai
+import numpy as np
+
+from app.core.config import settings
+from app.rag.embedding_cache import EmbeddingCache, SQLiteEmbeddingStore, make_cache_key
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSION = 768
+
+class EmbeddingClient(ABC):
+    """
+    Async interface for embedding text.
+    Implementations must never block the event loop.
+    """
+
+    model: str = settings.EMBEDDING_MODEL
+
+    async def embed(self, text: str, task_type: str = "retrieval_query") -> List[float]:
+        """Embeds a single text and returns its vector."""
+        embeddings = await self.embed_many([text], task_type=task_type)
+        return embeddings[0]
+
+    @abstractmethod
+    async def embed_many(self, texts: List[str], task_type: str = "retrieval_document") -> List[List[float]]:
+        """Embeds a list of texts and returns one vector per text, in order."""
+
+    def close(self) -> None:
+        """Releases any resources held by the client."""
+        pass
+
+class GeminiEmbeddingClient(EmbeddingClient):
+    """
+    Runs the synchronous genai.embed_content call in a bounded thread pool.
+
+    At most max_concurrency calls are in flight; further callers wait on the
+    semaphore. Each call is bounded by timeout seconds. A call that times out
+    keeps its slot until its thread actually returns, so hung calls can't
+    pile up in the executor beyond max_concurrency.
+    """
+
+    def __init__(
+        self,
+        model: str = settings.EMBEDDING_MODEL,
+        max_concurrency: int = settings.EMBEDDING_MAX_CONCURRENCY,
+        timeout: float = settings.EMBEDDING_TIMEOUT_SECONDS,
+    ):
+        self.model = model
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embedding")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _embed_content(self, content, task_type: str):
+        call = functools.partial(
+            genai.embed_content,
+            model=self.model,
+            content=content,
+            task_type=task_type,
+        )
+        loop = asyncio.get_running_loop()
+        await self._semaphore.acquire()
+        try:
+            future = self._executor.submit(call)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        # Released when the thread is done, not when the caller stops waiting for it
+        future.add_done_callback(lambda _: self._release(loop))
+        result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        return result["embedding"]
+
+    def _release(self, loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            loop.call_soon_threadsafe(self._semaphore.release)
+        except RuntimeError: # The loop is closed, and its semaphore with it
+            pass
+
+    async def embed_many(self, texts: List[str], task_type: str = "retrieval_document") -> List[List[float]]:
+        if not texts:
+            return []
+        return await self._embed_content(texts, task_type)
+
+    async def embed(self, text: str, task_type: str = "retrieval_query") -> List[float]:
+        # A plain string returns a single vector rather than a list of vectors
+        return await self._embed_content(text, task_type)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+class FakeEmbeddingClient(EmbeddingClient):
+    """
+    Offline embedding client for tests and load testing.
+    Returns deterministic unit vectors derived from the text, with optional simulated latency.
+    """
+
+    def __init__(
+        self,
+        model: str = settings.EMBEDDING_MODEL,
+        dimension: int = EMBEDDING_DIMENSION,
+        latency: float = settings.EMBEDDING_FAKE_LATENCY_MS / 1000,
+        max_concurrency: int = settings.EMBEDDING_MAX_CONCURRENCY,
+    ):
+        self.model = model
+        self.dimension = dimension
+        self.latency = latency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    async def embed_many(self, texts: List[str], task_type: str = "retrieval_document") -> List[List[float]]:
+        async with self._semaphore:
+            self.calls += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+class CachedEmbeddingClient(EmbeddingClient):
+    """
+    Wraps another EmbeddingClient with an EmbeddingCache.
+    Keys combine the normalized text, the model name and the task type.
+    The cache's disk tier is only touched from worker threads.
+    """
+
+    def __init__(self, inner: EmbeddingClient, cache: EmbeddingCache):
+        self.inner = inner
+        self.cache = cache
+        self.model = inner.model
+
+    async def embed(self, text: str, task_type: str = "retrieval_query") -> List[float]:
+        key = make_cache_key(text, self.model, task_type)
+        embedding = (await self.cache.aget_many([key]))[0]
+        if embedding is None:
+            embedding = await self.inner.embed(text, task_type=task_type)
+            embedding = (await self.cache.aput_many([(key, embedding)]))[0]
+        return embedding
+
+    async def embed_many(self, texts: List[str], task_type: str = "retrieval_document") -> List[List[float]]:
+        keys = [make_cache_key(text, self.model, task_type) for text in texts]
+        embeddings = await self.cache.aget_many(keys)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            fresh = await self.inner.embed_many([texts[i] for i in missing], task_type=task_type)
+            stored = await self.cache.aput_many([(keys[i], embedding) for i, embedding in zip(missing, fresh)])
+            for i, embedding in zip(missing, stored):
+                embeddings[i] = embedding
+        return embeddings
+
+    def close(self) -> None:
+        self.inner.close()
+        if self.cache.store is not None:
+            self.cache.store.close()
+
+def create_embedding_client(backend: Optional[str] = None, cached: Optional[bool] = None) -> EmbeddingClient:
+    """
+    Builds the embedding client selected by settings.EMBEDDING_BACKEND ("gemini" or "fake"),
+    wrapped in an EmbeddingCache unless caching is disabled.
+    """
+    backend = (backend or settings.EMBEDDING_BACKEND).lower()
+    if backend == "fake":
+        logger.info("Using fake embedding client (offline mode).")
+        client: EmbeddingClient = FakeEmbeddingClient()
+    elif backend == "gemini":
+        client = GeminiEmbeddingClient()
+    else:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    if cached is None:
+        cached = settings.EMBEDDING_CACHE_ENABLED
+    if not cached:
+        return client
+
+    store = None
+    if settings.EMBEDDING_CACHE_SQLITE_PATH:
+        store = SQLiteEmbeddingStore(settings.EMBEDDING_CACHE_SQLITE_PATH)
+    cache = EmbeddingCache(
+        max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+        ttl_seconds=settings.EMBEDDING_CACHE_TTL_SECONDS,
+        store=store,
+    )
+    return CachedEmbeddingClient(client, cache)
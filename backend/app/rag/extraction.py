@@ -0,0 +1,191 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple
+
+from bs4 import BeautifulSoup, CData, Comment, FeatureNotFound, NavigableString, Tag
+
+from app.core.config import settings
+from app.rag.chunking import Block
+
+logger = logging.getLogger(__name__)
+
+# The article body on docs.hmsreg.com
+MAIN_CONTENT_SELECTOR = 'div[data-object-id="dsProcedure"].content'
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# Tags whose content starts a new block; everything else (links, emphasis, table cells...) flows into it
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'body', 'caption', 'dd', 'details', 'div', 'dl', 'dt',
+    'figcaption', 'figure', 'form', 'li', 'main', 'ol', 'p', 'pre', 'section', 'summary', 'table', 'tbody',
+    'tfoot', 'thead', 'tr', 'ul',
+}
+
+class ExtractedPage(NamedTuple):
+    title: Optional[str]
+    content: Optional[str]
+    blocks: List[Block] # The same text as content, split at headings and block elements
+
+@functools.lru_cache(maxsize=None)
+def available_parser(preferred: str = "lxml") -> str:
+    """Returns preferred if BeautifulSoup can use it here, else the built-in 'html.parser'."""
+    try:
+        BeautifulSoup("", preferred)
+        return preferred
+    except FeatureNotFound:
+        logger.info(f"HTML parser '{preferred}' is not installed; using 'html.parser'.")
+        return "html.parser"
+
+def extract_title(soup: BeautifulSoup) -> Optional[str]:
+    """
+    Extracts the article title from h1/h2 tags, preferring the main content
+    div over the rest of the body. Returns None if no suitable title is found.
+    """
+    main_content = soup.select_one(MAIN_CONTENT_SELECTOR)
+    for container, source in ((main_content, "content"), (soup.body, "body")):
+        if container is None:
+            continue
+        # Try to find h1 or h2 tag for the title
+        title_tag = container.find(['h1', 'h2'])
+        if title_tag:
+            title = title_tag.get_text(strip=True)
+            if title:
+                logger.debug(f"Extracted title from {source}: {title}")
+                return title
+
+    logger.debug("No title found in h1/h2 tags")
+    return None
+
+def clean_text(container: Tag) -> str:
+    """Strips boilerplate, comments and empty tags from container and returns its normalized text."""
+    # Remove specific boilerplate/navigation elements
+    for selector in ['header', 'footer', 'nav', 'script', 'style', '.skip-link', '.breadcrumb']:
+        for tag in container.find_all(selector):
+            tag.decompose()
+
+    # Remove comments
+    for comment in container.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+
+    # Remove any remaining unwanted tags like empty spans or divs that are not structural
+    for unwanted_tag in container.find_all(['span', 'div'], class_=False, id=False):
+        if not unwanted_tag.get_text(strip=True): # Remove empty or whitespace-only tags
+            unwanted_tag.decompose()
+
+    text_content = container.get_text(separator=' ', strip=True) # Use space separator to avoid word concatenation
+    return re.sub(r'\s+', ' ', text_content).strip() # Normalize whitespace
+
+def extract_blocks(container: Tag) -> List[Block]:
+    """
+    Splits the text of an already cleaned container into headings and body
+    blocks, in document order. Joined with spaces, the block texts equal
+    clean_text(container).
+    """
+    blocks: List[Block] = []
+    parts: List[str] = []
+
+    def flush() -> None:
+        text = re.sub(r'\s+', ' ', ' '.join(parts)).strip()
+        parts.clear()
+        if text:
+            blocks.append((0, text))
+
+    def walk(node: Tag) -> None:
+        for child in node.children:
+            if isinstance(child, NavigableString):
+                # Only the string types get_text() includes (not comments, doctypes...)
+                if type(child) in (NavigableString, CData) and child.strip():
+                    parts.append(child.strip())
+            elif child.name in HEADING_TAGS:
+                flush()
+                heading = re.sub(r'\s+', ' ', child.get_text(separator=' ', strip=True)).strip()
+                if heading:
+                    blocks.append((int(child.name[1]), heading))
+            elif child.name in BLOCK_TAGS:
+                flush()
+                walk(child)
+                flush()
+            else:
+                walk(child)
+
+    walk(container)
+    flush()
+    return blocks
+
+def _extract_content_container(soup: BeautifulSoup) -> Tuple[Optional[Tag], Optional[str]]:
+    main_content = soup.select_one(MAIN_CONTENT_SELECTOR)
+    if main_content is not None:
+        text_content = clean_text(main_content)
+        if len(text_content) > 50:
+            logger.debug(f"Extracted content from div[data-object-id='dsProcedure'] (length: {len(text_content)}).")
+            return main_content, text_content
+        logger.debug(f"Div[dsProcedure] content too short (length: {len(text_content)}).")
+
+    # Fallback to body content if specific div is not sufficient, with the same cleaning
+    # (cleaning is idempotent, so an already cleaned main div is unaffected)
+    if soup.body is not None:
+        text_content = clean_text(soup.body)
+        if len(text_content) > 50:
+            logger.debug(f"Extracted content from body fallback (length: {len(text_content)}).")
+            return soup.body, text_content
+
+    logger.debug(f"No significant content extracted by any selector.")
+    return None, None
+
+def extract_content(soup: BeautifulSoup) -> Optional[str]:
+    """
+    Extracts the main article content. Falls back to the whole body if the
+    main content div is missing or too short. Cleaning modifies soup.
+    """
+    return _extract_content_container(soup)[1]
+
+def extract_page(html: str, parser: str = "html.parser") -> ExtractedPage:
+    """
+    Returns the title, content and content blocks of a page's HTML, parsing it
+    once. A module-level function of plain strings, so it can run in a worker
+    process.
+    """
+    soup = BeautifulSoup(html, parser)
+    # The title is read before cleaning removes anything from the tree
+    title = extract_title(soup)
+    container, content = _extract_content_container(soup)
+    return ExtractedPage(title, content, extract_blocks(container) if container is not None else [])
+
+class HTMLExtractor:
+    """
+    Extraction stage for the crawler: runs extract_page on raw HTML in a
+    process pool, so parsing and cleaning don't compete with the event loop
+    that drives the browser (or with each other, through the GIL).
+
+    Workers are spawned rather than forked: the crawler's process already runs
+    the event loop, the Playwright driver and thread pools, and forking it can
+    deadlock. With max_workers=0 extraction runs in a worker thread instead.
+
+    parser is the BeautifulSoup backend: 'lxml' (a project dependency) by
+    default, falling back to 'html.parser' if it's missing. The golden-file
+    tests check that both produce the same text, but on malformed HTML they
+    can build different trees and so split blocks differently; the scraper's
+    own extraction uses the same configured parser.
+    """
+
+    def __init__(self, max_workers: int = settings.INGEST_EXTRACT_WORKERS, parser: str = settings.INGEST_HTML_PARSER):
+        self.max_workers = max(0, max_workers)
+        self.parser = available_parser(parser)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def extract(self, html: str) -> ExtractedPage:
+        """Extracts html; see extract_page."""
+        if not self.max_workers:
+            return await asyncio.to_thread(extract_page, html, self.parser)
+        if self._executor is None: # Started on first use, so an unused extractor costs nothing
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return await asyncio.get_running_loop().run_in_executor(self._executor, extract_page, html, self.parser)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,126 @@
+import asyncio
+import importlib.util
+import logging
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urljoin
+
+import httpx
+from bs4 import BeautifulSoup
+
+from app.core.config import settings
+from app.rag.crawl_cache import CrawlCache
+
+logger = logging.getLogger(__name__)
+
+class FetchedPage(NamedTuple):
+    html: str
+    page_title: str
+    hrefs: List[str]
+    unchanged: bool = False # Same HTML as the crawl cache's snapshot (a 304 or an identical body)
+
+def http2_available() -> bool:
+    """httpx only speaks HTTP/2 with the optional h2 package installed."""
+    return importlib.util.find_spec("h2") is not None
+
+def parse_static_page(html: str, url: str, selector: str) -> Optional[Tuple[str, List[str]]]:
+    """
+    Returns (page title, hrefs) of server-rendered HTML, or None if selector
+    matches nothing, i.e. the page needs a browser to render its content.
+    hrefs are resolved like the browser's a.href.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    if soup.select_one(selector) is None:
+        return None
+    # document.title collapses whitespace the same way
+    title = " ".join(soup.title.get_text().split()) if soup.title else ""
+    base = soup.find("base", href=True)
+    base_url = urljoin(url, base["href"]) if base else url
+    return title, [urljoin(base_url, a["href"].strip()) for a in soup.select("a[href]")]
+
+class StaticFetcher:
+    """
+    Fast path of the crawler's tiered fetch: a pooled, keep-alive async HTTP
+    client (HTTP/2 when h2 is installed) that fetches a page's HTML without a
+    browser. A page only counts as fetched if its server-rendered HTML already
+    contains the content selector; otherwise fetch() returns None and the
+    crawler renders it with Playwright.
+
+    With a CrawlCache, fetched pages are stored in it and requests for cached
+    pages are conditional (If-None-Match/If-Modified-Since). A 304 returns the
+    cached snapshot without parsing it again; both a 304 and a body identical
+    to the snapshot mark the page as unchanged.
+    """
+
+    def __init__(
+        self,
+        selector: str = 'div[data-object-id="dsProcedure"]',
+        timeout: float = settings.INGEST_HTTP_TIMEOUT_SECONDS,
+        max_connections: int = settings.INGEST_HTTP_MAX_CONNECTIONS,
+        cache: Optional[CrawlCache] = None,
+        client: Optional[httpx.AsyncClient] = None,
+    ):
+        self.selector = selector
+        self.cache = cache
+        self.client = client or httpx.AsyncClient(
+            http2=http2_available(),
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects=True,
+        )
+        self.stats: Counter = Counter() # static, not_modified, fallback, error
+
+    async def fetch(self, url: str) -> Optional[FetchedPage]:
+        """Returns the page, or None if it needs a browser."""
+        headers: Dict[str, str] = {}
+        # SQLite and gzip work stays off the event loop, like parsing
+        cached = await asyncio.to_thread(self.cache.get, url) if self.cache is not None else None
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        try:
+            response = await self.client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            logger.warning(f"Static fetch of {url} failed ({e}); falling back to the browser.")
+            self.stats["error"] += 1
+            return None
+
+        if response.status_code == 304 and cached is not None:
+            self.stats["not_modified"] += 1
+            return FetchedPage(cached.html, cached.page_title, cached.hrefs, unchanged=True)
+        if response.status_code != 200 or "html" not in response.headers.get("content-type", "text/html"):
+            logger.debug(f"Static fetch of {url} returned {response.status_code}; falling back to the browser.")
+            self.stats["fallback"] += 1
+            return None
+
+        html = response.text
+        page = await asyncio.to_thread(parse_static_page, html, str(response.url), self.selector)
+        if page is None:
+            logger.debug(f"No {self.selector} in the static HTML of {url}; falling back to the browser.")
+            self.stats["fallback"] += 1
+            return None
+        self.stats["static"] += 1
+        page_title, hrefs = page
+        unchanged = False
+        if self.cache is not None:
+            unchanged = await asyncio.to_thread(
+                self.cache.update, url, html, page_title, hrefs,
+                response.headers.get("etag"), response.headers.get("last-modified"),
+            )
+        return FetchedPage(html, page_title, hrefs, unchanged)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+def fetch_static(url: str, selector: str, timeout: float = settings.INGEST_HTTP_TIMEOUT_SECONDS) -> Optional[str]:
+    """Blocking one-off fetch: the page's HTML if it's reachable and server-renders selector, else None."""
+    try:
+        response = httpx.get(url, timeout=timeout, follow_redirects=True)
+    except httpx.HTTPError as e:
+        logger.warning(f"Static fetch of {url} failed: {e}")
+        return None
+    if response.status_code != 200 or parse_static_page(response.text, str(response.url), selector) is None:
+        return None
+    return response.text
@@ -0,0 +1,116 @@
+import json
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+# Query parameters that only track where a visitor came from; they never change the page
+TRACKING_PARAMS = frozenset({
+    "fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_gl", "ref", "ref_src",
+})
+
+def canonicalize_url(url: str) -> str:
+    """
+    Returns a canonical form of url, so the same page is only crawled once:
+    lowercase scheme and host, no fragment, no tracking parameters (utm_* and
+    TRACKING_PARAMS), and query parameters sorted by name.
+    """
+    parsed = urlparse(url.strip())
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    ]
+    return urlunparse((
+        parsed.scheme.lower(),
+        parsed.netloc.lower(),
+        parsed.path or "/",
+        parsed.params,
+        urlencode(sorted(query)),
+        "", # Fragments never reach the server
+    ))
+
+class CrawlFrontier:
+    """
+    FIFO crawl frontier with O(1) enqueue, dequeue and membership checks.
+
+    Every URL is canonicalized and admitted once (the seen set covers queued,
+    in-flight and finished URLs), together with its link depth. URLs that were
+    popped but not marked done are still pending, so a checkpoint written
+    mid-crawl resumes them too. metadata is saved along with the checkpoint,
+    for whatever else a resumed run needs (e.g. the collection it writes to).
+    """
+
+    def __init__(self, max_depth: Optional[int] = None):
+        self.max_depth = max_depth
+        self._queue: Deque[Tuple[str, int]] = deque()
+        self._in_flight: Dict[str, int] = {}
+        self._seen: Set[str] = set()
+        self.done: Set[str] = set()
+        self.metadata: Dict[str, Any] = {}
+
+    def add(self, url: str, depth: int = 0) -> bool:
+        """Queues url at depth. Returns False if it was seen before or is too deep."""
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        url = canonicalize_url(url)
+        if url in self._seen:
+            return False
+        self._seen.add(url)
+        self._queue.append((url, depth))
+        return True
+
+    def add_many(self, urls: Iterable[str], depth: int = 0) -> int:
+        """Queues every new URL in urls at depth and returns how many were added."""
+        return sum(self.add(url, depth) for url in urls)
+
+    def pop(self) -> Tuple[str, int]:
+        """Returns the oldest queued (url, depth). Raises IndexError if the queue is empty."""
+        url, depth = self._queue.popleft()
+        self._in_flight[url] = depth
+        return url, depth
+
+    def mark_done(self, url: str) -> None:
+        """Records that url was processed (successfully or not), so it isn't resumed."""
+        url = canonicalize_url(url)
+        self._in_flight.pop(url, None)
+        self.done.add(url)
+
+    def __contains__(self, url: str) -> bool:
+        return canonicalize_url(url) in self._seen
+
+    def __len__(self) -> int:
+        """Number of URLs waiting to be popped."""
+        return len(self._queue)
+
+    def __bool__(self) -> bool:
+        return bool(self._queue)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the frontier to path as JSON. In-flight URLs are saved as queued,
+        ahead of the rest. The file is replaced atomically.
+        """
+        state = {
+            "max_depth": self.max_depth,
+            "queue": [[url, depth] for url, depth in self._in_flight.items()] + [list(item) for item in self._queue],
+            "done": sorted(self.done),
+            "seen": sorted(self._seen),
+            "metadata": self.metadata,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CrawlFrontier":
+        """Restores a frontier written by save."""
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        frontier = cls(max_depth=state.get("max_depth"))
+        frontier._queue.extend((url, depth) for url, depth in state["queue"])
+        frontier.done = set(state["done"])
+        frontier._seen = set(state["seen"])
+        frontier.metadata = state.get("metadata", {})
+        return frontier
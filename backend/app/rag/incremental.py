@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set
+
+from chromadb.api import ClientAPI
+
+from app.rag.vector_store import chunk_metadata, get_collection, get_vector_store
+
+logger = logging.getLogger(__name__)
+
+def content_hash(text: str) -> str:
+    """Returns the sha256 hex digest of text, used to detect changed pages and chunks."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def page_hash(title: str, content: str, chunker: str) -> str:
+    """Hash of everything a page contributes to its chunks, including how it is chunked."""
+    return content_hash(f"{chunker}\n{title}\n{content}")
+
+class IngestionManifest:
+    """
+    Content hashes of what a collection currently holds, read from chunk metadata.
+
+    Ingestion consults it to skip unchanged pages entirely and to re-embed only
+    the chunks whose text changed. It also records which URLs the current run
+    saw, so chunks of removed pages can be deleted afterwards.
+    """
+
+    def __init__(self):
+        self.page_hashes: Dict[str, str] = {}
+        self.page_chunkers: Dict[str, str] = {}
+        self.chunk_hashes: Dict[str, str] = {}
+        self.chunk_ids_by_url: Dict[str, Set[str]] = defaultdict(set)
+        self.seen_urls: Set[str] = set()
+        self.unchanged_urls: Set[str] = set()
+
+    @classmethod
+    def from_collection(cls, client: ClientAPI, collection_name: str = "hmsreg_docs") -> "IngestionManifest":
+        manifest = cls()
+        stored = get_collection(client, collection_name).get(include=["metadatas"])
+        for chunk_id, metadata in zip(stored["ids"], stored["metadatas"] or []):
+            metadata = metadata or {}
+            url = metadata.get("url")
+            if url:
+                manifest.chunk_ids_by_url[url].add(chunk_id)
+                # A page only counts as stored if all of its chunks agree on its hash
+                stored_hash = metadata.get("page_hash") or ""
+                if manifest.page_hashes.setdefault(url, stored_hash) != stored_hash:
+                    manifest.page_hashes[url] = ""
+                stored_chunker = metadata.get("chunker") or ""
+                if manifest.page_chunkers.setdefault(url, stored_chunker) != stored_chunker:
+                    manifest.page_chunkers[url] = ""
+            if metadata.get("content_hash"):
+                manifest.chunk_hashes[chunk_id] = metadata["content_hash"]
+        logger.info(f"Loaded ingestion manifest: {len(manifest.chunk_ids_by_url)} pages, {len(manifest.chunk_hashes)} chunks.")
+        return manifest
+
+    def is_page_unchanged(self, url: str, current_page_hash: str) -> bool:
+        """Marks url as seen and returns True if its stored chunks are up to date."""
+        self.seen_urls.add(url)
+        if current_page_hash and self.page_hashes.get(url) == current_page_hash:
+            self.unchanged_urls.add(url)
+            return True
+        return False
+
+    def mark_unchanged(self, url: str, chunker: str) -> bool:
+        """
+        Marks url as seen and, if its chunks are stored and were chunked by the
+        given chunker (see chunker_signature), as unchanged without hashing its
+        content (e.g. when its HTML didn't change). Returns whether it was.
+        """
+        self.seen_urls.add(url)
+        if self.page_hashes.get(url) and self.page_chunkers.get(url) == chunker:
+            self.unchanged_urls.add(url)
+            return True
+        return False
+
+    def needs_embedding(self, chunk_id: str, current_content_hash: Optional[str]) -> bool:
+        return not current_content_hash or self.chunk_hashes.get(chunk_id) != current_content_hash
+
+def write_chunk_changes(
+    client: ClientAPI,
+    chunks: List[Dict[str, Any]],
+    manifest: IngestionManifest,
+    collection_name: str = "hmsreg_docs",
+) -> Dict[str, int]:
+    """
+    Upserts the chunks whose text changed (with their embedding) and updates
+    the metadata of chunks whose text is unchanged but whose page hash is new.
+    Returns counts of upserted and updated chunks.
+    """
+    collection = get_vector_store(client).get_collection(collection_name)
+
+    # Chunks whose text changed are upserted. Unchanged text on a changed page only needs
+    # its metadata refreshed, even if the chunk was embedded again (e.g. for de-duplication).
+    # Changed chunks whose embedding failed are left alone; their page hash then disagrees
+    # and they are retried next run.
+    changed = [chunk for chunk in chunks if manifest.needs_embedding(chunk["chunk_id"], chunk.get("content_hash"))]
+    upserts = [chunk for chunk in changed if chunk.get("embedding")]
+    updates = [
+        chunk for chunk in chunks
+        if not manifest.needs_embedding(chunk["chunk_id"], chunk.get("content_hash"))
+        and chunk.get("page_hash") and chunk["page_hash"] != manifest.page_hashes.get(chunk["url"])
+    ]
+
+    if upserts:
+        collection.upsert(
+            ids=[chunk["chunk_id"] for chunk in upserts],
+            documents=[chunk["content"] for chunk in upserts],
+            embeddings=[chunk["embedding"] for chunk in upserts],
+            metadatas=[chunk_metadata(chunk) for chunk in upserts],
+        )
+    if updates:
+        collection.update(
+            ids=[chunk["chunk_id"] for chunk in updates],
+            metadatas=[chunk_metadata(chunk) for chunk in updates],
+        )
+    return {"upserted": len(upserts), "updated": len(updates)}
+
+def delete_stale_chunks(
+    client: ClientAPI,
+    manifest: IngestionManifest,
+    current_ids: Set[str],
+    collection_name: str = "hmsreg_docs",
+    delete_missing: bool = True,
+) -> int:
+    """
+    Deletes the stored chunk ids that changed pages no longer produce (current_ids
+    holds every chunk id of the run) and, with delete_missing, the chunks of pages
+    the run didn't see at all. Returns the number of deleted chunks.
+    """
+    if delete_missing and not manifest.seen_urls:
+        # A run that saw no pages at all (e.g. the site was down) must not empty the index
+        logger.warning("No pages were seen in this run; keeping chunks of missing pages.")
+        delete_missing = False
+
+    stale_ids: Set[str] = set()
+    for url, chunk_ids in manifest.chunk_ids_by_url.items():
+        if url in manifest.unchanged_urls:
+            continue
+        if url in manifest.seen_urls or delete_missing:
+            stale_ids |= chunk_ids - current_ids
+    if stale_ids:
+        get_vector_store(client).get_collection(collection_name).delete(ids=sorted(stale_ids))
+    return len(stale_ids)
+
+def sync_chunks(
+    client: ClientAPI,
+    chunks: List[Dict[str, Any]],
+    manifest: IngestionManifest,
+    collection_name: str = "hmsreg_docs",
+    delete_missing: bool = True,
+) -> Dict[str, int]:
+    """
+    Applies an incremental ingestion run to the collection.
+
+    Chunks whose text changed are upserted with their embedding. Chunks whose
+    text is unchanged only get their metadata (e.g. a new page hash) updated. Chunk ids a
+    changed page no longer produces are deleted. With delete_missing, pages
+    the run didn't see at all are deleted too. When anything changed, the
+    collection's content version is bumped so cached answers are invalidated.
+
+    Returns counts of upserted, updated and deleted chunks.
+    """
+    counts = write_chunk_changes(client, chunks, manifest, collection_name)
+    counts["deleted"] = delete_stale_chunks(
+        client, manifest, {chunk["chunk_id"] for chunk in chunks}, collection_name, delete_missing
+    )
+    if any(counts.values()):
+        bump_content_version(client, collection_name)
+    logger.info(f"Incremental sync of '{collection_name}': {counts}")
+    return counts
+
+def bump_content_version(client: ClientAPI, collection_name: str = "hmsreg_docs") -> None:
+    """Records a new content version in the collection metadata (see get_collection_version)."""
+    collection = get_collection(client, collection_name)
+    metadata = dict(collection.metadata or {})
+    metadata["content_version"] = uuid.uuid4().hex
+    collection.modify(metadata=metadata)
+    get_vector_store(client).invalidate(collection_name)
+
+def chunks_needing_embedding(chunks: List[Dict[str, Any]], manifest: Optional[IngestionManifest]) -> List[Dict[str, Any]]:
+    """
+    The chunks that don't have an embedding yet and whose text changed (all of
+    them when manifest is None). Unchanged chunks keep an empty embedding, which
+    sync_chunks treats as a metadata-only update.
+    """
+    for chunk in chunks:
+        chunk.setdefault("embedding", [])
+    return [
+        chunk for chunk in chunks
+        if not chunk["embedding"]
+        and (manifest is None or manifest.needs_embedding(chunk["chunk_id"], chunk.get("content_hash")))
+    ]
+
+def embed_changed_chunks(chunks: List[Dict[str, Any]], manifest: Optional[IngestionManifest], embed) -> None:
+    """Fills in chunk['embedding'] for chunks_needing_embedding, calling embed(texts) once."""
+    changed = chunks_needing_embedding(chunks, manifest)
+    if not changed:
+        return
+    embeddings = embed([chunk["content"] for chunk in changed])
+    if len(embeddings) != len(changed):
+        logger.error(f"Mismatch between number of changed chunks ({len(changed)}) and embeddings ({len(embeddings)}). Skipping embeddings.")
+        return
+    for chunk, embedding in zip(changed, embeddings):
+        chunk["embedding"] = embedding
@@ -3,7 +3,7 @@ import os
 import sys
 import argparse
 from urllib.parse import urljoin, urlparse
-from typing import List, Dict, Optional, Set, Any
+from typing import List, Dict, Optional, Set, Any, Tuple
 import asyncio
 from pathlib import Path
 
@@ -12,18 +12,33 @@ backend_dir = Path(__file__).resolve().parent.parent.parent
 sys.path.insert(0, str(backend_dir))
 
 from playwright.sync_api import sync_playwright, Browser, Page # Playwright imports
-from bs4 import BeautifulSoup, Tag, Comment
+from bs4 import BeautifulSoup
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 import google.generativeai as genai
 from dotenv import load_dotenv
-import re # Added for regex operations
 import numpy as np # Added for semantic de-duplication
 
 # Import ChromaDB client
 import chromadb
 
 # Import add_chunks_to_collection from vector_store.py
-from app.rag.vector_store import add_chunks_to_collection
+from app.core.config import settings
+from app.rag.vector_store import add_chunks_to_collection, get_vector_store
+from app.rag.frontier import CrawlFrontier, canonicalize_url
+from app.rag.batch_embedder import BatchEmbedder
+from app.rag.browser_profile import BrowserProfile
+from app.rag.chunking import HEADING_PATH_SEPARATOR, Block, StructuredChunker
+from app.rag.corpus_dedup import CorpusDedupIndex
+from app.rag.crawl_cache import CrawlCache
+from app.rag.dedup import greedy_dedup
+from app.rag.embedding_cache import DocumentEmbeddingCache, SQLiteEmbeddingStore
+from app.rag.embeddings import GeminiEmbeddingClient
+from app.rag.extraction import MAIN_CONTENT_SELECTOR, available_parser, extract_content, extract_title
+from app.rag.fetcher import StaticFetcher, fetch_static
+from app.rag.incremental import (
+    IngestionManifest, bump_content_version, content_hash, delete_stale_chunks, embed_changed_chunks, page_hash,
+    write_chunk_changes,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +48,9 @@ load_dotenv()
 EMBEDDING_MODEL_NAME = "models/text-embedding-004"
 CHROMA_DB_PATH = "./chroma_data" # Local persistent storage for ChromaDB
 
+# Resolved (absolute) hrefs of every link on the page, evaluated in the browser
+ALL_HREFS_SCRIPT = "Array.from(document.querySelectorAll('a[href]')).map(a => a.href)"
+
 class HMSREGDocumentationScraper:
     """
     A scraper for HMSREG documentation, designed to extract article content
@@ -59,8 +77,10 @@ class HMSREGDocumentationScraper:
     def __init__(self, base_url: str, browser: Browser, chunk_size: int = 2000, chunk_overlap: int = 400, max_depth: int = 3):
         self.base_url = base_url
         self.visited_urls: Set[str] = set()
-        self.domain = urlparse(base_url).netloc
+        self.domain = urlparse(base_url).netloc.lower()
         self.browser = browser # Playwright browser instance
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -68,6 +88,14 @@ class HMSREGDocumentationScraper:
             is_separator_regex=False,
         )
         self.max_depth = max_depth # maximum crawling depth
+        self.chunker: Optional[StructuredChunker] = None # Set to chunk by structure and tokens instead of text_splitter
+        self.manifest: Optional[IngestionManifest] = None # Set for incremental ingestion
+        self.corpus_index: Optional[CorpusDedupIndex] = None # Set to de-duplicate chunks across pages
+        self.defer_embedding = False # Set when a BatchEmbedder embeds the missing chunks after the crawl
+        self.embedding_cache: Optional[DocumentEmbeddingCache] = None # Set to reuse embeddings of unchanged chunk text
+        self.static_fetch = False # Set to check the site with a plain HTTP request before starting a browser
+        self.profile: Optional[BrowserProfile] = None # Set to load pages in one resource-blocking context
+        self._context = None # The profile's context, created on first use
 
         api_key = os.getenv("GOOGLE_API_KEY")
         if api_key is None:
@@ -78,22 +106,36 @@ class HMSREGDocumentationScraper:
             self.has_api_key = True
 
 
+    def chunker_signature(self) -> str:
+        """
+        Identifies how pages are split into chunks. It is part of the page hash
+        and stored with every chunk, so changing the chunker or its sizes
+        re-chunks every page in the next incremental ingestion.
+        """
+        if self.chunker is not None:
+            return f"structured:{self.chunker.max_tokens}/{self.chunker.min_tokens}/{self.chunker.overlap_tokens}"
+        return f"character:{self.chunk_size}/{self.chunk_overlap}"
+
     def _is_internal_link(self, url: str) -> bool:
         """Checks if a URL belongs to the same domain as the base_url."""
         return urlparse(url).netloc == self.domain
 
     def _get_absolute_url(self, href: str) -> Optional[str]:
         """Converts a relative URL to an absolute URL and filters for internal links."""
-        absolute_url = urljoin(self.base_url, href)
-        parsed_url = urlparse(absolute_url)
-        clean_url = parsed_url.scheme + "://" + parsed_url.netloc + parsed_url.path
-        if parsed_url.query:
-            clean_url += "?" + parsed_url.query
+        clean_url = canonicalize_url(urljoin(self.base_url, href))
 
         if self._is_internal_link(clean_url):
             return clean_url
         return None
 
+    def _new_page(self) -> Page:
+        """Opens a page; with a profile, in one reused context that blocks unneeded resources."""
+        if self.profile is None:
+            return self.browser.new_page()
+        if self._context is None or self._context.browser is not self.browser:
+            self._context = self.profile.new_context_sync(self.browser)
+        return self._context.new_page()
+
     def _fetch_page(self, url: str) -> Optional[Page]: # Returns Playwright Page object
         """Fetches a page using Playwright and returns a Page object if successful."""
         if url in self.visited_urls:
@@ -104,11 +146,11 @@ class HMSREGDocumentationScraper:
 
         page = None
         try:
-            page = self.browser.new_page()
-            page.goto(url, wait_until="domcontentloaded")
+            page = self._new_page()
+            page.goto(url, wait_until=settings.INGEST_BROWSER_WAIT_UNTIL)
             # Explicitly wait for the main content div to appear
             # Use the specific selector identified: div[data-object-id="dsProcedure"]
-            page.wait_for_selector('div[data-object-id="dsProcedure"]', state='visible', timeout=10000)
+            page.wait_for_selector('div[data-object-id="dsProcedure"]', state='visible', timeout=settings.INGEST_BROWSER_TIMEOUT_MS)
             
             return page
         except Exception as e:
@@ -122,99 +164,45 @@ class HMSREGDocumentationScraper:
         Extracts the article title from h1/h2 tags in the page.
         Returns None if no suitable title is found.
         """
-        main_content_locator = page.locator('div[data-object-id="dsProcedure"].content')
-        if main_content_locator.count() > 0:
-            html_content = main_content_locator.first.inner_html()
-            soup = BeautifulSoup(html_content, 'html.parser')
-
-            # Try to find h1 or h2 tag for the title
-            title_tag = soup.find(['h1', 'h2'])
-            if title_tag:
-                title = title_tag.get_text(strip=True)
-                if title:
-                    logger.debug(f"Extracted title from content: {title}")
-                    return title
-
-        # Fallback: try to find h1/h2 in the whole body
-        body_content_html = page.locator('body').inner_html(timeout=1000)
-        if body_content_html:
-            soup = BeautifulSoup(body_content_html, 'html.parser')
-            title_tag = soup.find(['h1', 'h2'])
-            if title_tag:
-                title = title_tag.get_text(strip=True)
-                if title:
-                    logger.debug(f"Extracted title from body: {title}")
-                    return title
-
-        logger.debug("No title found in h1/h2 tags")
-        return None
+        return self._extract_title_from_html(page.content())
 
     def _extract_article_content(self, page: Page) -> Optional[str]: # Takes Playwright Page object
         """
         Extracts the main article content from a Playwright Page object.
         """
-        main_content_locator = page.locator('div[data-object-id="dsProcedure"].content')
-        if main_content_locator.count() > 0:
-            html_content = main_content_locator.first.inner_html()
-            soup = BeautifulSoup(html_content, 'html.parser')
-
-            # Remove specific boilerplate/navigation elements
-            for selector in ['header', 'footer', 'nav', 'script', 'style', '.skip-link', '.breadcrumb']:
-                for tag in soup.find_all(selector):
-                    tag.decompose()
-
-            # Remove comments
-            for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-                comment.extract()
-
-            # Remove any remaining unwanted tags like empty spans or divs that are not structural
-            for unwanted_tag in soup.find_all(['span', 'div'], class_=False, id=False):
-                if not unwanted_tag.get_text(strip=True): # Remove empty or whitespace-only tags
-                    unwanted_tag.decompose()
-
-            text_content = soup.get_text(separator=' ', strip=True) # Use space separator to avoid word concatenation
-            text_content = re.sub(r'\s+', ' ', text_content).strip() # Normalize whitespace
-
-            if len(text_content) > 50:
-                logger.debug(f"Extracted content from div[data-object-id='dsProcedure'] (length: {len(text_content)}).")
-                return text_content
-            else:
-                logger.debug(f"Div[dsProcedure] content too short (length: {len(text_content)}).")
-
-        # Fallback to body content if specific div is not sufficient, with similar cleaning
-        body_content_html = page.locator('body').inner_html(timeout=1000)
-        if body_content_html:
-            soup = BeautifulSoup(body_content_html, 'html.parser')
-            for selector in ['header', 'footer', 'nav', 'script', 'style', '.skip-link', '.breadcrumb']:
-                for tag in soup.find_all(selector):
-                    tag.decompose()
-            for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-                comment.extract()
-            for unwanted_tag in soup.find_all(['span', 'div'], class_=False, id=False):
-                if not unwanted_tag.get_text(strip=True):
-                    unwanted_tag.decompose()
-
-            text_content = soup.get_text(separator=' ', strip=True)
-            text_content = re.sub(r'\s+', ' ', text_content).strip()
-
-            if len(text_content) > 50:
-                logger.debug(f"Extracted content from body fallback (length: {len(text_content)}).")
-                return text_content
-
-        logger.debug(f"No significant content extracted by any selector.")
-        return None
+        return self._extract_content_from_html(page.content())
+
+    @staticmethod
+    def _extract_title_from_html(html: str) -> Optional[str]:
+        """
+        Extracts the article title from h1/h2 tags in a page's HTML,
+        preferring the main content div over the rest of the body.
+        Returns None if no suitable title is found.
+        """
+        return extract_title(BeautifulSoup(html, available_parser(settings.INGEST_HTML_PARSER)))
+
+    @staticmethod
+    def _extract_content_from_html(html: str) -> Optional[str]:
+        """
+        Extracts the main article content from a page's HTML.
+        Falls back to the whole body if the main content div is missing or too short.
+        """
+        return extract_content(BeautifulSoup(html, available_parser(settings.INGEST_HTML_PARSER)))
 
     def _parse_links(self, page: Page) -> List[str]: # Takes Playwright Page object
         """Extracts all unique, internal links from a Playwright Page object."""
-        links = []
-        all_hrefs = page.evaluate("Array.from(document.querySelectorAll('a[href]')).map(a => a.href)")
+        all_hrefs = page.evaluate(ALL_HREFS_SCRIPT)
         logger.debug(f"Found {len(all_hrefs)} raw hrefs via Playwright: {all_hrefs}")
+        return self._filter_links(all_hrefs)
 
+    def _filter_links(self, all_hrefs: List[str]) -> List[str]:
+        """Resolves hrefs and keeps the unique internal links that haven't been visited."""
+        links = []
         for href in all_hrefs:
             absolute_url = self._get_absolute_url(href)
             if absolute_url and absolute_url not in self.visited_urls:
                 links.append(absolute_url)
-        unique_links = list(set(links))
+        unique_links = list(dict.fromkeys(links)) # Keep page order so crawls are deterministic
         logger.debug(f"Found {len(unique_links)} unique internal links: {unique_links}")
         return unique_links
 
@@ -224,56 +212,77 @@ class HMSREGDocumentationScraper:
         Splits a given text into chunks using the configured text splitter
         and performs semantic de-duplication on the generated chunks.
         """
+        return [chunk for chunk, _ in self._split_text_with_embeddings(text)]
+
+    def _split_text_with_embeddings(self, text: str) -> List[Tuple[str, List[float]]]:
+        """
+        Splits a given text into chunks, performs semantic de-duplication and returns
+        (chunk, embedding) pairs. The embeddings computed for de-duplication are kept,
+        so they can be stored without embedding the chunks a second time. Embeddings
+        are empty lists when they couldn't be computed.
+        """
         initial_chunks = self.text_splitter.split_text(text)
-        
+        return [(initial_chunks[i], embedding) for i, embedding in self._dedup_chunks(initial_chunks)]
+
+    def _dedup_chunks(
+        self, initial_chunks: List[str], embeddings: Optional[List[List[float]]] = None
+    ) -> List[Tuple[int, List[float]]]:
+        """
+        Semantic de-duplication of a page's chunks: returns the positions of the
+        chunks to keep with their embeddings (empty lists when they couldn't be computed).
+
+        Pass embeddings to de-duplicate with embeddings computed elsewhere (such as
+        a BatchEmbedder); chunks whose embedding is empty are kept as they are.
+        """
         # --- Semantic De-duplication ---
         SIMILARITY_THRESHOLD = 0.95  # Tune this value as needed
-        unique_chunks = []
 
         if not initial_chunks:
             return []
         
-        if not self.has_api_key:
+        if embeddings is None and not self.has_api_key:
             logger.warning("GOOGLE_API_KEY is not set. Skipping semantic de-duplication.")
-            return initial_chunks
+            return [(i, []) for i in range(len(initial_chunks))]
 
         try:
             # Generate embeddings for all initial chunks
-            all_chunk_embeddings_response = genai.embed_content(
-                model=EMBEDDING_MODEL_NAME,
-                content=initial_chunks,
-                task_type="retrieval_document"
-            )
-            all_chunk_embeddings = all_chunk_embeddings_response["embedding"]
-
-            if not all_chunk_embeddings:
-                logger.warning("No embeddings generated for initial chunks. Skipping semantic de-duplication.")
-                return initial_chunks
+            all_chunk_embeddings = self._embed_documents(initial_chunks) if embeddings is None else embeddings
 
-            # Add the first chunk unconditionally
-            unique_chunks.append(initial_chunks[0])
-            unique_chunk_embeddings = [all_chunk_embeddings[0]]
+            if not all_chunk_embeddings or len(all_chunk_embeddings) != len(initial_chunks):
+                logger.warning("No embeddings generated for initial chunks. Skipping semantic de-duplication.")
+                return [(i, []) for i in range(len(initial_chunks))]
 
-            for i in range(1, len(initial_chunks)):
-                current_chunk = initial_chunks[i]
-                current_embedding = all_chunk_embeddings[i]
-                
-                is_duplicate = False
-                for unique_embedding in unique_chunk_embeddings:
-                    similarity = self.calculate_cosine_similarity(current_embedding, unique_embedding)
-                    if similarity > SIMILARITY_THRESHOLD:
-                        is_duplicate = True
-                        break
-                
-                if not is_duplicate:
-                    unique_chunks.append(current_chunk)
-                    unique_chunk_embeddings.append(current_embedding)
+            embedded = [i for i, embedding in enumerate(all_chunk_embeddings) if embedding]
+            keep = {embedded[j] for j in greedy_dedup([all_chunk_embeddings[i] for i in embedded], SIMILARITY_THRESHOLD)}
+            unique = [(i, all_chunk_embeddings[i]) for i in range(len(initial_chunks)) if i in keep or not all_chunk_embeddings[i]]
             
-            logger.info(f"De-duplicated chunks: {len(initial_chunks)} initial, {len(unique_chunks)} unique.")
-            return unique_chunks
+            logger.info(f"De-duplicated chunks: {len(initial_chunks)} initial, {len(unique)} unique.")
+            return unique
         except Exception as e:
             logger.error(f"Error during semantic de-duplication: {e}. Returning all initial chunks.")
-            return initial_chunks
+            return [(i, []) for i in range(len(initial_chunks))]
+
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds texts with genai calls of at most INGEST_EMBEDDING_BATCH_SIZE texts,
+        skipping texts already in the embedding cache. Used without a BatchEmbedder
+        (scrape_site, or an AsyncCrawler without one); it has no rate limit or retries.
+        """
+        def embed(texts: List[str]) -> List[List[float]]:
+            embeddings: List[List[float]] = []
+            batch_size = settings.INGEST_EMBEDDING_BATCH_SIZE
+            for start in range(0, len(texts), batch_size):
+                result = genai.embed_content(
+                    model=EMBEDDING_MODEL_NAME,
+                    content=texts[start:start + batch_size],
+                    task_type="retrieval_document"
+                )
+                embeddings.extend(result.get('embedding', []))
+            return embeddings
+
+        if self.embedding_cache is None:
+            return embed(texts)
+        return self.embedding_cache.embed(texts, embed)
 
     def _get_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Generates embeddings for a list of text chunks."""
@@ -282,14 +291,7 @@ class HMSREGDocumentationScraper:
             return [[] for _ in texts]
 
         try:
-            result = genai.embed_content(
-                model=EMBEDDING_MODEL_NAME,
-                content=texts,
-                task_type="retrieval_document"
-            )
-            
-            embeddings = result.get('embedding', [])
-            
+            embeddings = self._embed_documents(texts)
             logger.info(f"Generated embeddings for {len(texts)} chunks.")
             return embeddings
         except Exception as e:
@@ -303,11 +305,15 @@ class HMSREGDocumentationScraper:
         This checks if key elements (e.g., a main article tag or body) are present on the base page.
         """
         logger.info(f"Performing health check on {self.base_url}")
+        if self.static_fetch and fetch_static(self.base_url, 'div[data-object-id="dsProcedure"]') is not None:
+            # The content div is already in the server-rendered HTML; no browser needed
+            logger.info(f"Health check result for {self.base_url}: reachable=True, structure_ok=True (static HTML)")
+            return {"site_reachable": True, "structure_ok": True}
         page = None
         try:
-            page = self.browser.new_page()
-            page.goto(self.base_url, wait_until="domcontentloaded")
-            page.wait_for_selector('div[data-object-id="dsProcedure"]', state='visible', timeout=10000)
+            page = self._new_page()
+            page.goto(self.base_url, wait_until=settings.INGEST_BROWSER_WAIT_UNTIL)
+            page.wait_for_selector('div[data-object-id="dsProcedure"]', state='visible', timeout=settings.INGEST_BROWSER_TIMEOUT_MS)
             
             site_reachable = True
             
@@ -329,26 +335,123 @@ class HMSREGDocumentationScraper:
             if page:
                 page.close()
 
-    def scrape_site(self, start_url: Optional[str] = None) -> List[Dict[str, Any]]:
+    def _build_chunks(self, url: str, title: str, content: str, blocks: Optional[List[Block]] = None) -> List[Dict[str, Any]]:
+        """
+        Splits a page's content into chunks, embeds them and returns the chunk dicts
+        stored in ChromaDB (url, title, chunk_id, content, embedding and content hashes).
+
+        With a chunker set, the page's blocks (see extract_blocks; the content as
+        one block if not given) are chunked by structure and tokens, and chunks
+        under headings get a 'heading_path'.
+
+        With a manifest set (incremental ingestion), unchanged pages are skipped
+        before splitting and only chunks whose text changed are embedded. With a
+        corpus_index set, chunks that duplicate a chunk of an earlier processed
+        page are dropped and recorded on that chunk instead.
+
+        The AsyncCrawler runs the same steps (_split_page, _dedup_chunks and
+        _assemble_chunks) with the de-duplication embeddings from a BatchEmbedder.
+        """
+        split = self._split_page(url, title, content, blocks)
+        if split is None:
+            return []
+        current_page_hash, texts, heading_paths = split
+        # The de-duplication embeddings are reused for storage
+        kept = self._dedup_chunks(texts)
+        return self._assemble_chunks(url, title, current_page_hash, texts, heading_paths, kept)
+
+    def _split_page(
+        self, url: str, title: str, content: str, blocks: Optional[List[Block]] = None
+    ) -> Optional[Tuple[str, List[str], List[str]]]:
+        """
+        Returns the page hash, the chunk texts and their heading paths ('' when
+        not under a heading), or None if the page is unchanged since the last ingestion.
+        """
+        current_page_hash = page_hash(title, content, self.chunker_signature())
+        if self.manifest is not None and self.manifest.is_page_unchanged(url, current_page_hash):
+            logger.info(f"Unchanged since last ingestion, skipping: {url}")
+            return None
+
+        logger.debug(f"Extracted content (snippet): {content[:200]}...")
+        if self.chunker is not None:
+            pieces = self.chunker.split(blocks or [(0, content)])
+            texts = [piece.text for piece in pieces]
+            heading_paths = [HEADING_PATH_SEPARATOR.join(piece.heading_path) for piece in pieces]
+        else:
+            texts = self.text_splitter.split_text(content)
+            heading_paths = [""] * len(texts)
+        return current_page_hash, texts, heading_paths
+
+    def _assemble_chunks(
+        self,
+        url: str,
+        title: str,
+        current_page_hash: str,
+        texts: List[str],
+        heading_paths: List[str],
+        kept: List[Tuple[int, List[float]]],
+    ) -> List[Dict[str, Any]]:
+        """Builds the chunk dicts of the kept (position, embedding) chunks; see _build_chunks."""
+        logger.info(f"Split content from {url} into {len(kept)} chunks.")
+        if not kept:
+            return []
+
+        chunk_dicts = [
+            {
+                "url": url,
+                "title": title, # Use the more specific article title
+                "chunk_id": f"{url}#{i}",
+                "content": texts[position],
+                "content_hash": content_hash(texts[position]),
+                "page_hash": current_page_hash,
+                "chunker": self.chunker_signature(),
+                "embedding": embedding,
+            }
+            for i, (position, embedding) in enumerate(kept)
+        ]
+        for chunk, (position, _) in zip(chunk_dicts, kept):
+            if heading_paths[position]:
+                chunk["heading_path"] = heading_paths[position]
+        # Only chunks left without an embedding (de-duplication skipped or failed) are embedded here,
+        # unless a later batch embedding stage takes care of them
+        if not self.defer_embedding:
+            embed_changed_chunks(chunk_dicts, self.manifest, self._get_embeddings)
+        if self.corpus_index is not None:
+            unique = self.corpus_index.filter(chunk_dicts)
+            if len(unique) < len(chunk_dicts):
+                logger.info(f"Dropped {len(chunk_dicts) - len(unique)} chunks of {url} that duplicate chunks of other pages.")
+            chunk_dicts = unique
+        return chunk_dicts
+
+    def scrape_site(
+        self,
+        start_url: Optional[str] = None,
+        frontier: Optional[CrawlFrontier] = None,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_every: int = 25,
+    ) -> List[Dict[str, Any]]:
         """
         Scrapes the documentation site starting from the base_url or a specified start_url.
         Recursively follows internal links to collect all article content, then splits it into chunks and generates embeddings.
+
+        Pass a frontier restored with CrawlFrontier.load to resume an interrupted crawl;
+        with checkpoint_path set, the frontier is saved there every checkpoint_every pages.
+        Only the chunks of pages processed in this call are returned.
         """
         if start_url is None:
             start_url = self.base_url
 
-        # Store (url, depth) tuples
-        to_visit = [(start_url, 0)]
+        if frontier is None:
+            frontier = CrawlFrontier(max_depth=self.max_depth)
+        frontier.add(start_url, 0) # No-op when resuming, the start URL was seen already
         all_processed_chunks: List[Dict[str, Any]] = []
+        pages_since_checkpoint = 0
 
-        while to_visit:
-            current_url, current_depth = to_visit.pop(0)
-
-            if current_depth > self.max_depth:
-                logger.info(f"Skipping {current_url} due to max depth ({self.max_depth}) reached.")
-                continue
+        while frontier:
+            current_url, current_depth = frontier.pop()
 
             if current_url in self.visited_urls:
+                frontier.mark_done(current_url)
                 continue
             
             page = self._fetch_page(current_url)
@@ -361,25 +464,7 @@ class HMSREGDocumentationScraper:
                 content = self._extract_article_content(page)
 
                 if content:
-                    logger.debug(f"Extracted content (snippet): {content[:200]}...")
-                    chunks = self._split_text(content)
-                    logger.info(f"Split content from {current_url} into {len(chunks)} chunks.")
-
-                    if chunks:
-                        embeddings = self._get_embeddings(chunks)
-                        if len(embeddings) != len(chunks):
-                            logger.error(f"Mismatch between number of chunks ({len(chunks)}) and embeddings ({len(embeddings)}) for {current_url}. Skipping embeddings.")
-                            embeddings = [[] for _ in chunks]
-                        
-                        for i, chunk in enumerate(chunks):
-                            chunk_embedding = embeddings[i] if embeddings and i < len(embeddings) else []
-                            all_processed_chunks.append({
-                                "url": current_url,
-                                "title": article_title, # Use the more specific article title
-                                "chunk_id": f"{current_url}#{i}",
-                                "content": chunk,
-                                "embedding": chunk_embedding,
-                            })
+                    all_processed_chunks.extend(self._build_chunks(current_url, article_title, content))
                 else:
                     logger.warning(f"No significant content extracted from: {current_url}")
 
@@ -388,14 +473,22 @@ class HMSREGDocumentationScraper:
                     logger.debug(f"Found {len(new_links)} new links on {current_url}: {new_links}")
                 else:
                     logger.debug(f"No new links found on {current_url}.")
-                for link in new_links:
-                    if link not in self.visited_urls and link not in [item[0] for item in to_visit]:
-                        to_visit.append((link, current_depth + 1))
+                frontier.add_many(new_links, current_depth + 1)
                 
                 page.close()
             else:
                 logger.error(f"Failed to fetch or parse: {current_url}")
 
+            frontier.mark_done(current_url)
+            pages_since_checkpoint += 1
+            if checkpoint_path and pages_since_checkpoint >= checkpoint_every:
+                frontier.save(checkpoint_path)
+                pages_since_checkpoint = 0
+
+        if checkpoint_path:
+            frontier.save(checkpoint_path)
+        if self.corpus_index is not None:
+            self.corpus_index.apply_source_urls(all_processed_chunks)
         return all_processed_chunks
 
 if __name__ == "__main__":
@@ -410,6 +503,38 @@ if __name__ == "__main__":
                         help="Name of the ChromaDB collection.")
     parser.add_argument("--max_depth", type=int, default=3,
                         help="Maximum depth for crawling links. Default is 3.")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Number of pages loaded concurrently. Default is 4.")
+    parser.add_argument("--contexts", type=int, default=2,
+                        help="Number of browser contexts the page pool is spread over. Default is 2.")
+    parser.add_argument("--per_host_concurrency", type=int, default=4,
+                        help="Maximum concurrent requests to a single host. Default is 4.")
+    parser.add_argument("--per_host_delay", type=float, default=0.0,
+                        help="Minimum seconds between request starts to a single host. Default is 0.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-embed changed pages and upsert them instead of rebuilding the collection.")
+    parser.add_argument("--keep_missing", action="store_true",
+                        help="With --incremental, keep chunks of pages that weren't seen in this run.")
+    parser.add_argument("--no_corpus_dedup", action="store_true",
+                        help="Keep chunks that are near-duplicates of chunks on other pages instead of merging them.")
+    parser.add_argument("--no_embedding_cache", action="store_true",
+                        help="Embed every chunk again instead of reusing embeddings of identical chunk text.")
+    parser.add_argument("--flush_size", type=int, default=settings.INGEST_FLUSH_SIZE,
+                        help=f"Number of chunks written to ChromaDB at a time. Default is {settings.INGEST_FLUSH_SIZE}.")
+    parser.add_argument("--extract_workers", type=int, default=settings.INGEST_EXTRACT_WORKERS,
+                        help=f"Processes that extract text from page HTML (0 uses a thread). Default is {settings.INGEST_EXTRACT_WORKERS}.")
+    parser.add_argument("--checkpoint", type=str,
+                        help="Path of a checkpoint file saved after every flush; an interrupted run resumes from it.")
+    parser.add_argument("--no_static_fetch", action="store_true",
+                        help="Render every page with Playwright instead of first trying a plain HTTP request.")
+    parser.add_argument("--no_crawl_cache", action="store_true",
+                        help="Don't snapshot crawled pages or send conditional requests for them.")
+    parser.add_argument("--from_cache", action="store_true",
+                        help="Replay the crawl offline from the crawl cache's snapshots (every cached page unless --urls_file is given).")
+    parser.add_argument("--no_resource_blocking", action="store_true",
+                        help="Let the browser load images, fonts and trackers, and never replace its pages.")
+    parser.add_argument("--chunker", choices=["structured", "character"], default=settings.INGEST_CHUNKER,
+                        help=f"Chunk by headings and tokens (structured) or with the 2000/400 character splitter. Default is {settings.INGEST_CHUNKER}.")
     parser.add_argument("--urls_file", type=str,
                         help="Path to a file containing a list of URLs to scrape, one per line. If provided, base_url and max_depth are ignored.")
     args = parser.parse_args()
@@ -670,80 +795,172 @@ if __name__ == "__main__":
         ]
         
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch() 
-        try:
-            # Initialize scraper with the first URL as base_url, but process DEBUG_URLS directly
-            scraper = HMSREGDocumentationScraper(args.base_url, browser=browser, max_depth=args.max_depth)
-
-            # Health check on the first URL if not using a urls_file
-            if not args.urls_file:
+    crawl_cache = None
+    if settings.INGEST_CRAWL_CACHE_PATH and (args.from_cache or not args.no_crawl_cache):
+        crawl_cache = CrawlCache(settings.INGEST_CRAWL_CACHE_PATH)
+    if args.from_cache:
+        if crawl_cache is None:
+            logger.error("--from_cache needs INGEST_CRAWL_CACHE_PATH to be set. Aborting.")
+            exit(1)
+        if not args.urls_file:
+            urls_to_scrape = crawl_cache.urls()
+        logger.info(f"Replaying {len(urls_to_scrape)} pages from the crawl cache at {crawl_cache.path}.")
+
+    # Initialize scraper with the first URL as base_url, but process the URL list directly
+    scraper = HMSREGDocumentationScraper(args.base_url, browser=None, max_depth=args.max_depth)
+    scraper.static_fetch = settings.INGEST_STATIC_FETCH and not args.no_static_fetch
+    if not args.no_resource_blocking:
+        scraper.profile = BrowserProfile()
+    if args.chunker == "structured":
+        scraper.chunker = StructuredChunker()
+
+    # Health check on the first URL if not using a urls_file
+    if not args.urls_file and not args.from_cache:
+        with sync_playwright() as p:
+            scraper.browser = p.chromium.launch()
+            try:
                 health_status = scraper.health_check()
-                if not health_status["site_reachable"] or not health_status["structure_ok"]:
-                    logger.error("Site not reachable or structure not as expected. Aborting ingestion.")
-                    exit(1)
-
-            logger.info(f"Starting to scrape {len(urls_to_scrape)} URLs...")
-            all_processed_chunks_for_db: List[Dict[str, Any]] = []
-
-            for url_to_process in urls_to_scrape:
-                page = scraper._fetch_page(url_to_process)
-                if page:
-                    # Extract title from h1/h2 tags, fallback to page title
-                    article_title = scraper._extract_article_title(page)
-                    if not article_title:
-                        article_title = page.title() if page.title() else "No Title"
-
-                    content = scraper._extract_article_content(page)
-
-                    if content:
-                        logger.debug(f"Extracted content (snippet): {content[:200]}...")
-                        chunks = scraper._split_text(content) # This now includes semantic de-duplication
-                        logger.info(f"Split content from {url_to_process} into {len(chunks)} chunks.")
-
-                        if chunks:
-                            embeddings = scraper._get_embeddings(chunks)
-                            if len(embeddings) != len(chunks):
-                                logger.error(f"Mismatch between number of chunks ({len(chunks)}) and embeddings ({len(embeddings)}) for {url_to_process}. Skipping embeddings.")
-                                embeddings = [[] for _ in chunks]
-                            
-                            for i, chunk in enumerate(chunks):
-                                chunk_embedding = embeddings[i] if embeddings and i < len(embeddings) else []
-                                all_processed_chunks_for_db.append({
-                                    "url": url_to_process,
-                                    "title": article_title, 
-                                    "chunk_id": f"{url_to_process}#{i}",
-                                    "content": chunk,
-                                    "embedding": chunk_embedding,
-                                })
-                    else:
-                        logger.warning(f"No significant content extracted from: {url_to_process}")
-                    
-                    page.close() # Close page after processing
-                else:
-                    logger.error(f"Failed to fetch or parse: {url_to_process}")
-
-
-            if all_processed_chunks_for_db:
-                logger.info(f"Scraped, chunked, and embedded {len(all_processed_chunks_for_db)} total chunks for DB ingestion.")
-
-                chroma_client = chromadb.PersistentClient(path=args.chroma_path)
-                logger.info(f"ChromaDB client initialized with persistent path: {args.chroma_path}")
+            finally:
+                scraper.browser.close()
+                scraper.browser = None
+        if not health_status["site_reachable"] or not health_status["structure_ok"]:
+            logger.error("Site not reachable or structure not as expected. Aborting ingestion.")
+            exit(1)
 
-                # Delete old collection to avoid duplicates
-                try:
-                    chroma_client.delete_collection(name=args.collection_name)
-                    logger.info(f"Deleted old ChromaDB collection: {args.collection_name}")
-                except Exception as e:
-                    logger.info(f"No existing collection to delete (this is fine): {e}")
+    chroma_client = chromadb.PersistentClient(path=args.chroma_path)
+    logger.info(f"ChromaDB client initialized with persistent path: {args.chroma_path}")
+    if args.incremental:
+        scraper.manifest = IngestionManifest.from_collection(chroma_client, args.collection_name)
+    if not args.no_corpus_dedup:
+        scraper.corpus_index = CorpusDedupIndex()
+    scraper.defer_embedding = True # Embedded in batches across pages below
+    embedding_store = None
+    if settings.INGEST_EMBEDDING_CACHE_PATH and not args.no_embedding_cache:
+        embedding_store = SQLiteEmbeddingStore(settings.INGEST_EMBEDDING_CACHE_PATH)
+        scraper.embedding_cache = DocumentEmbeddingCache(embedding_store, EMBEDDING_MODEL_NAME)
+
+    from playwright.async_api import async_playwright
+    from app.rag.crawler import AsyncCrawler
+    from app.rag.extraction import HTMLExtractor
+    from app.rag.pipeline import IngestionPipeline
+
+    store = get_vector_store(chroma_client)
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        frontier = CrawlFrontier.load(args.checkpoint)
+        logger.info(f"Resuming from checkpoint {args.checkpoint}: {len(frontier.done)} pages already stored.")
+    else:
+        frontier = CrawlFrontier(max_depth=0) # Only the listed URLs, as before
 
-                add_chunks_to_collection(
-                    client=chroma_client,
-                    chunks=all_processed_chunks_for_db,
-                    collection_name=args.collection_name
+    if args.incremental:
+        # Changed chunks are upserted as they come; the collection stays queryable throughout
+        target_collection = args.collection_name
+        def write(chunks: List[Dict[str, Any]]) -> Dict[str, int]:
+            return write_chunk_changes(chroma_client, chunks, scraper.manifest, target_collection)
+    else:
+        # Build into a new collection version and flip the alias once it's complete,
+        # so the API keeps serving the previous version during the rebuild. A resumed
+        # run continues the version it started.
+        target_collection = frontier.metadata.get("collection") or store.create_versioned_collection(args.collection_name).name
+        frontier.metadata["collection"] = target_collection
+        logger.info(f"Building ChromaDB collection version: {target_collection}")
+        def write(chunks: List[Dict[str, Any]]) -> Dict[str, int]:
+            added = add_chunks_to_collection(chroma_client, chunks, target_collection)
+            if not added and any(chunk.get("embedding") for chunk in chunks):
+                # Stop instead of marking these pages done; a resumed run retries them
+                raise RuntimeError(f"Writing {len(chunks)} chunks to {target_collection} failed.")
+            return {"added": added}
+
+    if scraper.corpus_index is not None and frontier.done:
+        # Finished pages aren't processed again; later pages must still be de-duplicated against their chunks
+        restored = scraper.corpus_index.restore(
+            chroma_client, target_collection, frontier.done, frontier.metadata.get("source_urls"),
+        )
+        logger.info(f"Restored {restored} chunks of {len(frontier.done)} finished pages into the de-duplication index.")
+
+    async def run_pipeline() -> Dict[str, int]:
+        embedding_client = GeminiEmbeddingClient(model=EMBEDDING_MODEL_NAME)
+        # One embedder for the de-duplication embeddings and the rest, so one rate limit covers every request
+        embedder = BatchEmbedder(embedding_client, cache=scraper.embedding_cache)
+        extractor = HTMLExtractor(max_workers=args.extract_workers)
+        static_fetcher = StaticFetcher(cache=crawl_cache) if scraper.static_fetch and not args.from_cache else None
+        async with async_playwright() as p:
+            browser = None if args.from_cache else await p.chromium.launch()
+            try:
+                crawler = AsyncCrawler(
+                    scraper,
+                    browser,
+                    concurrency=args.concurrency,
+                    contexts=args.contexts,
+                    per_host_concurrency=args.per_host_concurrency,
+                    per_host_delay=args.per_host_delay,
+                    extractor=extractor,
+                    static_fetcher=static_fetcher,
+                    crawl_cache=crawl_cache,
+                    from_cache=args.from_cache,
+                    profile=scraper.profile,
+                    embedder=embedder,
                 )
-                logger.info("Ingestion process completed successfully for DEBUG_URLS.")
-            else:
-                logger.warning("No chunks were processed or generated from DEBUG_URLS. ChromaDB not updated. This could mean no content was extracted or no links were found on the starting page.")
-        finally:
-            browser.close()
+                pipeline = IngestionPipeline(
+                    crawler,
+                    embedder,
+                    write,
+                    manifest=scraper.manifest,
+                    flush_size=args.flush_size,
+                    checkpoint_path=args.checkpoint,
+                )
+                counts = await pipeline.run(urls_to_scrape, max_depth=0, frontier=frontier)
+                if static_fetcher is not None:
+                    logger.info(f"Static fetch: {dict(static_fetcher.stats)}")
+                if scraper.profile is not None:
+                    logger.info(f"Browser requests: {dict(scraper.profile.stats)}")
+                if args.incremental:
+                    counts["deleted"] = delete_stale_chunks(
+                        chroma_client,
+                        scraper.manifest,
+                        pipeline.chunk_ids,
+                        collection_name=target_collection,
+                        delete_missing=not args.keep_missing,
+                    )
+                return counts
+            finally:
+                if browser is not None:
+                    await browser.close()
+                embedding_client.close()
+                extractor.close()
+                if static_fetcher is not None:
+                    await static_fetcher.aclose()
+
+    logger.info(f"Starting to scrape {len(urls_to_scrape)} URLs with {args.concurrency} concurrent pages...")
+    try:
+        counts = asyncio.run(run_pipeline())
+    except BaseException:
+        if not args.incremental and not args.checkpoint:
+            # Nothing can resume this build, so don't leave a copy of the index behind
+            store.delete_collection(target_collection)
+        raise
+    finally:
+        if crawl_cache is not None:
+            crawl_cache.close()
+        if embedding_store is not None:
+            logger.info(f"Embedding cache: {scraper.embedding_cache.hits} hits, {scraper.embedding_cache.misses} misses.")
+            embedding_store.close()
+    if counts.get("missing_embeddings"):
+        logger.error(f"{counts['missing_embeddings']} chunks could not be embedded and are not stored in this run.")
+    if scraper.corpus_index is not None:
+        logger.info(f"Cross-page de-duplication dropped {scraper.corpus_index.dropped} chunks.")
+        scraper.corpus_index.update_source_urls(chroma_client, target_collection)
+
+    if args.incremental:
+        if counts.get("upserted") or counts.get("updated") or counts.get("deleted"):
+            bump_content_version(chroma_client, target_collection)
+        logger.info(f"Incremental ingestion completed: {len(scraper.manifest.unchanged_urls)} pages unchanged, {counts}.")
+    elif counts.get("added"):
+        store.swap_alias(args.collection_name, target_collection)
+        logger.info(f"Collection alias '{args.collection_name}' now points to {target_collection}: {counts}.")
+        logger.info("Ingestion process completed successfully for DEBUG_URLS.")
+    else:
+        store.delete_collection(target_collection)
+        logger.warning("No chunks were processed or generated from DEBUG_URLS. ChromaDB not updated. This could mean no content was extracted or no links were found on the starting page.")
+        exit(1)
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint) # The run is complete; the next one starts fresh
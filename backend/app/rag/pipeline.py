@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.rag.batch_embedder import BatchEmbedder
+from app.rag.crawler import AsyncCrawler
+from app.rag.frontier import CrawlFrontier
+from app.rag.incremental import IngestionManifest, chunks_needing_embedding
+
+logger = logging.getLogger(__name__)
+
+# A processed page on its way through the pipeline: (url, chunks)
+_Page = Tuple[str, List[Dict[str, Any]]]
+
+class IngestionPipeline:
+    """
+    Streaming ingestion: fetch -> extract, split and de-duplicate -> embed -> write.
+
+    The crawler's workers fetch pages and process them in worker threads (give
+    the crawler the same BatchEmbedder, so the de-duplication embeddings go
+    through its rate limit too); the embed stage collects pages until it can
+    fill the BatchEmbedder's concurrent batches with the chunks still missing
+    an embedding; the write stage hands at least flush_size chunks at a
+    time to write (a blocking callable, run in a thread). Stages are connected
+    by queues of at most queue_pages pages, so a slow stage pauses the ones
+    before it and memory stays bounded no matter how large the site is.
+
+    A page is only marked done in the frontier once all of its chunks were
+    written, and with checkpoint_path the frontier is saved after every
+    flush, so an interrupted run resumes exactly after the last flush. The
+    checkpoint also keeps the scraper's corpus_index source URLs (see
+    CorpusDedupIndex.restore).
+    """
+
+    def __init__(
+        self,
+        crawler: AsyncCrawler,
+        embedder: BatchEmbedder,
+        write: Callable[[List[Dict[str, Any]]], Optional[Dict[str, int]]],
+        manifest: Optional[IngestionManifest] = None,
+        flush_size: int = settings.INGEST_FLUSH_SIZE,
+        queue_pages: int = settings.INGEST_QUEUE_PAGES,
+        checkpoint_path: Optional[str] = None,
+    ):
+        self.crawler = crawler
+        self.embedder = embedder
+        self.write = write
+        self.manifest = manifest
+        self.flush_size = max(1, flush_size)
+        self.queue_pages = max(1, queue_pages)
+        self.checkpoint_path = checkpoint_path
+        self.chunk_ids: Set[str] = set() # Every chunk id the run produced, for deleting stale ones
+        self.counts: Counter = Counter()
+
+    async def _embed_stage(self, pages: Any, out: "asyncio.Queue[Optional[_Page]]") -> None:
+        # Enough chunks to keep every concurrent batch busy
+        target = self.embedder.batch_size * self.embedder.max_concurrency
+        buffer: List[_Page] = []
+        pending = 0
+
+        async def flush() -> None:
+            nonlocal buffer, pending
+            if pending:
+                chunks = [chunk for _, page_chunks in buffer for chunk in page_chunks]
+                self.counts["missing_embeddings"] += await self.embedder.embed_chunks(chunks, self.manifest)
+            for page in buffer:
+                await out.put(page)
+            buffer, pending = [], 0
+
+        async for _, url, chunks in pages:
+            self.counts["pages"] += 1
+            buffer.append((url, chunks))
+            pending += len(chunks_needing_embedding(chunks, self.manifest))
+            if pending >= target or not pending:
+                await flush()
+        await flush()
+        await out.put(None)
+
+    async def _write_stage(self, frontier: CrawlFrontier, pages: "asyncio.Queue[Optional[_Page]]") -> None:
+        buffer: List[Dict[str, Any]] = []
+        urls: List[str] = []
+
+        async def flush() -> None:
+            nonlocal buffer, urls
+            if buffer:
+                result = await asyncio.to_thread(self.write, buffer)
+                self.counts.update(result or {})
+                self.counts["chunks"] += len(buffer)
+                logger.info(f"Flushed {len(buffer)} chunks ({self.counts['chunks']} so far, {self.counts['pages']} pages).")
+            # Only now are these pages safely stored
+            for url in urls:
+                frontier.mark_done(url)
+            if self.checkpoint_path and (buffer or urls):
+                corpus_index = self.crawler.scraper.corpus_index
+                if corpus_index is not None:
+                    # Merges into stored chunks are only written at the end; a resumed run restores them
+                    frontier.metadata["source_urls"] = corpus_index.source_urls_snapshot()
+                frontier.save(self.checkpoint_path)
+            buffer, urls = [], []
+
+        while (page := await pages.get()) is not None:
+            url, chunks = page
+            self.chunk_ids.update(chunk["chunk_id"] for chunk in chunks)
+            buffer.extend(chunks)
+            urls.append(url)
+            if len(buffer) >= self.flush_size:
+                await flush()
+        await flush()
+
+    async def run(self, start_urls: Iterable[str], max_depth: int = 0, frontier: Optional[CrawlFrontier] = None) -> Dict[str, int]:
+        """
+        Ingests start_urls and the pages linked from them, up to max_depth links
+        away. A restored frontier resumes an interrupted run. Returns counts of
+        pages, written chunks, chunks without an embedding and whatever write
+        reported.
+        """
+        if frontier is None:
+            frontier = CrawlFrontier(max_depth=max_depth)
+        if self.manifest is not None:
+            # Pages finished before an interruption were written by that run; their chunks are current
+            self.manifest.seen_urls |= frontier.done
+            self.manifest.unchanged_urls |= frontier.done
+
+        pages = self.crawler.iter_pages(
+            start_urls,
+            max_depth,
+            frontier,
+            max_pending_pages=self.queue_pages,
+            mark_done=False,
+        )
+        embedded: "asyncio.Queue[Optional[_Page]]" = asyncio.Queue(maxsize=self.queue_pages)
+        embed_task = asyncio.create_task(self._embed_stage(pages, embedded))
+        write_task = asyncio.create_task(self._write_stage(frontier, embedded))
+        try:
+            await asyncio.gather(embed_task, write_task)
+        finally:
+            for task in (embed_task, write_task):
+                task.cancel()
+            await asyncio.gather(embed_task, write_task, return_exceptions=True)
+            await pages.aclose()
+        return dict(self.counts)
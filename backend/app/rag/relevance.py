@@ -0,0 +1,23 @@
+from typing import List, Optional, Sequence
+
+def select_relevant(
+    distances: Sequence[float],
+    max_distance: Optional[float] = None,
+    margin: Optional[float] = None,
+) -> List[int]:
+    """
+    Returns the indices of the results that are relevant enough to use as context.
+
+    Results are expected in Chroma's order (closest first). A result is kept if its
+    distance is at most max_distance and within margin of the best distance, so a
+    single strong match isn't padded out with weaker ones. An empty list means
+    nothing in the collection is close enough to the query.
+    """
+    if not distances:
+        return []
+
+    limit = float("inf") if max_distance is None else max_distance
+    best = min(distances)
+    if margin is not None:
+        limit = min(limit, best + margin)
+    return [i for i, distance in enumerate(distances) if distance <= limit]
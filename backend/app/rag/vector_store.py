@@ -1,20 +1,289 @@
-from typing import List, Dict, Any
+import json
+import threading
+import time
+import weakref
+from typing import List, Dict, Any, Callable, Optional, Sequence, Tuple, Union
 
+import numpy as np
 from chromadb.api import ClientAPI
 from chromadb.api.models.Collection import Collection
+from chromadb.errors import NotFoundError
+from app.core.config import settings
 from app.schemas.rag import QueryResult
 
 # Note: The ChromaDB client is now initialized and managed by FastAPI's lifecycle events
 # in app.main.py, and provided via dependency injection.
 
+# Collection whose metadata maps alias names (e.g. "hmsreg_docs") to versioned collections
+ALIAS_COLLECTION = "collection-aliases"
+VERSION_SEPARATOR = "__v"
+# Joins the source_urls of a chunk that was de-duplicated across pages
+SOURCE_URL_SEPARATOR = " "
+
+class VectorStore:
+    """
+    Owns a ChromaDB client and caches its collection handles.
+
+    Handles are resolved once per collection name instead of calling
+    get_or_create_collection (a metadata round-trip and, for PersistentClient,
+    a SQLite write) on every query. A cached handle is re-resolved after
+    revalidate_seconds so a rebuild by another process is picked up, and
+    dropped immediately when Chroma reports that its collection no longer exists.
+    """
+
+    def __init__(self, client: ClientAPI, revalidate_seconds: Optional[float] = None):
+        self.client = client
+        self.revalidate_seconds = (
+            settings.CHROMA_COLLECTION_REVALIDATE_SECONDS if revalidate_seconds is None else revalidate_seconds
+        )
+        self._collections: Dict[str, Tuple[Collection, float]] = {}
+        self._lock = threading.Lock()
+
+    def get_collection(self, name: str = "hmsreg_docs") -> Collection:
+        """Returns the cached handle for the collection, creating the collection if needed."""
+        with self._lock:
+            entry = self._collections.get(name)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+            collection = self.client.get_or_create_collection(name=self.resolve_alias(name))
+            self._collections[name] = (collection, time.monotonic() + self.revalidate_seconds)
+            return collection
+
+    def _aliases(self) -> Dict[str, Any]:
+        try:
+            metadata = self.client.get_collection(name=ALIAS_COLLECTION).metadata
+        except (NotFoundError, ValueError):
+            return {}
+        return dict(metadata) if isinstance(metadata, dict) else {}
+
+    def resolve_alias(self, name: str) -> str:
+        """Returns the collection name an alias points to, or name itself if it isn't an alias."""
+        target = self._aliases().get(name)
+        return target if isinstance(target, str) and target else name
+
+    def create_versioned_collection(self, alias: str = "hmsreg_docs") -> Collection:
+        """Creates the next "<alias>__v<n>" collection for a rebuild. The alias is not changed."""
+        versions = [
+            version for version in (_version_number(alias, c.name) for c in self.client.list_collections())
+            if version is not None
+        ]
+        return self.client.create_collection(
+            name=f"{alias}{VERSION_SEPARATOR}{max(versions, default=0) + 1}",
+            metadata={"created_at": time.time()},
+        )
+
+    def swap_alias(self, alias: str, target: str, grace_seconds: Optional[float] = None) -> None:
+        """
+        Points alias at the target collection in a single metadata write, marks the
+        previous target as retired and garbage-collects versions retired longer
+        than grace_seconds ago.
+        """
+        aliases = self._aliases()
+        previous = aliases.get(alias) or alias
+        aliases[alias] = target
+        registry = self.client.get_or_create_collection(name=ALIAS_COLLECTION)
+        registry.modify(metadata=aliases)
+        self.invalidate(alias)
+
+        if previous != target:
+            try:
+                retired = self.client.get_collection(name=previous)
+                retired.modify(metadata={**(retired.metadata or {}), "retired_at": time.time()})
+            except (NotFoundError, ValueError):
+                pass
+        self.gc_versions(alias, grace_seconds)
+
+    def gc_versions(self, alias: str = "hmsreg_docs", grace_seconds: Optional[float] = None) -> List[str]:
+        """
+        Deletes retired versions of alias (and the pre-alias collection of the same
+        name) once they have been retired for grace_seconds, and versions newer than
+        the live one that were never swapped in (left by a failed or interrupted
+        build) once they are grace_seconds old. Returns the deleted names.
+        """
+        if grace_seconds is None:
+            grace_seconds = settings.CHROMA_VERSION_GRACE_SECONDS
+        current = self.resolve_alias(alias)
+        live_version = _version_number(alias, current) or 0
+        cutoff = time.time() - grace_seconds
+        deleted = []
+        for collection in self.client.list_collections():
+            if collection.name == current:
+                continue
+            version = _version_number(alias, collection.name)
+            if collection.name != alias and version is None:
+                continue
+            metadata = collection.metadata or {}
+            retired_at = metadata.get("retired_at")
+            if retired_at is None and version is not None and version > live_version:
+                retired_at = metadata.get("created_at") # Staging version of a build that never finished
+            if retired_at is not None and retired_at <= cutoff:
+                self.client.delete_collection(name=collection.name)
+                deleted.append(collection.name)
+        return deleted
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Drops the cached handle for name, or all handles if name is None."""
+        with self._lock:
+            if name is None:
+                self._collections.clear()
+            else:
+                self._collections.pop(name, None)
+
+    def delete_collection(self, name: str = "hmsreg_docs") -> None:
+        """Deletes the collection (the current target, for an alias) and drops its cached handle."""
+        self.invalidate(name)
+        self.client.delete_collection(name=self.resolve_alias(name))
+
+    def _with_collection(self, name: str, operation: Callable[[Collection], Any]) -> Any:
+        # Retry once with a fresh handle if the collection was deleted or recreated
+        try:
+            return operation(self.get_collection(name))
+        except NotFoundError:
+            self.invalidate(name)
+            return operation(self.get_collection(name))
+
+    def query(
+        self,
+        query_embedding: List[float],
+        n_results: int = 4,
+        collection_name: str = "hmsreg_docs",
+        include_embeddings: bool = False
+    ) -> QueryResult:
+        """Queries the collection through its cached handle. See query_collection."""
+        return self.query_batch(
+            [query_embedding],
+            n_results=n_results,
+            collection_name=collection_name,
+            include_embeddings=include_embeddings
+        )[0]
+
+    def query_batch(
+        self,
+        query_embeddings: Sequence[List[float]],
+        n_results: int = 4,
+        collection_name: str = "hmsreg_docs",
+        where: Union[None, Dict[str, Any], Sequence[Optional[Dict[str, Any]]]] = None,
+        include_embeddings: bool = False
+    ) -> List[QueryResult]:
+        """Queries the collection for many embeddings at once. See query_collection_batch."""
+        if not query_embeddings:
+            return []
+
+        if where is None or isinstance(where, dict):
+            filters = [where] * len(query_embeddings)
+        else:
+            filters = list(where)
+            if len(filters) != len(query_embeddings):
+                raise ValueError("where must have one filter per query embedding.")
+
+        include = ["documents", "metadatas", "distances"]
+        if include_embeddings:
+            include.append("embeddings")
+
+        # Chroma takes a single filter per call, so queries sharing a filter go together
+        groups: Dict[str, Tuple[Optional[Dict[str, Any]], List[int]]] = {}
+        for position, query_filter in enumerate(filters):
+            key = json.dumps(query_filter, sort_keys=True, default=str)
+            groups.setdefault(key, (query_filter, []))[1].append(position)
+
+        results: List[Optional[QueryResult]] = [None] * len(query_embeddings)
+        for query_filter, positions in groups.values():
+            raw = self._with_collection(
+                collection_name,
+                lambda collection: collection.query(
+                    query_embeddings=[query_embeddings[p] for p in positions],
+                    n_results=n_results,
+                    where=query_filter,
+                    include=include
+                ),
+            )
+            for row, position in enumerate(positions):
+                results[position] = _to_query_result(raw, row)
+        return results
+
+def _version_number(alias: str, name: str) -> Optional[int]:
+    """Returns n for a "<alias>__v<n>" collection name, or None for any other name."""
+    prefix = f"{alias}{VERSION_SEPARATOR}"
+    suffix = name[len(prefix):]
+    return int(suffix) if name.startswith(prefix) and suffix.isdigit() else None
+
+def _to_query_result(raw: Dict[str, Any], row: int) -> QueryResult:
+    """Picks one query's results out of Chroma's list-of-lists response."""
+    def column(name: str) -> list:
+        values = raw.get(name)
+        if values is None or len(values) <= row or values[row] is None:
+            return []
+        return list(values[row])
+
+    embeddings = None
+    if raw.get('embeddings') is not None and len(raw['embeddings']) > row:
+        embeddings = np.asarray(raw['embeddings'][row], dtype=float).tolist()
+
+    return QueryResult(
+        documents=column('documents'),
+        metadatas=column('metadatas'),
+        ids=column('ids'),
+        distances=[float(d) for d in column('distances')],
+        embeddings=embeddings
+    )
+
+_stores: "weakref.WeakKeyDictionary[ClientAPI, VectorStore]" = weakref.WeakKeyDictionary()
+_stores_lock = threading.Lock()
+
+def get_vector_store(client: ClientAPI) -> VectorStore:
+    """
+    Returns the VectorStore for the client, so module-level helpers called with
+    the same client share one handle cache.
+    """
+    with _stores_lock:
+        store = _stores.get(client)
+        if store is None:
+            store = VectorStore(client)
+            _stores[client] = store
+        return store
+
 def get_collection(client: ClientAPI, name: str = "hmsreg_docs") -> Collection:
     """
     Returns the specific collection for HMSREG docs.
     Creates it if it doesn't exist.
     The ChromaDB client is provided via FastAPI's dependency injection.
     """
-    # get_or_create_collection is the standard way to ensure it exists
-    return client.get_or_create_collection(name=name)
+    return get_vector_store(client).get_collection(name)
+
+def delete_collection(client: ClientAPI, name: str = "hmsreg_docs") -> None:
+    """
+    Deletes the collection and invalidates its cached handle.
+    """
+    get_vector_store(client).delete_collection(name)
+
+def get_collection_version(client: ClientAPI, name: str = "hmsreg_docs") -> str:
+    """
+    Returns an identifier that changes whenever the collection's content changes.
+    A full rebuild recreates the collection, which assigns a new id; incremental
+    ingestion bumps the content_version in the collection metadata.
+    """
+    collection = get_collection(client, name)
+    content_version = (collection.metadata or {}).get("content_version", "")
+    return f"{collection.id}:{content_version}" if content_version else str(collection.id)
+
+def chunk_metadata(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The metadata stored for a chunk; content hashes, the chunker signature, the
+    heading path and the URLs of pages the chunk was de-duplicated from are
+    included when the chunk has them.
+    """
+    metadata = {
+        "url": chunk['url'],
+        "title": chunk['title'],
+        "chunk_id": chunk['chunk_id'], # Keep the original chunk ID
+    }
+    for key in ("content_hash", "page_hash", "chunker", "heading_path"):
+        if chunk.get(key):
+            metadata[key] = chunk[key]
+    if len(chunk.get("source_urls") or []) > 1:
+        # Chroma metadata values are scalars; see CorpusDedupIndex
+        metadata["source_urls"] = SOURCE_URL_SEPARATOR.join(chunk["source_urls"])
+    return metadata
 
 def add_chunks_to_collection(
     client: ClientAPI,
@@ -39,14 +308,7 @@ def add_chunks_to_collection(
     collection = get_collection(client, collection_name)
 
     documents = [chunk['content'] for chunk in chunks]
-    metadatas = [
-        {
-            "url": chunk['url'],
-            "title": chunk['title'],
-            "chunk_id": chunk['chunk_id'], # Keep the original chunk ID
-        }
-        for chunk in chunks
-    ]
+    metadatas = [chunk_metadata(chunk) for chunk in chunks]
     embeddings = [chunk['embedding'] for chunk in chunks]
     ids = [chunk['chunk_id'] for chunk in chunks] # Use chunk_id as the document ID in Chroma
 
@@ -80,7 +342,8 @@ def query_collection(
     client: ClientAPI,
     query_embedding: List[float],
     n_results: int = 4,
-    collection_name: str = "hmsreg_docs"
+    collection_name: str = "hmsreg_docs",
+    include_embeddings: bool = False
 ) -> QueryResult:
     """
     Queries the ChromaDB collection for relevant documents.
@@ -90,19 +353,46 @@ def query_collection(
         query_embedding: The embedding vector of the query.
         n_results: Number of results to retrieve.
         collection_name: The name of the ChromaDB collection.
+        include_embeddings: Whether to also return the stored embeddings of the results.
 
     Returns:
-        QueryResult object containing documents and metadata.
+        QueryResult object containing documents and metadata (and embeddings if requested).
     """
-    collection = get_collection(client, collection_name)
-    
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results
+    return get_vector_store(client).query(
+        query_embedding,
+        n_results=n_results,
+        collection_name=collection_name,
+        include_embeddings=include_embeddings
+    )
+
+
+def query_collection_batch(
+    client: ClientAPI,
+    query_embeddings: Sequence[List[float]],
+    n_results: int = 4,
+    collection_name: str = "hmsreg_docs",
+    where: Union[None, Dict[str, Any], Sequence[Optional[Dict[str, Any]]]] = None,
+    include_embeddings: bool = False
+) -> List[QueryResult]:
+    """
+    Queries the ChromaDB collection for many query embeddings in one pass.
+
+    Args:
+        client: The ChromaDB client instance.
+        query_embeddings: The embedding vectors of the queries.
+        n_results: Number of results to retrieve per query.
+        collection_name: The name of the ChromaDB collection.
+        where: A metadata filter applied to every query, or one filter (or None) per query.
+               Queries that share a filter are sent to Chroma in a single call.
+        include_embeddings: Whether to also return the stored embeddings of the results.
+
+    Returns:
+        One QueryResult (with ids and distances) per query embedding, in input order.
+    """
+    return get_vector_store(client).query_batch(
+        query_embeddings,
+        n_results=n_results,
+        collection_name=collection_name,
+        where=where,
+        include_embeddings=include_embeddings
     )
-    
-    # Flatten the results (Chroma returns list of lists)
-    documents = results['documents'][0] if results['documents'] else []
-    metadatas = results['metadatas'][0] if results['metadatas'] else []
-    
-    return QueryResult(documents=documents, metadatas=metadatas)
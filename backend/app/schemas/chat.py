@@ -20,4 +20,14 @@ class ChatResponse(BaseModel):
     citations: List[SourceCitation] = []
     confidence: Optional[float] = None
     fallback_message: Optional[str] = None
-    suggested_queries: Optional[List[str]] = None
\ No newline at end of file
+    suggested_queries: Optional[List[str]] = None
+
+class StreamingChatResponse(BaseModel):
+    """
+    LLM output schema for single-pass streaming.
+    Control fields come before the answer so they are complete by the time answer text streams.
+    """
+    fallback_message: Optional[str] = None
+    suggested_queries: Optional[List[str]] = None
+    confidence: Optional[float] = None
+    answer: str = ""
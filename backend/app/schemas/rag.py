@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 class Chunk(BaseModel):
     content: str
@@ -9,4 +9,7 @@ class Chunk(BaseModel):
 
 class QueryResult(BaseModel):
     documents: List[str]
-    metadatas: List[Dict[str, Any]]
\ No newline at end of file
+    metadatas: List[Dict[str, Any]]
+    ids: List[str] = []
+    distances: List[float] = []
+    embeddings: Optional[List[List[float]]] = None
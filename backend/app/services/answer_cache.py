@@ -0,0 +1,181 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import logfire
+import numpy as np
+
+from app.rag.embedding_cache import normalize_text
+from app.schemas.chat import ChatResponse, SourceCitation
+
+_answer_hits = logfire.metric_counter("answer_cache_hits", description="Answer cache hits")
+_answer_misses = logfire.metric_counter("answer_cache_misses", description="Answer cache misses")
+
+AnswerKey = Tuple[str, str, str]
+
+class AnswerCache:
+    """
+    Caches final ChatResponses keyed on (normalized message, user role, collection version).
+
+    Entries for an older collection version are dropped as soon as a newer
+    version is seen, so a rebuilt index never serves stale answers. When a
+    similarity threshold is set, lookups can also match on the query embedding.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl_seconds: Optional[float] = 3600,
+        similarity_threshold: Optional[float] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[AnswerKey, Tuple[ChatResponse, Optional[np.ndarray], float]]" = OrderedDict()
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(message: str, user_role: Optional[str], collection_version: str) -> AnswerKey:
+        return (normalize_text(message), user_role or "", collection_version)
+
+    def _check_version(self, collection_version: str) -> None:
+        # Must be called with the lock held
+        if collection_version != self._version:
+            self._entries.clear()
+            self._version = collection_version
+
+    def get(self, message: str, user_role: Optional[str], collection_version: str) -> Optional[ChatResponse]:
+        """Returns the cached response for an exact (normalized) match, or None."""
+        key = self.make_key(message, user_role, collection_version)
+        with self._lock:
+            self._check_version(collection_version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] >= time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                _answer_hits.add(1, {"match": "exact"})
+                return entry[0].model_copy(deep=True)
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+        _answer_misses.add(1)
+        return None
+
+    def find_similar(
+        self, query_embedding: List[float], user_role: Optional[str], collection_version: str
+    ) -> Optional[ChatResponse]:
+        """
+        Returns the cached response whose query embedding is most similar to
+        query_embedding, if it is above the similarity threshold.
+        """
+        if self.similarity_threshold is None:
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+        query = query / norm
+
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(collection_version)
+            candidates = [
+                (key, embedding)
+                for key, (_, embedding, expires_at) in self._entries.items()
+                if embedding is not None and key[1] == (user_role or "") and expires_at >= now
+            ]
+            if not candidates:
+                return None
+
+            similarities = np.stack([embedding for _, embedding in candidates]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+
+            key = candidates[best][0]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            response = self._entries[key][0]
+        _answer_hits.add(1, {"match": "similar"})
+        return response.model_copy(deep=True)
+
+    def put(
+        self,
+        message: str,
+        user_role: Optional[str],
+        collection_version: str,
+        response: ChatResponse,
+        query_embedding: Optional[List[float]] = None,
+    ) -> None:
+        """Stores the final response (including citations) for later replay."""
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(embedding)
+            embedding = embedding / norm if norm else None
+
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else float("inf")
+        key = self.make_key(message, user_role, collection_version)
+        with self._lock:
+            self._check_version(collection_version)
+            self._entries[key] = (response.model_copy(deep=True), embedding, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+def replay_events(response: ChatResponse) -> Iterator[Tuple[str, object]]:
+    """
+    Turns a cached ChatResponse back into the (type, content) events that
+    ChatService.stream_chat_response yields, with the answer split into word tokens.
+    """
+    if response.fallback_message:
+        yield ("fallback", response.fallback_message)
+        return
+
+    citations_data = [c.model_dump() for c in response.citations]
+    if response.suggested_queries:
+        yield ("suggestions", response.suggested_queries)
+        if response.answer:
+            yield ("token", response.answer)
+        yield ("citation", citations_data)
+        return
+
+    for token in re.findall(r"\S+\s*|\s+", response.answer):
+        yield ("token", token)
+    yield ("citation", citations_data)
+
+def response_from_events(events: List[Tuple[str, object]], citations: List[SourceCitation]) -> ChatResponse:
+    """
+    Rebuilds the final ChatResponse from the (type, content) events of a live stream,
+    so it can be cached and replayed later.
+    """
+    answer = ""
+    fallback_message = None
+    suggested_queries = None
+    for kind, content in events:
+        if kind == "token":
+            answer += content
+        elif kind == "fallback":
+            fallback_message = content
+        elif kind == "suggestions":
+            suggested_queries = content
+    return ChatResponse(
+        answer=answer,
+        citations=[] if fallback_message else citations,
+        fallback_message=fallback_message,
+        suggested_queries=suggested_queries,
+    )
@@ -1,12 +1,18 @@
 import os
-from typing import List, Tuple, Any
+from typing import List, Tuple, Any, Optional
 import google.generativeai as genai
 from dotenv import load_dotenv
 from chromadb.api import ClientAPI
 
-from pydantic_ai import Agent
-from app.schemas.chat import ChatRequest, ChatResponse, SourceCitation
-from app.rag.vector_store import query_collection
+from pydantic_ai import Agent, NativeOutput
+from pydantic_ai.models.gemini import GeminiModelSettings
+from app.schemas.chat import ChatRequest, ChatResponse, SourceCitation, StreamingChatResponse
+from app.rag.vector_store import query_collection, get_collection_version
+from app.rag.embeddings import EmbeddingClient, create_embedding_client
+from app.rag.dedup import ChunkDeduplicator
+from app.rag.relevance import select_relevant
+from app.services.answer_cache import AnswerCache, replay_events, response_from_events
+from app.services.streaming import coalesce_tokens
 from app.core.config import settings # Import settings
 
 load_dotenv()
@@ -20,12 +26,37 @@ FALLBACK_MESSAGE = (
     "[dokumentasjonen](https://docs.hmsreg.com)."
 )
 
+# Domain-specific term expansions for better matching
+TERM_EXPANSIONS = {
+    'kort': ['kort', 'HMS kort', 'HMS-kort', 'HMSREG kort'],
+    'register': ['register', 'registrering', 'HMS register'],
+    'risiko': ['risiko', 'risikovurdering', 'risikostyring', 'risikoanalyse'],
+    'underleverandør': ['leverandør', 'underleverandører', 'entreprenør', 'underentreprenør'],
+    'hovedentreprenør': ['hovedleverandør', 'hovedbedrift'],
+    'avvik': ['avvik', 'avvikshåndtering', 'HMS avvik', 'avviksmelding'],
+    'opplæring': ['opplæring', 'kurs', 'opplæringskurs', 'skolering'],
+    'sertifikat': ['sertifikat', 'sertifisering', 'kompetansebevis'],
+    'prosjekt': ['prosjekt', 'byggeprosjekt', 'anlegg', 'byggeplass'],
+    'mannskap': ['mannskap', 'mannskapsliste', 'arbeidere', 'ansatte'],
+    'godkjenning': ['godkjenning', 'godkjenne', 'godkjent', 'akseptert'],
+    'dokumentasjon': ['dokumentasjon', 'dokument', 'dokumenter'],
+}
+
 class ChatService:
-    def __init__(self):
+    """
+    RAG chat pipeline (embedding -> retrieval -> generation).
+
+    Construction builds both agents and the expansion table, so the service is
+    meant to be created once per process (see app.services.registry) and shared
+    across requests.
+    """
+
+    def __init__(self, embedding_client: Optional[EmbeddingClient] = None):
+        # Async embedding client so query embedding never blocks the event loop
+        self.embedding_client = embedding_client or create_embedding_client()
+
         # Initialize the PydanticAI Agent with model settings
         # Lower temperature to reduce repetition
-        from pydantic_ai.models.gemini import GeminiModelSettings
-
         model_settings = GeminiModelSettings(temperature=0.3)
 
         self.agent = Agent(
@@ -33,127 +64,150 @@ class ChatService:
             output_type=ChatResponse,
             model_settings=model_settings,
         )
-        # Agent for streaming (returns text)
-        self.streaming_agent = Agent(
-            'google-gla:gemini-2.5-flash',
-            model_settings=model_settings,
+        if settings.CHAT_SINGLE_PASS_STREAMING:
+            # Single streamed structured generation; native JSON output streams field by field
+            self.single_pass_agent = Agent(
+                'google-gla:gemini-2.5-flash',
+                output_type=NativeOutput(StreamingChatResponse),
+                model_settings=model_settings,
+            )
+        else:
+            # Agent for the legacy second, streamed pass (returns text)
+            self.streaming_agent = Agent(
+                'google-gla:gemini-2.5-flash',
+                model_settings=model_settings,
+            )
+
+        # Cache of final answers for repeated (FAQ-style) questions
+        self.answer_cache: Optional[AnswerCache] = None
+        if settings.ANSWER_CACHE_ENABLED:
+            self.answer_cache = AnswerCache(
+                max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+                ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+                similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+            )
+
+        # Near-duplicate filter for retrieved chunks
+        self.deduplicator = ChunkDeduplicator(
+            exact=settings.RAG_DEDUP_EXACT,
+            substring=settings.RAG_DEDUP_SUBSTRING,
+            jaccard_threshold=settings.RAG_DEDUP_JACCARD_THRESHOLD,
+            first_sentence=settings.RAG_DEDUP_FIRST_SENTENCE,
+            cosine_threshold=settings.RAG_DEDUP_COSINE_THRESHOLD,
         )
 
-        # Domain-specific term expansions for better matching
-        self.term_expansions = {
-            'kort': ['kort', 'HMS kort', 'HMS-kort', 'HMSREG kort'],
-            'register': ['register', 'registrering', 'HMS register'],
-            'risiko': ['risiko', 'risikovurdering', 'risikostyring', 'risikoanalyse'],
-            'underleverandør': ['leverandør', 'underleverandører', 'entreprenør', 'underentreprenør'],
-            'hovedentreprenør': ['hovedleverandør', 'hovedbedrift'],
-            'avvik': ['avvik', 'avvikshåndtering', 'HMS avvik', 'avviksmelding'],
-            'opplæring': ['opplæring', 'kurs', 'opplæringskurs', 'skolering'],
-            'sertifikat': ['sertifikat', 'sertifisering', 'kompetansebevis'],
-            'prosjekt': ['prosjekt', 'byggeprosjekt', 'anlegg', 'byggeplass'],
-            'mannskap': ['mannskap', 'mannskapsliste', 'arbeidere', 'ansatte'],
-            'godkjenning': ['godkjenning', 'godkjenne', 'godkjent', 'akseptert'],
-            'dokumentasjon': ['dokumentasjon', 'dokument', 'dokumenter'],
-        }
+        # Domain-specific term expansions, compiled once into (term, expansions) pairs
+        self.term_expansions = TERM_EXPANSIONS
+        self._compiled_expansions = tuple(
+            (term, tuple(expansions)) for term, expansions in TERM_EXPANSIONS.items()
+        )
 
     def _expand_query(self, query: str) -> str:
         """Expand query with domain-specific terms for better matching."""
         query_lower = query.lower()
         expanded_terms = []
 
-        for term, expansions in self.term_expansions.items():
+        for term, expansions in self._compiled_expansions:
             if term in query_lower:
                 # Add all expansion variations
                 expanded_terms.extend(expansions)
 
         if expanded_terms:
-            # Combine original query with expansions
-            return f"{query} {' '.join(set(expanded_terms))}"
+            # Combine original query with de-duplicated expansions in a stable order,
+            # so the same question always maps to the same embedding cache key
+            return f"{query} {' '.join(dict.fromkeys(expanded_terms))}"
 
         return query
 
-    async def _prepare_context(self, request: ChatRequest, chroma_client: ClientAPI) -> tuple[str, List[SourceCitation]]:
+    async def _get_cached_answer(
+        self, request: ChatRequest, chroma_client: ClientAPI
+    ) -> tuple[Optional[ChatResponse], str, Optional[List[float]]]:
+        """
+        Looks up a cached answer for the request.
+        Returns (cached_response, collection_version, query_embedding); the embedding
+        is only computed when approximate matching is enabled.
+        """
+        collection_version = get_collection_version(chroma_client)
+        user_role = request.user_role.value if request.user_role else None
+
+        cached = self.answer_cache.get(request.message, user_role, collection_version)
+        query_embedding = None
+        if cached is None and self.answer_cache.similarity_threshold is not None:
+            # Served from the embedding cache when _prepare_context runs next
+            query_embedding = await self.embedding_client.embed(
+                self._expand_query(request.message), task_type="retrieval_query"
+            )
+            cached = self.answer_cache.find_similar(query_embedding, user_role, collection_version)
+        return cached, collection_version, query_embedding
+
+    def _cache_answer(
+        self,
+        request: ChatRequest,
+        collection_version: str,
+        response: ChatResponse,
+        query_embedding: Optional[List[float]] = None,
+    ) -> None:
+        user_role = request.user_role.value if request.user_role else None
+        self.answer_cache.put(request.message, user_role, collection_version, response, query_embedding)
+
+    async def _prepare_context(
+        self, request: ChatRequest, chroma_client: ClientAPI
+    ) -> tuple[Optional[str], List[SourceCitation]]:
         """
         Shared logic to embed query and retrieve context.
-        Returns (prompt_with_context, retrieved_citations)
+        Returns (prompt_with_context, retrieved_citations); the prompt is None when
+        no retrieved chunk passes the relevance cut-off.
         """
         # 1. Expand the query for better matching
         expanded_query = self._expand_query(request.message)
 
-        # 2. Embed the expanded query
-        embedding_result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=expanded_query,
-            task_type="retrieval_query"
-        )
-        query_embedding = embedding_result["embedding"]
+        # 2. Embed the expanded query (awaited, runs off the event loop)
+        query_embedding = await self.embedding_client.embed(expanded_query, task_type="retrieval_query")
 
-        # 3. Retrieve chunks for deduplication (reduced from 15 to 10)
+        # 3. Retrieve chunks (with their stored embeddings) for deduplication
         query_result = query_collection(
             client=chroma_client,
             query_embedding=query_embedding,
-            n_results=10
+            n_results=10,
+            include_embeddings=self.deduplicator.cosine_threshold is not None,
         )
-        
+
         # 4. Smart deduplication: remove similar chunks, not just exact matches
         formatted_chunks = []
         retrieved_citations: List[SourceCitation] = []
         seen_urls = set()
-        unique_docs = []
-
-        if query_result.documents:
-            for doc, meta in zip(query_result.documents, query_result.metadatas):
-                if doc and meta:
-                    # Check if this chunk is similar to any already selected chunk
-                    is_duplicate = False
-                    doc_normalized = doc.lower().strip()
-
-                    for existing_doc in unique_docs:
-                        existing_normalized = existing_doc.lower().strip()
-
-                        # Check for exact match
-                        if doc_normalized == existing_normalized:
-                            is_duplicate = True
-                            break
-
-                        # Check if one is a substring of the other (likely duplicate)
-                        if (doc_normalized in existing_normalized or
-                            existing_normalized in doc_normalized):
-                            is_duplicate = True
-                            break
-
-                        # Check for high word overlap (lowered from 85% to 60%)
-                        doc_words = set(doc_normalized.split())
-                        existing_words = set(existing_normalized.split())
-                        if doc_words and existing_words:
-                            overlap = len(doc_words & existing_words) / len(doc_words | existing_words)
-                            if overlap > 0.60:  # 60% word overlap = likely duplicate
-                                is_duplicate = True
-                                break
-
-                        # Check for sentence-level duplication (first sentence match)
-                        doc_sentences = [s.strip() for s in doc_normalized.split('.') if s.strip()]
-                        existing_sentences = [s.strip() for s in existing_normalized.split('.') if s.strip()]
-                        if doc_sentences and existing_sentences:
-                            # If first sentences are very similar, likely duplicate
-                            if doc_sentences[0] == existing_sentences[0]:
-                                is_duplicate = True
-                                break
-
-                    if not is_duplicate:
-                        source = meta.get('url', 'Unknown')
-                        title = meta.get('title', 'Untitled')
-
-                        chunk_content = f"Title: {title}\nSource: {source}\nContent: {doc}"
-                        formatted_chunks.append(chunk_content)
-                        unique_docs.append(doc)
-
-                        if source not in seen_urls and source != 'Unknown':
-                            retrieved_citations.append(SourceCitation(title=title, url=source))
-                            seen_urls.add(source)
-
-                # Limit to best 5 chunks after deduplication
-                if len(formatted_chunks) >= 5:
-                    break
+
+        # Keep only chunks close enough to the query (adaptive top-k), then skip
+        # entries without text or metadata, keeping embeddings aligned
+        relevant = range(len(query_result.documents))
+        if query_result.distances:
+            relevant = select_relevant(
+                query_result.distances,
+                max_distance=settings.RAG_MAX_DISTANCE,
+                margin=settings.RAG_DISTANCE_MARGIN,
+            )
+        candidates = [
+            i for i in relevant
+            if query_result.documents[i] and query_result.metadatas[i]
+        ]
+        if not candidates:
+            return None, []
+        documents = [query_result.documents[i] for i in candidates]
+        embeddings = [query_result.embeddings[i] for i in candidates] if query_result.embeddings else None
+
+        # Limit to best 5 chunks after deduplication
+        for index in self.deduplicator.select(documents, embeddings, limit=5):
+            doc = documents[index]
+            meta = query_result.metadatas[candidates[index]]
+            source = meta.get('url', 'Unknown')
+            title = meta.get('title', 'Untitled')
+
+            chunk_content = f"Title: {title}\nSource: {source}\nContent: {doc}"
+            formatted_chunks.append(chunk_content)
+
+            if source not in seen_urls and source != 'Unknown':
+                retrieved_citations.append(SourceCitation(title=title, url=source))
+                seen_urls.add(source)
 
         context_str = "\n\n".join(formatted_chunks)
 
@@ -173,8 +227,19 @@ class ChatService:
         Orchestrates the RAG pipeline: Embedding -> Retrieval -> Generation.
         """
         try:
+            if self.answer_cache is not None:
+                cached, collection_version, query_embedding = await self._get_cached_answer(request, chroma_client)
+                if cached is not None:
+                    return cached
+
             prompt_with_context, _ = await self._prepare_context(request, chroma_client)
-            
+            if prompt_with_context is None:
+                # Nothing relevant was retrieved, so skip the LLM call entirely
+                response = ChatResponse(answer="", citations=[], fallback_message=FALLBACK_MESSAGE)
+                if self.answer_cache is not None:
+                    self._cache_answer(request, collection_version, response, query_embedding)
+                return response
+
             # No need to append specific instruction for JSON format, output_type handles it.
             # prompt_with_context += " Provide citations as a list of source URLs used."
 
@@ -205,7 +270,10 @@ class ChatService:
                 result.output.answer = ""
                 result.output.citations = [] # Discard citations if answer is not confident
                 result.output.fallback_message = FALLBACK_MESSAGE # Set fallback message
-            
+
+            if self.answer_cache is not None:
+                self._cache_answer(request, collection_version, result.output, query_embedding)
+
             return result.output
 
         except Exception as e:
@@ -222,85 +290,193 @@ class ChatService:
         Yields (type, content) tuples.
         """
         try:
+            if self.answer_cache is not None:
+                cached, collection_version, query_embedding = await self._get_cached_answer(request, chroma_client)
+                if cached is not None:
+                    # Replay the cached answer as a token stream, skipping retrieval and generation
+                    for event in replay_events(cached):
+                        yield event
+                    return
+
             prompt_with_context, retrieved_citations = await self._prepare_context(request, chroma_client)
-            
-            user_role = request.user_role.value if request.user_role else "General User"
+            if prompt_with_context is None:
+                # Nothing relevant was retrieved, so skip the LLM call entirely
+                yield ("fallback", FALLBACK_MESSAGE)
+                if self.answer_cache is not None:
+                    self._cache_answer(
+                        request, collection_version,
+                        ChatResponse(answer="", citations=[], fallback_message=FALLBACK_MESSAGE),
+                        query_embedding,
+                    )
+                return
 
-            system_prompt = (
-                f"You are a helpful assistant for HMSREG documentation.\n"
-                f"Target Audience Role: {user_role}\n\n"
-                f"Instructions:\n"
-                f"- Answer the user's question based strictly on the provided context. "
-                f"Synthesize information from multiple sources if necessary to provide a comprehensive answer, "
-                f"but avoid direct repetition or verbatim copying of content. Be concise and to the point.\n"
-                f"- Adapt your tone and focus to be most helpful to a {user_role}.\n"
-                f"- If the user's query is too broad or ambiguous, identify it as such.\n"
-                f"- Populate the 'suggested_queries' field of the ChatResponse with 2-3 specific, relevant follow-up questions or topics if ambiguity is detected.\n"
-                f"- If 'suggested_queries' are provided, the 'answer' field should be a concise statement acknowledging the ambiguity and guiding the user to the suggestions.\n"
-                f"If you don't know the answer based on the context, just say that you don't know. "
-                f"You must output a JSON object matching the ChatResponse schema."
-            )
-            
-            # First, get a complete ChatResponse object to check for fallback or suggestions
-            full_response_result = await self.agent.run(prompt_with_context, instructions=system_prompt)
-            full_response = full_response_result.output # Changed from .data
+            user_role = request.user_role.value if request.user_role else "General User"
 
-            # Handle fallback message
-            if full_response.fallback_message:
-                yield ("fallback", full_response.fallback_message)
-                return
+            if settings.CHAT_SINGLE_PASS_STREAMING:
+                events = self._stream_single_pass(prompt_with_context, user_role, retrieved_citations)
+            else:
+                events = self._stream_two_pass(prompt_with_context, user_role, retrieved_citations)
 
-            # Handle suggested queries
-            if full_response.suggested_queries:
-                yield ("suggestions", full_response.suggested_queries)
-                # If suggestions are provided, the answer might be very short or empty,
-                # so we might not need to stream anything further, or just stream the short answer.
-                # For now, let's assume if suggestions are primary, the main answer streaming is secondary/empty.
-                if full_response.answer:
-                    # Yield a very short answer if any, before citations
-                    yield ("token", full_response.answer)
-                citations_data = [c.model_dump() for c in retrieved_citations]
-                yield ("citation", citations_data)
-                return
+            streamed_events = []
+            async for event in coalesce_tokens(events):
+                streamed_events.append(event)
+                yield event
 
-            # If no fallback or suggestions, proceed with streaming the main answer
-            # We still need a system prompt that doesn't expect a Pydantic object for the streaming agent
-            streaming_system_prompt = (
-                f"You are a helpful assistant for HMSREG documentation.\n"
-                f"Target Audience Role: {user_role}\n\n"
-                f"CRITICAL INSTRUCTIONS:\n"
-                f"- Answer the user's question in the same language as the question.\n"
-                f"- Synthesize information from ALL context sources into ONE cohesive, flowing answer.\n"
-                f"- DO NOT repeat the same information multiple times, even if it appears in multiple context sources.\n"
-                f"- Each piece of information should appear ONLY ONCE in your answer.\n"
-                f"- NEVER copy sentences or paragraphs verbatim from the context.\n"
-                f"- Be concise, clear, and to the point. Avoid redundancy.\n"
-                f"- If the context contains overlapping information, merge it into a single coherent explanation.\n"
-                f"- Complete your sentences - never cut off mid-sentence.\n"
-                f"- Adapt your tone and focus to be most helpful to a {user_role}.\n"
-                f"If you don't know the answer, just say that you don't know."
-            )
+            if self.answer_cache is not None:
+                response = response_from_events(streamed_events, retrieved_citations)
+                # A stream that ended without an answer (cut off or empty) must not be replayed for the TTL
+                if response.answer or response.fallback_message or response.suggested_queries:
+                    self._cache_answer(request, collection_version, response, query_embedding)
 
-            # Track accumulated text to only send new portions
-            accumulated_text = ""
-
-            async with self.streaming_agent.run_stream(prompt_with_context, instructions=streaming_system_prompt) as result:
-                async for chunk in result.stream():
-                    # Gemini returns full accumulated text, not deltas
-                    # We need to extract only the new portion
-                    if chunk and len(chunk) > len(accumulated_text):
-                        new_text = chunk[len(accumulated_text):]
-                        accumulated_text = chunk
-                        yield ("token", new_text)
-                    elif chunk != accumulated_text:
-                        # In case of unexpected format, send the chunk
-                        yield ("token", chunk)
-                        accumulated_text = chunk
-
-            # Yield citations after streaming is complete
-            citations_data = [c.model_dump() for c in retrieved_citations]
-            yield ("citation", citations_data)
-            
         except Exception as e:
             print(f"Error in streaming RAG pipeline: {e}")
             yield ("error", f"I encountered an error while processing your request: {str(e)}")
+
+    async def _stream_single_pass(self, prompt_with_context: str, user_role: str, retrieved_citations: List[SourceCitation]):
+        """
+        Streams one structured generation and emits its fields as they arrive.
+
+        StreamingChatResponse lists fallback_message, suggested_queries and confidence
+        before answer, so they are complete once the first answer characters appear.
+        Time-to-first-token is a single model round-trip.
+        """
+        system_prompt = (
+            f"You are a helpful assistant for HMSREG documentation.\n"
+            f"Target Audience Role: {user_role}\n\n"
+            f"CRITICAL INSTRUCTIONS:\n"
+            f"- Answer the user's question in the same language as the question.\n"
+            f"- Synthesize information from ALL context sources into ONE cohesive, flowing answer.\n"
+            f"- DO NOT repeat the same information multiple times, even if it appears in multiple context sources.\n"
+            f"- Each piece of information should appear ONLY ONCE in your answer.\n"
+            f"- NEVER copy sentences or paragraphs verbatim from the context.\n"
+            f"- Be concise, clear, and to the point. Avoid redundancy.\n"
+            f"- If the context contains overlapping information, merge it into a single coherent explanation.\n"
+            f"- Complete your sentences - never cut off mid-sentence.\n\n"
+            f"Additional Guidelines:\n"
+            f"- Adapt your tone and focus to be most helpful to a {user_role}.\n"
+            f"- If the user's query is too broad or ambiguous, populate 'suggested_queries' with 2-3 specific follow-up questions "
+            f"and keep 'answer' to a concise statement guiding the user to the suggestions.\n"
+            f"- If you don't know the answer based on the context, say so.\n"
+            f"You must output a JSON object matching the schema, filling the fields in order."
+        )
+
+        # Only the length of the answer already sent is tracked, so each partial costs O(delta)
+        sent_length = 0
+        control_sent = False
+        final = None
+
+        async with self.single_pass_agent.run_stream(prompt_with_context, instructions=system_prompt) as result:
+            # Debouncing bounds how often pydantic-ai re-validates the growing JSON document
+            debounce_by = settings.STREAM_COALESCE_INTERVAL_MS / 1000 or None
+            async for partial in result.stream_output(debounce_by=debounce_by):
+                final = partial
+                if not partial.answer:
+                    continue
+
+                if not control_sent:
+                    # Control fields precede the answer, so they are final at this point
+                    control_sent = True
+                    fallback = self._single_pass_fallback(partial)
+                    if fallback:
+                        yield ("fallback", fallback)
+                        return
+                    if partial.suggested_queries:
+                        yield ("suggestions", partial.suggested_queries)
+
+                if len(partial.answer) > sent_length:
+                    yield ("token", partial.answer[sent_length:])
+                    sent_length = len(partial.answer)
+
+        if final is None:
+            return
+
+        if not control_sent:
+            # The model produced no answer text; only the control fields are left
+            fallback = self._single_pass_fallback(final)
+            if fallback:
+                yield ("fallback", fallback)
+                return
+            if final.suggested_queries:
+                yield ("suggestions", final.suggested_queries)
+
+        citations_data = [c.model_dump() for c in retrieved_citations]
+        yield ("citation", citations_data)
+
+    @staticmethod
+    def _single_pass_fallback(output: StreamingChatResponse) -> Optional[str]:
+        """Returns the fallback message to send instead of the answer, if any."""
+        if output.fallback_message:
+            return output.fallback_message
+        if output.confidence is not None and output.confidence < settings.RAG_CONFIDENCE_THRESHOLD:
+            return FALLBACK_MESSAGE
+        return None
+
+    async def _stream_two_pass(self, prompt_with_context: str, user_role: str, retrieved_citations: List[SourceCitation]):
+        """
+        Legacy streaming: a full structured run to detect fallback/suggestions,
+        followed by a second, streamed text run for the answer.
+        """
+        system_prompt = (
+            f"You are a helpful assistant for HMSREG documentation.\n"
+            f"Target Audience Role: {user_role}\n\n"
+            f"Instructions:\n"
+            f"- Answer the user's question based strictly on the provided context. "
+            f"Synthesize information from multiple sources if necessary to provide a comprehensive answer, "
+            f"but avoid direct repetition or verbatim copying of content. Be concise and to the point.\n"
+            f"- Adapt your tone and focus to be most helpful to a {user_role}.\n"
+            f"- If the user's query is too broad or ambiguous, identify it as such.\n"
+            f"- Populate the 'suggested_queries' field of the ChatResponse with 2-3 specific, relevant follow-up questions or topics if ambiguity is detected.\n"
+            f"- If 'suggested_queries' are provided, the 'answer' field should be a concise statement acknowledging the ambiguity and guiding the user to the suggestions.\n"
+            f"If you don't know the answer based on the context, just say that you don't know. "
+            f"You must output a JSON object matching the ChatResponse schema."
+        )
+        
+        # First, get a complete ChatResponse object to check for fallback or suggestions
+        full_response_result = await self.agent.run(prompt_with_context, instructions=system_prompt)
+        full_response = full_response_result.output # Changed from .data
+
+        # Handle fallback message
+        if full_response.fallback_message:
+            yield ("fallback", full_response.fallback_message)
+            return
+
+        # Handle suggested queries
+        if full_response.suggested_queries:
+            yield ("suggestions", full_response.suggested_queries)
+            # If suggestions are provided, the answer might be very short or empty,
+            # so we might not need to stream anything further, or just stream the short answer.
+            # For now, let's assume if suggestions are primary, the main answer streaming is secondary/empty.
+            if full_response.answer:
+                # Yield a very short answer if any, before citations
+                yield ("token", full_response.answer)
+            citations_data = [c.model_dump() for c in retrieved_citations]
+            yield ("citation", citations_data)
+            return
+
+        # If no fallback or suggestions, proceed with streaming the main answer
+        # We still need a system prompt that doesn't expect a Pydantic object for the streaming agent
+        streaming_system_prompt = (
+            f"You are a helpful assistant for HMSREG documentation.\n"
+            f"Target Audience Role: {user_role}\n\n"
+            f"CRITICAL INSTRUCTIONS:\n"
+            f"- Answer the user's question in the same language as the question.\n"
+            f"- Synthesize information from ALL context sources into ONE cohesive, flowing answer.\n"
+            f"- DO NOT repeat the same information multiple times, even if it appears in multiple context sources.\n"
+            f"- Each piece of information should appear ONLY ONCE in your answer.\n"
+            f"- NEVER copy sentences or paragraphs verbatim from the context.\n"
+            f"- Be concise, clear, and to the point. Avoid redundancy.\n"
+            f"- If the context contains overlapping information, merge it into a single coherent explanation.\n"
+            f"- Complete your sentences - never cut off mid-sentence.\n"
+            f"- Adapt your tone and focus to be most helpful to a {user_role}.\n"
+            f"If you don't know the answer, just say that you don't know."
+        )
+
+        async with self.streaming_agent.run_stream(prompt_with_context, instructions=streaming_system_prompt) as result:
+            # Ask pydantic-ai for deltas directly; coalescing happens in stream_chat_response
+            async for delta in result.stream_text(delta=True, debounce_by=None):
+                if delta:
+                    yield ("token", delta)
+
+        # Yield citations after streaming is complete
+        citations_data = [c.model_dump() for c in retrieved_citations]
+        yield ("citation", citations_data)
@@ -0,0 +1,52 @@
+import logging
+from typing import Optional, Dict, Any
+
+from app.services.chat_service import ChatService
+from app.rag.embeddings import create_embedding_client
+
+logger = logging.getLogger(__name__)
+
+class ServiceRegistry:
+    """
+    Process-wide holder for long-lived services.
+
+    Created once in the FastAPI lifespan (see app.main) and stored on
+    app.state.services, so requests reuse one warmed ChatService instead of
+    building new agents for every call.
+    """
+
+    def __init__(self):
+        self.chat_service: Optional[ChatService] = None
+        self.ready: bool = False
+        self.error: Optional[str] = None
+
+    def start(self) -> None:
+        """
+        Builds and warms all services. A failure is recorded in the readiness
+        state instead of being raised, so the app can still serve health checks.
+        """
+        try:
+            self.chat_service = ChatService(embedding_client=create_embedding_client())
+            self.ready = True
+            self.error = None
+            logger.info("ChatService initialized and ready.")
+        except Exception as e:
+            self.chat_service = None
+            self.ready = False
+            self.error = str(e)
+            logger.error(f"Failed to initialize ChatService: {e}")
+
+    def shutdown(self) -> None:
+        """Releases resources and drops references to all services."""
+        if self.chat_service is not None:
+            self.chat_service.embedding_client.close()
+        self.chat_service = None
+        self.ready = False
+
+    def status(self) -> Dict[str, Any]:
+        """Returns the readiness state for the health endpoint."""
+        return {
+            "ready": self.ready,
+            "services": {"chat_service": self.chat_service is not None},
+            "error": self.error,
+        }
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from typing import AsyncIterator, List, Optional, Tuple, Any
+
+from app.core.config import settings
+
+async def coalesce_tokens(
+    events: AsyncIterator[Tuple[str, Any]],
+    min_chars: int = settings.STREAM_COALESCE_MIN_CHARS,
+    interval_ms: int = settings.STREAM_COALESCE_INTERVAL_MS,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Merges consecutive ("token", text) events into larger frames.
+
+    Buffered text is flushed once it reaches min_chars characters or interval_ms
+    milliseconds have passed since the last flush (also while waiting for the
+    next event), and always before any non-token event and at the end of the
+    stream. With both limits at 0 every token is passed through unchanged.
+    """
+    buffer: List[str] = []
+    buffered_chars = 0
+    last_flush = time.monotonic()
+    interval = interval_ms / 1000
+    iterator = events.__aiter__()
+    # The next event while text is buffered; not cancelled on a flush, so the stream isn't interrupted
+    pending: Optional[asyncio.Future] = None
+
+    try:
+        while True:
+            try:
+                if buffer:
+                    # Wait for the next event only until the buffered text is due, so a pause
+                    # of the model doesn't hold back what it already produced
+                    if pending is None:
+                        pending = asyncio.ensure_future(iterator.__anext__())
+                    done, _ = await asyncio.wait({pending}, timeout=max(0.0, last_flush + interval - time.monotonic()))
+                    if not done:
+                        yield ("token", "".join(buffer))
+                        buffer, buffered_chars = [], 0
+                        last_flush = time.monotonic()
+                        continue
+                    event_type, content = pending.result()
+                elif pending is not None:
+                    event_type, content = await pending
+                else:
+                    event_type, content = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            pending = None
+
+            if event_type != "token":
+                if buffer:
+                    yield ("token", "".join(buffer))
+                    buffer, buffered_chars = [], 0
+                    last_flush = time.monotonic()
+                yield (event_type, content)
+                continue
+
+            buffer.append(content)
+            buffered_chars += len(content)
+            now = time.monotonic()
+            if buffered_chars >= min_chars or now - last_flush >= interval:
+                yield ("token", "".join(buffer))
+                buffer, buffered_chars = [], 0
+                last_flush = now
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+    if buffer:
+        yield ("token", "".join(buffer))
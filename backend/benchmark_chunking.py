@@ -0,0 +1,202 @@
+"""
+Compares the character splitter (2000/400 characters) with the structured,
+token-aware chunker on a corpus of crawled pages: index size, embedding cost,
+retrieval hit rate and the tokens each query retrieves.
+
+The corpus is the crawl cache (see INGEST_CRAWL_CACHE_PATH) or --html files.
+Queries come from a --queries JSONL file ({"query": ..., "answer": ...} per
+line) or are synthesized from the pages: each heading's path is a query whose
+answer is the start of the section's first sentence. A query hits when a
+retrieved chunk contains its answer. Retrieval is scored offline with TF-IDF,
+or with Gemini embeddings with --gemini.
+
+    python benchmark_chunking.py
+    python benchmark_chunking.py --html tests/rag/golden/*.html --top_k 3
+"""
+import argparse
+import asyncio
+import json
+import math
+import re
+import sys
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.core.config import settings
+from app.rag.chunking import HEADING_PATH_SEPARATOR, StructuredChunker, approximate_token_count
+from app.rag.crawl_cache import CrawlCache
+from app.rag.extraction import ExtractedPage, extract_page
+
+ANSWER_WORDS = 12 # Words of a section's first sentence that make up a synthesized answer
+EMBED_BATCH_SIZE = 100
+_WORD_PATTERN = re.compile(r"\w+")
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def load_pages(cache_path: str, html_paths: Sequence[str]) -> List[ExtractedPage]:
+    """Extracts every page of the corpus that has content."""
+    if html_paths:
+        documents = []
+        for path in html_paths:
+            with open(path, encoding="utf-8") as f:
+                documents.append(f.read())
+    else:
+        cache = CrawlCache(cache_path)
+        try:
+            documents = [cache.get(url).html for url in cache.urls()]
+        finally:
+            cache.close()
+    pages = [extract_page(html) for html in documents]
+    return [page for page in pages if page.content]
+
+def synthesize_queries(pages: Sequence[ExtractedPage]) -> List[Tuple[str, str]]:
+    """(heading path, start of the section's first sentence) for every heading followed by text."""
+    queries = []
+    for page in pages:
+        headings: List[Tuple[int, str]] = []
+        for (level, text), (next_level, next_text) in zip(page.blocks, page.blocks[1:]):
+            if not level:
+                continue
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, text))
+            if next_level:
+                continue
+            first_sentence = re.split(r"(?<=[.!?])\s", next_text, maxsplit=1)[0]
+            answer = " ".join(first_sentence.split()[:ANSWER_WORDS])
+            queries.append((HEADING_PATH_SEPARATOR.join(heading for _, heading in headings), answer))
+    return queries
+
+def load_queries(path: str) -> List[Tuple[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        return [(entry["query"], entry["answer"]) for entry in map(json.loads, f) if entry]
+
+class TfidfRetriever:
+    """Offline stand-in for embedding search: cosine similarity of TF-IDF vectors."""
+
+    def __init__(self, chunks: Sequence[str]):
+        counts = [Counter(_WORD_PATTERN.findall(chunk.lower())) for chunk in chunks]
+        document_frequency = Counter(term for count in counts for term in count)
+        self.idf = {term: math.log((1 + len(chunks)) / (1 + df)) + 1 for term, df in document_frequency.items()}
+        self.postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        for index, count in enumerate(counts):
+            weights = {term: tf * self.idf[term] for term, tf in count.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for term, weight in weights.items():
+                self.postings[term].append((index, weight / norm))
+
+    def search(self, queries: Sequence[str], top_k: int) -> List[List[int]]:
+        results = []
+        for query in queries:
+            scores: Dict[int, float] = defaultdict(float)
+            for term, tf in Counter(_WORD_PATTERN.findall(query.lower())).items():
+                for index, weight in self.postings.get(term, ()):
+                    scores[index] += tf * self.idf[term] * weight
+            results.append(sorted(scores, key=scores.get, reverse=True)[:top_k])
+        return results
+
+class GeminiRetriever:
+    """Embedding search with the ingestion's embedding model."""
+
+    def __init__(self, chunks: Sequence[str]):
+        from app.rag.embeddings import GeminiEmbeddingClient
+        import google.generativeai as genai
+        import os
+
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        self.client = GeminiEmbeddingClient()
+        vectors = asyncio.run(self._embed(list(chunks), "retrieval_document"))
+        self.matrix = self._unit(vectors)
+
+    async def _embed(self, texts: List[str], task_type: str) -> List[List[float]]:
+        batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+        results = await asyncio.gather(*(self.client.embed_many(batch, task_type) for batch in batches))
+        return [vector for result in results for vector in result]
+
+    @staticmethod
+    def _unit(vectors: List[List[float]]) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    def search(self, queries: Sequence[str], top_k: int) -> List[List[int]]:
+        query_matrix = self._unit(asyncio.run(self._embed(list(queries), "retrieval_query")))
+        scores = query_matrix @ self.matrix.T
+        return [list(np.argsort(-row)[:top_k]) for row in scores]
+
+def evaluate(chunks: List[str], queries: Sequence[Tuple[str, str]], retriever_cls, top_k: int) -> Dict[str, float]:
+    """Hit rates and MRR, and the tokens retrieved per query (larger chunks hit more often, at that cost)."""
+    normalized = [_normalize(chunk) for chunk in chunks]
+    tokens = [approximate_token_count(chunk) for chunk in chunks]
+    ranked = retriever_cls(chunks).search([query for query, _ in queries], top_k) if queries else []
+    hits_at_1 = hits_at_k = reciprocal_ranks = context_tokens = 0.0
+    for (_, answer), indices in zip(queries, ranked):
+        context_tokens += sum(tokens[index] for index in indices)
+        answer = _normalize(answer)
+        rank = next((position for position, index in enumerate(indices, 1) if answer in normalized[index]), None)
+        if rank is not None:
+            hits_at_1 += rank == 1
+            hits_at_k += 1
+            reciprocal_ranks += 1 / rank
+    total = max(len(queries), 1)
+    return {
+        "hit@1": hits_at_1 / total, f"hit@{top_k}": hits_at_k / total, "mrr": reciprocal_ranks / total,
+        "context_tokens": context_tokens / total,
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare the character splitter and the structured chunker.")
+    parser.add_argument("--cache", type=str, default=settings.INGEST_CRAWL_CACHE_PATH,
+                        help="Crawl cache to read the pages from.")
+    parser.add_argument("--html", nargs="*", default=[],
+                        help="HTML files to use as the corpus instead of the crawl cache.")
+    parser.add_argument("--queries", type=str,
+                        help="JSONL file of {\"query\", \"answer\"} objects; synthesized from headings if omitted.")
+    parser.add_argument("--top_k", type=int, default=5, help="Chunks retrieved per query.")
+    parser.add_argument("--gemini", action="store_true",
+                        help="Score retrieval with Gemini embeddings instead of offline TF-IDF.")
+    args = parser.parse_args()
+
+    pages = load_pages(args.cache, args.html)
+    if not pages:
+        print("No pages with content in the corpus.", file=sys.stderr)
+        return 1
+    queries = load_queries(args.queries) if args.queries else synthesize_queries(pages)
+    content_chars = sum(len(page.content) for page in pages)
+
+    character_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=2000, chunk_overlap=400, length_function=len, is_separator_regex=False,
+    )
+    structured_chunker = StructuredChunker()
+    splitters = {
+        "character": lambda page: character_splitter.split_text(page.content),
+        "structured": lambda page: [chunk.text for chunk in structured_chunker.split(page.blocks)],
+    }
+    retriever_cls = GeminiRetriever if args.gemini else TfidfRetriever
+
+    print(f"{len(pages)} pages, {content_chars} characters of content, {len(queries)} queries "
+          f"({'Gemini' if args.gemini else 'TF-IDF'} retrieval)")
+    header = f"{'splitter':<12}{'chunks':>8}{'chars':>10}{'dup %':>8}{'tokens':>10}{'max tok':>9}"
+    header += f"{'hit@1':>8}{f'hit@{args.top_k}':>8}{'mrr':>8}{'ctx tok':>9}"
+    print(header)
+    for name, split in splitters.items():
+        chunks = [chunk for page in pages for chunk in split(page)]
+        tokens = [approximate_token_count(chunk) for chunk in chunks]
+        chars = sum(len(chunk) for chunk in chunks)
+        # Stored characters beyond the content itself: overlap and heading path lines
+        duplication = 100 * (chars - content_chars) / content_chars
+        scores = evaluate(chunks, queries, retriever_cls, args.top_k)
+        print(f"{name:<12}{len(chunks):>8}{chars:>10}{duplication:>8.1f}{sum(tokens):>10}{max(tokens, default=0):>9}"
+              + f"{scores['hit@1']:>8.3f}{scores[f'hit@{args.top_k}']:>8.3f}{scores['mrr']:>8.3f}"
+              + f"{scores['context_tokens']:>9.0f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
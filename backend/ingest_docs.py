@@ -17,84 +17,126 @@ print(f"DATABASE_URL from environment: {os.getenv('DATABASE_URL')}")
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
 # Assuming data_processor.py is in the project root
-from data_processor import get_and_chunk_text
+from data_processor import get_and_chunk_text_with_embeddings
 # These imports are now relative within the 'backend' package
-from app.rag.vector_store import get_collection, add_chunks_to_collection
+from app.rag.vector_store import get_vector_store, add_chunks_to_collection
+from app.rag.incremental import IngestionManifest, content_hash, sync_chunks
+from app.rag.batch_embedder import BatchEmbedder
+from app.rag.embeddings import GeminiEmbeddingClient
+from app.rag.embedding_cache import DocumentEmbeddingCache, SQLiteEmbeddingStore
+from app.rag.corpus_dedup import CorpusDedupIndex
 from app.core.config import settings
 
 # Initialize ChromaDB client
 # This should be PersistentClient if you want to save the data
 CHROMA_CLIENT = chromadb.PersistentClient(path=settings.CHROMA_PERSIST_DIRECTORY)
 COLLECTION_NAME = "hmsreg_docs"
+EMBEDDING_MODEL = "models/text-embedding-004" # Must match data_processor.py
 
-async def ingest_documents(urls: list[str]):
+async def ingest_documents(urls: list[str], incremental: bool = False):
+    """
+    Fetches, chunks and embeds the given URLs into the collection.
+    With incremental=True the collection is kept: only chunks whose text changed are
+    embedded and upserted, and chunks of pages that are gone are deleted.
+    """
     print(f"Starting document ingestion for {len(urls)} URLs...")
     
     all_processed_chunks = []
+    manifest = None
+    # Boilerplate repeated across pages is stored once, with all of its source URLs
+    corpus_index = CorpusDedupIndex()
     
-    # Optional: Clear existing collection before re-ingesting
-    try:
-        CHROMA_CLIENT.delete_collection(name=COLLECTION_NAME)
-        print(f"Cleared existing ChromaDB collection: {COLLECTION_NAME}")
-    except Exception as e:
-        print(f"Could not delete collection (might not exist yet): {e}")
+    if incremental:
+        manifest = IngestionManifest.from_collection(CHROMA_CLIENT, COLLECTION_NAME)
+        print(f"Incremental ingestion: {len(manifest.chunk_hashes)} chunks already stored.")
+
+    # Every embedding request, for de-duplication and for the chunks still missing one
+    # afterwards, goes through one embedder: batched, rate limited and retried
+    embedding_client = GeminiEmbeddingClient(model=EMBEDDING_MODEL)
+    embedding_store = SQLiteEmbeddingStore(settings.INGEST_EMBEDDING_CACHE_PATH) if settings.INGEST_EMBEDDING_CACHE_PATH else None
+    cache = DocumentEmbeddingCache(embedding_store, EMBEDDING_MODEL) if embedding_store else None
+    embedder = BatchEmbedder(embedding_client, cache=cache)
+    loop = asyncio.get_running_loop()
 
-    # Ensure collection exists after potential deletion
-    collection = get_collection(CHROMA_CLIENT, COLLECTION_NAME)
-    print(f"Using ChromaDB collection: {collection.name}")
+    def embed(texts):
+        # Called from the worker thread that chunks the page; the embedder runs on this loop
+        # (failed texts come back empty and are embedded again, with the dead letter retries, at the end)
+        return asyncio.run_coroutine_threadsafe(embedder.submit(texts), loop).result()
 
-    for url in urls:
-        print(f"\nProcessing URL: {url}")
-        chunks = get_and_chunk_text(url) # This now returns semantically de-duplicated chunks
+    try:
+        for url in urls:
+            print(f"\nProcessing URL: {url}")
+            # Semantically de-duplicated chunks, with the embeddings computed for de-duplication
+            chunks = await asyncio.to_thread(get_and_chunk_text_with_embeddings, url, embed)
 
-        if chunks:
-            for i, chunk_content in enumerate(chunks):
-                # For simplicity, using a basic title extraction and chunk_id
-                # In a real scenario, you might extract title more robustly from HTML
-                # And create a more stable chunk_id
-                title = "Untitled Document" # Placeholder, consider improving this in data_processor or here
+            if chunks:
+                page_chunks = []
+                for i, (chunk_content, chunk_embedding) in enumerate(chunks):
+                    # For simplicity, using a basic title extraction and chunk_id
+                    # In a real scenario, you might extract title more robustly from HTML
+                    # And create a more stable chunk_id
+                    title = "Untitled Document" # Placeholder, consider improving this in data_processor or here
                 
-                # Try to get a better title from the URL if possible, or use the HTML title
-                # For this specific URL structure, extracting an ID might be useful for title
-                if "ID=" in url:
-                    try:
-                        title_id = url.split("ID=")[-1]
-                        title = f"HMSREG Document {title_id}"
-                    except:
-                        pass # Fallback to "Untitled Document"
+                    # Try to get a better title from the URL if possible, or use the HTML title
+                    # For this specific URL structure, extracting an ID might be useful for title
+                    if "ID=" in url:
+                        try:
+                            title_id = url.split("ID=")[-1]
+                            title = f"HMSREG Document {title_id}"
+                        except:
+                            pass # Fallback to "Untitled Document"
                 
-                all_processed_chunks.append({
-                    "content": chunk_content,
-                    "url": url,
-                    "title": title,
-                    "chunk_id": f"{url}_{i}" # Unique ID for each chunk
-                })
-        else:
-            print(f"No chunks returned for URL: {url}")
+                    page_chunks.append({
+                        "content": chunk_content,
+                        "url": url,
+                        "title": title,
+                        "chunk_id": f"{url}_{i}", # Unique ID for each chunk
+                        "content_hash": content_hash(chunk_content),
+                        "embedding": chunk_embedding,
+                    })
+                all_processed_chunks.extend(corpus_index.filter(page_chunks))
+                if manifest is not None:
+                    manifest.seen_urls.add(url)
+            else:
+                print(f"No chunks returned for URL: {url}")
+
+        print(f"Cross-page de-duplication dropped {corpus_index.dropped} chunks.")
+        corpus_index.apply_source_urls(all_processed_chunks)
 
-    if all_processed_chunks:
+        # Only chunks whose de-duplication embedding failed are still missing one
+        missing = await embedder.embed_chunks(all_processed_chunks, manifest)
+    finally:
+        embedding_client.close()
+        if embedding_store is not None:
+            embedding_store.close()
+    if missing:
+        print(f"{missing} chunks could not be embedded and are not stored in this run.")
+
+    if manifest is not None:
+        try:
+            counts = sync_chunks(CHROMA_CLIENT, all_processed_chunks, manifest, COLLECTION_NAME)
+            print(f"Incremental ingestion into '{COLLECTION_NAME}' finished: {counts}")
+        except Exception as e:
+            print(f"Error during incremental ingestion: {e}")
+    elif all_processed_chunks:
         print(f"\nTotal processed unique chunks for indexing: {len(all_processed_chunks)}")
-        # Generate embeddings for all chunks in a batch for efficiency
-        # Note: genai.embed_content can take a list of strings
+        staging = None
         try:
-            print("Generating embeddings for all chunks...")
-            all_contents = [chunk['content'] for chunk in all_processed_chunks]
-            embeddings_response = genai.embed_content(
-                model="models/text-embedding-004",
-                content=all_contents,
-                task_type="retrieval_document"
-            )
-            all_embeddings = embeddings_response["embedding"]
-
-            # Attach embeddings back to their respective chunks
-            for i, chunk in enumerate(all_processed_chunks):
-                chunk['embedding'] = all_embeddings[i]
-            
-            # Now add to ChromaDB
-            added_count = add_chunks_to_collection(CHROMA_CLIENT, all_processed_chunks, COLLECTION_NAME)
-            print(f"Successfully added {added_count} chunks to ChromaDB collection '{COLLECTION_NAME}'.")
+            # Add to a new collection version and point the alias at it once it's complete,
+            # so queries keep hitting the previous version during the rebuild
+            store = get_vector_store(CHROMA_CLIENT)
+            staging = store.create_versioned_collection(COLLECTION_NAME)
+            added_count = add_chunks_to_collection(CHROMA_CLIENT, all_processed_chunks, staging.name)
+            if added_count:
+                store.swap_alias(COLLECTION_NAME, staging.name)
+                print(f"Successfully added {added_count} chunks to '{staging.name}', now serving as '{COLLECTION_NAME}'.")
+            else:
+                store.delete_collection(staging.name)
+                print(f"No chunks were added; '{COLLECTION_NAME}' is unchanged.")
         except Exception as e:
             print(f"Error during embedding generation or adding to ChromaDB: {e}")
+            if staging is not None and store.resolve_alias(COLLECTION_NAME) != staging.name:
+                store.delete_collection(staging.name)
     else:
         print("No chunks to add to ChromaDB.")
 
@@ -108,4 +150,4 @@ if __name__ == "__main__":
         "https://docs.hmsreg.com/?Area-ID=10000&ID=10318"
     ]
     
-    asyncio.run(ingest_documents(DOC_URLS_SMALL_SUBSET))
+    asyncio.run(ingest_documents(DOC_URLS_SMALL_SUBSET, incremental="--incremental" in sys.argv))
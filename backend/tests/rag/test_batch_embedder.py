@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+import pytest
+
+from app.rag.batch_embedder import BatchEmbedder, TokenBucket
+from app.rag.embedding_cache import DocumentEmbeddingCache, SQLiteEmbeddingStore
+from app.rag.embeddings import EmbeddingClient
+
+class FlakyEmbeddingClient(EmbeddingClient):
+    """Fails the first `failures` calls, and every call that contains a text in `poison`."""
+
+    def __init__(self, failures: int = 0, poison: tuple = ()):
+        self.failures = failures
+        self.poison = set(poison)
+        self.batches = []
+
+    async def embed_many(self, texts, task_type="retrieval_document"):
+        self.batches.append(list(texts))
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("429 Resource exhausted")
+        if self.poison & set(texts):
+            raise ValueError("Invalid input")
+        return [[float(len(text)), 1.0] for text in texts]
+
+def _embedder(client, **kwargs):
+    options = dict(batch_size=3, max_concurrency=2, requests_per_minute=60000, max_retries=2, backoff_seconds=0)
+    options.update(kwargs)
+    return BatchEmbedder(client, **options)
+
+@pytest.mark.asyncio
+async def test_texts_are_embedded_in_fixed_size_batches():
+    """Verifies that texts are split into batches of batch_size and results keep their order."""
+    client = FlakyEmbeddingClient()
+    texts = [f"tekst {'x' * i}" for i in range(7)]
+
+    embeddings = await _embedder(client).embed(texts)
+
+    assert embeddings == [[float(len(text)), 1.0] for text in texts]
+    assert sorted(len(batch) for batch in client.batches) == [1, 3, 3]
+
+@pytest.mark.asyncio
+async def test_failed_batches_are_retried():
+    """Verifies that transient failures are retried with backoff instead of losing the batch."""
+    client = FlakyEmbeddingClient(failures=2)
+    embedder = _embedder(client, max_concurrency=1)
+
+    embeddings = await embedder.embed(["a", "bb", "ccc"])
+
+    assert all(embeddings)
+    assert len(client.batches) == 3
+    assert embedder.dead_letter == []
+
+@pytest.mark.asyncio
+async def test_poison_items_end_up_in_dead_letter():
+    """Verifies that a text failing its batch is retried alone, so the rest of the batch is kept."""
+    client = FlakyEmbeddingClient(poison=("ødelagt",))
+    embedder = _embedder(client)
+
+    embeddings = await embedder.embed(["a", "ødelagt", "ccc", "dddd"])
+
+    assert embeddings[1] == []
+    assert all(embeddings[i] for i in (0, 2, 3))
+    assert embedder.dead_letter == ["ødelagt"]
+
+@pytest.mark.asyncio
+async def test_submitted_pages_share_full_batches():
+    """Verifies that the texts of concurrently submitted small pages are embedded together in batches of batch_size."""
+    client = FlakyEmbeddingClient()
+    embedder = _embedder(client, batch_size=4, max_concurrency=1, linger_seconds=0.05)
+    pages = [[f"side {page} bit {i}" for i in range(2)] for page in range(6)]
+
+    results = await asyncio.gather(*(embedder.submit(texts) for texts in pages))
+
+    assert results == [[[float(len(text)), 1.0] for text in texts] for texts in pages]
+    assert [len(batch) for batch in client.batches] == [4, 4, 4]
+
+@pytest.mark.asyncio
+async def test_submitted_texts_of_failed_batches_are_not_dead_lettered():
+    """Verifies that submit() leaves a failed batch's texts empty instead of retrying them one by one."""
+    client = FlakyEmbeddingClient(poison=("ødelagt",))
+    embedder = _embedder(client, max_retries=0)
+
+    embeddings = await embedder.submit(["a", "ødelagt", "ccc", "dddd"])
+
+    assert embeddings[:3] == [[], [], []]
+    assert embeddings[3] == [4.0, 1.0]
+    assert client.batches == [["a", "ødelagt", "ccc"], ["dddd"]]
+    assert embedder.dead_letter == []
+
+@pytest.mark.asyncio
+async def test_embed_chunks_only_embeds_chunks_without_embedding():
+    """Verifies that chunks embedded earlier (e.g. for de-duplication) are not embedded again."""
+    client = FlakyEmbeddingClient(poison=("feil",))
+    chunks = [
+        {"chunk_id": "a#0", "content": "ferdig", "embedding": [0.5, 0.5]},
+        {"chunk_id": "a#1", "content": "ny"},
+        {"chunk_id": "a#2", "content": "feil", "embedding": []},
+    ]
+
+    missing = await _embedder(client).embed_chunks(chunks)
+
+    assert missing == 1
+    assert chunks[0]["embedding"] == [0.5, 0.5]
+    assert chunks[1]["embedding"] == [2.0, 1.0]
+    assert chunks[2]["embedding"] == []
+    assert ["ferdig"] not in client.batches
+
+@pytest.mark.asyncio
+async def test_cached_texts_are_not_sent_again(tmp_path):
+    """Verifies that a second run only sends the texts that weren't embedded before."""
+    store = SQLiteEmbeddingStore(str(tmp_path / "documents.sqlite3"))
+    client = FlakyEmbeddingClient()
+    cache = DocumentEmbeddingCache(store, "models/test")
+
+    first = await _embedder(client, cache=cache).embed(["a", "bb"])
+    second = await _embedder(client, cache=cache).embed(["a", "bb", "ccc"])
+
+    assert second[:2] == first
+    assert client.batches == [["a", "bb"], ["ccc"]]
+    store.close()
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    """Verifies that acquisitions beyond the burst capacity wait for the refill."""
+    bucket = TokenBucket(rate=50, capacity=2)
+    start = time.monotonic()
+    for _ in range(7):
+        await bucket.acquire()
+
+    assert time.monotonic() - start >= 0.09 # 5 tokens beyond the burst at 50/s
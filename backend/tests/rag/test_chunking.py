@@ -0,0 +1,77 @@
+import pytest
+
+from app.rag.chunking import StructuredChunker, approximate_token_count
+from app.rag.ingestion import HMSREGDocumentationScraper
+
+def _words(text):
+    return len(text.split())
+
+def _sentences(prefix, count, words=5):
+    return " ".join(f"{prefix}{i} " + " ".join(["ord"] * (words - 2)) + " slutt." for i in range(count))
+
+def test_approximate_token_count_adds_up_over_whitespace():
+    """Verifies that the token estimate counts punctuation and started 4-character word pieces."""
+    assert approximate_token_count("HMS-kort") == 3
+    assert approximate_token_count("mannskapsliste") == 4
+    assert approximate_token_count("HMS-kort mannskapsliste") == 7
+
+def test_sections_get_heading_paths_and_small_sections_merge():
+    """Verifies that chunks start with their heading path and that sections below min_tokens share a chunk."""
+    blocks = [
+        (1, "HMS-kort"), (0, _sentences("a", 4)),
+        (2, "Bestilling"), (0, _sentences("b", 4)),
+        (2, "Kort"), (0, "Kort tekst."),
+        (2, "Levering"), (0, _sentences("c", 4)),
+    ]
+    chunks = StructuredChunker(max_tokens=40, min_tokens=10, overlap_tokens=0, token_counter=_words).split(blocks)
+
+    assert [chunk.heading_path for chunk in chunks] == [["HMS-kort"], ["HMS-kort", "Bestilling"], ["HMS-kort"]]
+    assert chunks[0].text.startswith("HMS-kort\na0")
+    assert chunks[1].text.startswith("HMS-kort > Bestilling\nb0")
+    # "Kort" is too small to stand alone and takes the next section along, under their common path
+    assert chunks[2].text.startswith("HMS-kort > Kort\nKort tekst.\nLevering\nc0")
+
+def test_long_sections_respect_max_tokens_and_overlap_only_within_a_section():
+    """Verifies that long sections split at sentences within max_tokens, with overlap only inside the section."""
+    blocks = [(1, "Mannskap"), (0, _sentences("m", 12)), (1, "Rapporter"), (0, _sentences("r", 12))]
+    chunker = StructuredChunker(max_tokens=25, min_tokens=5, overlap_tokens=6, token_counter=_words)
+    chunks = chunker.split(blocks)
+
+    assert all(_words(chunk.text) <= 25 for chunk in chunks)
+    assert chunks[0].text.startswith("Mannskap\n")
+    first_rapporter = next(i for i, chunk in enumerate(chunks) if chunk.heading_path == ["Rapporter"])
+    # Continued chunks repeat the previous chunk's last sentence under the heading path
+    continued = chunks[1].text.split("\n")
+    assert continued[0] == "Mannskap"
+    assert continued[1] == chunks[0].text.split("\n")[-1]
+    # A new section starts fresh, without text of the previous one
+    assert chunks[first_rapporter].text.startswith("Rapporter\nr0")
+
+    # Every block's text ends up in a chunk
+    text = " ".join(chunk.text.replace("\n", " ") for chunk in chunks)
+    for sentence in _sentences("m", 12).split(". ") + _sentences("r", 12).split(". "):
+        assert sentence.rstrip(".") in text
+
+def test_words_longer_than_max_tokens_are_kept_whole():
+    """Verifies that text without sentence ends is split at words, and that an overlong word becomes its own chunk."""
+    chunks = StructuredChunker(max_tokens=4, min_tokens=1, overlap_tokens=0).split([(0, "a " * 6 + "x" * 40)])
+    assert [chunk.text for chunk in chunks] == ["a a a a", "a a", "x" * 40]
+    assert all(chunk.heading_path == [] for chunk in chunks)
+
+def test_overlap_must_be_smaller_than_max_tokens():
+    """Verifies that an overlap that leaves no room for new text is rejected."""
+    with pytest.raises(ValueError):
+        StructuredChunker(max_tokens=10, overlap_tokens=10)
+
+def test_scraper_stores_heading_paths_with_the_structured_chunker():
+    """Verifies that _build_chunks chunks the page's blocks and records each chunk's heading path."""
+    scraper = HMSREGDocumentationScraper("https://docs.hmsreg.com/", browser=None)
+    scraper.has_api_key = False
+    scraper.chunker = StructuredChunker(max_tokens=20, min_tokens=5, overlap_tokens=0, token_counter=_words)
+    blocks = [(1, "HMS-kort"), (0, _sentences("a", 3)), (2, "Bestilling"), (0, _sentences("b", 3))]
+    content = " ".join(text for _, text in blocks)
+
+    chunks = scraper._build_chunks("https://docs.hmsreg.com/?ID=1", "HMS-kort", content, blocks)
+
+    assert [chunk["heading_path"] for chunk in chunks] == ["HMS-kort", "HMS-kort > Bestilling"]
+    assert chunks[1]["content"].startswith("HMS-kort > Bestilling\nb0")
@@ -0,0 +1,76 @@
+from app.rag.corpus_dedup import CorpusDedupIndex
+from app.rag.vector_store import chunk_metadata
+
+def _chunk(url, i, content, embedding=None):
+    return {"url": url, "title": "Tittel", "chunk_id": f"{url}#{i}", "content": content, "embedding": embedding or []}
+
+def test_exact_duplicates_across_pages_are_merged():
+    """Verifies that repeated boilerplate is kept once and records every page it appeared on."""
+    index = CorpusDedupIndex()
+    login = "Logg inn i HMSREG med BankID."
+    first = index.filter([_chunk("a", 0, login), _chunk("a", 1, "Om HMS-kort.")])
+    second = index.filter([_chunk("b", 0, "  logg inn i HMSREG   med BankID. "), _chunk("b", 1, "Mannskapslister.")])
+
+    assert [chunk["chunk_id"] for chunk in first] == ["a#0", "a#1"]
+    assert [chunk["chunk_id"] for chunk in second] == ["b#1"]
+    assert index.source_urls == {"a#0": ["a", "b"]}
+    assert index.dropped == 1
+
+    index.apply_source_urls(first)
+
+    metadata = chunk_metadata(first[0])
+    assert metadata["url"] == "a"
+    assert metadata["source_urls"] == "a b"
+    assert "source_urls" not in chunk_metadata(first[1])
+
+def test_near_duplicate_embeddings_are_merged_into_best_match():
+    """Verifies that a chunk with a near-identical embedding is recorded on the chunk it matches."""
+    index = CorpusDedupIndex(threshold=0.95)
+    first = index.filter([_chunk("a", 0, "Første", [1.0, 0.0]), _chunk("a", 1, "Andre", [0.0, 1.0])])
+    second = index.filter([_chunk("b", 0, "Nesten andre", [0.01, 0.99]), _chunk("b", 1, "Ny", [1.0, 1.0])])
+    third = index.filter([_chunk("c", 0, "Nesten andre", [0.5, 0.5])]) # Same text as a dropped chunk
+
+    assert [chunk["chunk_id"] for chunk in second] == ["b#1"]
+    assert third == []
+    assert index.source_urls == {"a#1": ["a", "b", "c"]}
+
+def test_source_urls_of_stored_chunks_are_updated(tmp_path):
+    """Verifies that chunks written before a later page merged into them get their source URLs."""
+    import chromadb
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    collection = client.create_collection("hmsreg_docs")
+    index = CorpusDedupIndex()
+    kept = index.filter([_chunk("a", 0, "Logg inn med BankID.", [1.0, 0.0])])
+    collection.add(ids=["a#0"], documents=["Logg inn med BankID."], embeddings=[[1.0, 0.0]], metadatas=[chunk_metadata(kept[0])])
+    index.filter([_chunk("b", 0, "Logg inn med BankID.", [1.0, 0.0])])
+
+    assert index.update_source_urls(client, "hmsreg_docs") == 1
+    metadata = collection.get(ids=["a#0"])["metadatas"][0]
+    assert metadata["url"] == "a"
+    assert metadata["source_urls"] == "a b"
+
+def test_resumed_run_restores_the_index_from_stored_chunks(tmp_path):
+    """Verifies that a resumed run de-duplicates against chunks of finished pages and keeps their source URLs."""
+    import chromadb
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    collection = client.create_collection("hmsreg_docs")
+    index = CorpusDedupIndex()
+    stored = index.filter([_chunk("a", 0, "Logg inn med BankID.", [1.0, 0.0]), _chunk("a", 1, "Om HMS-kort.", [0.0, 1.0])])
+    stored += index.filter([_chunk("x", 0, "Mannskapslister.", [0.7, 0.7])]) # Written, but not marked done
+    index.filter([_chunk("b", 0, "Logg inn med BankID.", [1.0, 0.0])])
+    collection.add(
+        ids=[chunk["chunk_id"] for chunk in stored], documents=[chunk["content"] for chunk in stored],
+        embeddings=[chunk["embedding"] for chunk in stored], metadatas=[chunk_metadata(chunk) for chunk in stored],
+    )
+
+    # The run stops; the new one only has the collection and the checkpointed source URLs
+    resumed = CorpusDedupIndex()
+    assert resumed.restore(client, "hmsreg_docs", {"a", "b"}, index.source_urls_snapshot()) == 2
+    kept = resumed.filter([_chunk("c", 0, "  logg inn med BankID. "), _chunk("c", 1, "Nesten HMS-kort", [0.01, 0.99])])
+    again = resumed.filter([_chunk("x", 0, "Mannskapslister.", [0.7, 0.7])])
+
+    assert kept == []
+    assert resumed.source_urls == {"a#0": ["a", "b", "c"], "a#1": ["a", "c"]}
+    assert resumed.dropped == 2
+    # Pages that weren't finished are processed again and keep their own chunks
+    assert [chunk["chunk_id"] for chunk in again] == ["x#0"]
@@ -0,0 +1,222 @@
+import asyncio
+import pytest
+
+from app.rag.crawler import AsyncCrawler
+from app.rag.ingestion import HMSREGDocumentationScraper
+
+BASE = "https://docs.hmsreg.com/"
+
+def _html(title, text):
+    return (
+        f'<html><body><div data-object-id="dsProcedure" class="content">'
+        f'<h1>{title}</h1><p>{text} Denne teksten er lang nok til å bli med som innhold.</p></div></body></html>'
+    )
+
+SITE = {
+    BASE + "?ID=1": (_html("Start", "Startside."), [BASE + "?ID=2", BASE + "?ID=3", "https://external.com/"]),
+    BASE + "?ID=2": (_html("HMS-kort", "Om HMS-kort."), [BASE + "?ID=1", BASE + "?ID=4"]),
+    BASE + "?ID=3": (_html("Mannskap", "Om mannskapslister."), []),
+    BASE + "?ID=4": (_html("Dypt", "For dypt."), []),
+}
+
+class FakePage:
+    def __init__(self, stats):
+        self.stats = stats
+        self.url = None
+
+    async def close(self):
+        self.stats["pages_closed"] += 1
+
+    async def goto(self, url, wait_until=None):
+        self.url = url
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        await asyncio.sleep(0.02)
+        self.stats["in_flight"] -= 1
+
+    async def wait_for_selector(self, selector, state=None, timeout=None):
+        return None
+
+    async def content(self):
+        return SITE[self.url][0]
+
+    async def title(self):
+        return "Side"
+
+    async def evaluate(self, script):
+        return SITE[self.url][1]
+
+class FakeContext:
+    def __init__(self, stats):
+        self.stats = stats
+
+    async def new_page(self):
+        self.stats["pages_opened"] += 1
+        return FakePage(self.stats)
+
+    async def route(self, pattern, handler):
+        self.stats["route"] = handler
+
+    async def close(self):
+        self.stats["closed"] += 1
+
+class FakeBrowser:
+    def __init__(self):
+        self.stats = {"in_flight": 0, "max_in_flight": 0, "closed": 0, "pages_opened": 0, "pages_closed": 0}
+
+    async def new_context(self, **options):
+        return FakeContext(self.stats)
+
+@pytest.mark.asyncio
+async def test_crawler_fetches_concurrently_and_respects_depth():
+    """Verifies that pages load concurrently, links are followed to max_depth, and chunks keep discovery order."""
+    browser = FakeBrowser()
+    scraper = HMSREGDocumentationScraper(BASE, browser=None)
+    scraper.has_api_key = False
+
+    crawler = AsyncCrawler(scraper, browser, concurrency=3, contexts=2)
+    chunks = await crawler.crawl([BASE + "?ID=1"], max_depth=1)
+
+    assert [c["url"] for c in chunks] == [BASE + "?ID=1", BASE + "?ID=2", BASE + "?ID=3"]
+    assert [c["title"] for c in chunks] == ["Start", "HMS-kort", "Mannskap"]
+    assert chunks[0]["chunk_id"] == BASE + "?ID=1#0"
+    assert browser.stats["max_in_flight"] == 2 # Both depth-1 pages loaded at once
+    assert browser.stats["closed"] == 2
+
+@pytest.mark.asyncio
+async def test_crawler_per_host_limit():
+    """Verifies that the per-host limit caps concurrency below the page pool size."""
+    browser = FakeBrowser()
+    scraper = HMSREGDocumentationScraper(BASE, browser=None)
+    scraper.has_api_key = False
+
+    crawler = AsyncCrawler(scraper, browser, concurrency=4, per_host_concurrency=1)
+    chunks = await crawler.crawl(list(SITE), max_depth=0)
+
+    assert len(chunks) == 4
+    assert browser.stats["max_in_flight"] == 1
+
+class FakeRequest:
+    def __init__(self, resource_type, url):
+        self.resource_type = resource_type
+        self.url = url
+
+class FakeRoute:
+    def __init__(self, resource_type, url):
+        self.request = FakeRequest(resource_type, url)
+        self.outcome = None
+
+    async def abort(self):
+        self.outcome = "aborted"
+
+    async def continue_(self):
+        self.outcome = "continued"
+
+@pytest.mark.asyncio
+async def test_crawler_profile_blocks_resources_and_recycles_pages():
+    """Verifies that the browser profile aborts unneeded requests and pages are replaced after page_max_uses loads."""
+    from app.rag.browser_profile import BrowserProfile
+
+    browser = FakeBrowser()
+    scraper = HMSREGDocumentationScraper(BASE, browser=None)
+    scraper.has_api_key = False
+    profile = BrowserProfile(page_max_uses=2)
+
+    crawler = AsyncCrawler(scraper, browser, concurrency=1, profile=profile)
+    chunks = await crawler.crawl(list(SITE), max_depth=0)
+
+    assert len(chunks) == 4
+    assert browser.stats["pages_opened"] == 2 and browser.stats["pages_closed"] == 1
+
+    outcomes = []
+    for resource_type, url in [
+        ("document", BASE + "?ID=1"),
+        ("script", BASE + "app.js"),
+        ("image", BASE + "logo.png"),
+        ("font", BASE + "font.woff2"),
+        ("script", "https://www.googletagmanager.com/gtm.js"),
+    ]:
+        route = FakeRoute(resource_type, url)
+        await browser.stats["route"](route)
+        outcomes.append(route.outcome)
+    assert outcomes == ["continued", "continued", "aborted", "aborted", "aborted"]
+    assert profile.stats == {"allowed": 2, "blocked": 3}
+
+def _pipeline(write, **kwargs):
+    from app.rag.batch_embedder import BatchEmbedder
+    from app.rag.embeddings import FakeEmbeddingClient
+    from app.rag.pipeline import IngestionPipeline
+
+    scraper = HMSREGDocumentationScraper(BASE, browser=None)
+    scraper.has_api_key = False
+    scraper.defer_embedding = True
+    crawler = AsyncCrawler(scraper, FakeBrowser(), concurrency=1)
+    embedder = BatchEmbedder(FakeEmbeddingClient(dimension=8), batch_size=2, max_concurrency=1, requests_per_minute=60000)
+    return IngestionPipeline(crawler, embedder, write, flush_size=2, queue_pages=1, **kwargs)
+
+@pytest.mark.asyncio
+async def test_pipeline_writes_embedded_chunks_in_flushes(tmp_path):
+    """Verifies that chunks are embedded and written in bounded flushes, and pages are only done once written."""
+    from app.rag.corpus_dedup import CorpusDedupIndex
+    from app.rag.frontier import CrawlFrontier
+
+    flushes = []
+    def write(chunks):
+        assert all(len(chunk["embedding"]) == 8 for chunk in chunks)
+        flushes.append([chunk["url"] for chunk in chunks])
+        return {"added": len(chunks)}
+
+    checkpoint = str(tmp_path / "frontier.json")
+    pipeline = _pipeline(write, checkpoint_path=checkpoint)
+    pipeline.crawler.scraper.corpus_index = CorpusDedupIndex()
+    pipeline.crawler.scraper.corpus_index.source_urls["tidligere#0"] = ["tidligere", "annen"]
+    counts = await pipeline.run(list(SITE))
+
+    assert [len(flush) for flush in flushes] == [2, 2]
+    assert sorted(url for flush in flushes for url in flush) == sorted(SITE)
+    assert counts["added"] == counts["chunks"] == counts["pages"] == 4
+    frontier = CrawlFrontier.load(checkpoint)
+    assert frontier.done == set(SITE)
+    # Cross-page merges are checkpointed, so a resumed run can restore them
+    assert frontier.metadata["source_urls"] == {"tidligere#0": ["tidligere", "annen"]}
+
+@pytest.mark.asyncio
+async def test_pipeline_checkpoint_only_counts_written_pages(tmp_path):
+    """Verifies that a failed flush leaves its pages pending in the checkpoint, so a resumed run retries them."""
+    from app.rag.frontier import CrawlFrontier
+
+    written = []
+    def write(chunks):
+        if written:
+            raise RuntimeError("ChromaDB unavailable")
+        written.extend(chunk["url"] for chunk in chunks)
+
+    checkpoint = str(tmp_path / "frontier.json")
+    with pytest.raises(RuntimeError):
+        await _pipeline(write, checkpoint_path=checkpoint).run(list(SITE))
+
+    frontier = CrawlFrontier.load(checkpoint)
+    assert frontier.done == set(written)
+    assert len(frontier) == len(SITE) - len(written)
+
+@pytest.mark.asyncio
+async def test_crawler_embeds_for_deduplication_through_the_batch_embedder():
+    """Verifies that the crawler submits de-duplication embeddings to the BatchEmbedder, batched across pages."""
+    from unittest.mock import patch
+    from app.rag.batch_embedder import BatchEmbedder
+    from app.rag.embeddings import FakeEmbeddingClient
+
+    scraper = HMSREGDocumentationScraper(BASE, browser=None)
+    scraper.has_api_key = True
+    scraper.defer_embedding = True
+    client = FakeEmbeddingClient(dimension=8)
+    embedder = BatchEmbedder(client, batch_size=2, max_concurrency=1, requests_per_minute=60000, linger_seconds=0.5)
+    crawler = AsyncCrawler(scraper, FakeBrowser(), concurrency=2, embedder=embedder)
+
+    with patch('app.rag.ingestion.genai.embed_content', side_effect=AssertionError("unbatched embedding call")):
+        chunks = await crawler.crawl(list(SITE))
+
+    assert sorted(chunk["url"] for chunk in chunks) == sorted(SITE)
+    assert all(len(chunk["embedding"]) == 8 for chunk in chunks)
+    # One chunk per page, and the pages share the batches of 2
+    assert client.calls == len(SITE) // 2
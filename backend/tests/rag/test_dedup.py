@@ -0,0 +1,83 @@
+import numpy as np
+
+from app.rag.dedup import ChunkDeduplicator, EmbeddingDeduplicator, greedy_dedup, normalize_embeddings
+
+def test_text_rules_drop_near_duplicates():
+    """Verifies that exact, substring, overlap and first-sentence duplicates are dropped."""
+    documents = [
+        "Du bestiller HMS-kort i HMSREG. Kortet sendes til arbeidsgiver.",
+        "du bestiller hms-kort i hmsreg. kortet sendes til arbeidsgiver.",  # exact after normalizing
+        "Kortet sendes til arbeidsgiver.",  # substring
+        "Du bestiller HMS-kort i HMSREG. Noe helt annet her.",  # same first sentence
+        "Mannskapslister registreres daglig av entreprenøren.",
+    ]
+    assert ChunkDeduplicator().select(documents) == [0, 4]
+
+def test_cosine_rule_uses_embeddings():
+    """Verifies that chunks with near-identical embeddings are dropped."""
+    documents = ["første tekst", "andre tekst om noe", "tredje avsnitt"]
+    embeddings = [[1.0, 0.0], [0.99, 0.01], [0.0, 1.0]]
+    dedup = ChunkDeduplicator(jaccard_threshold=None, cosine_threshold=0.95)
+
+    assert dedup.select(documents, embeddings) == [0, 2]
+    assert dedup.select(documents) == [0, 1, 2]  # No embeddings: text rules only
+
+def test_limit_stops_after_enough_chunks():
+    """Verifies that selection stops once the limit is reached."""
+    documents = [f"avsnitt {i} handler om tema {i * 7}" for i in range(10)]
+    assert ChunkDeduplicator(jaccard_threshold=None, first_sentence=False).select(documents, limit=3) == [0, 1, 2]
+
+def test_normalize_embeddings_handles_zero_vectors():
+    """Verifies that rows are unit length and zero vectors stay zero."""
+    matrix = normalize_embeddings([[3.0, 4.0], [0.0, 0.0]])
+    assert matrix[0].tolist() == [0.6000000238418579, 0.800000011920929]
+    assert matrix[1].tolist() == [0.0, 0.0]
+
+def _pairwise_greedy(matrix, threshold):
+    """The per-pair loop greedy_dedup replaces."""
+    kept = []
+    for i, row in enumerate(matrix):
+        if all(np.dot(row, matrix[j]) / (np.linalg.norm(row) * np.linalg.norm(matrix[j])) <= threshold for j in kept):
+            kept.append(i)
+    return kept
+
+def test_greedy_dedup_matches_pairwise_loop_across_blocks():
+    """Verifies that blockwise greedy keep-first selects the same rows as the pairwise loop."""
+    rng = np.random.default_rng(0)
+    base = rng.standard_normal((40, 16))
+    noisy = base[[3, 10, 25, 39, 3]] + 0.01 * rng.standard_normal((5, 16))
+    matrix = np.concatenate([base, noisy])[rng.permutation(45)]
+
+    expected = _pairwise_greedy(matrix, 0.95)
+    assert len(expected) == 40
+    assert greedy_dedup(matrix, 0.95, block_size=7) == expected
+    assert greedy_dedup(matrix.tolist(), 0.95) == expected
+    assert greedy_dedup([]) == []
+
+def test_embedding_deduplicator_spans_add_calls():
+    """Verifies that later pages are de-duplicated against chunks kept from earlier ones."""
+    dedup = EmbeddingDeduplicator(threshold=0.95)
+
+    assert dedup.add([[1.0, 0.0], [0.0, 1.0]]) == [True, True]
+    assert dedup.add([[0.99, 0.01], [1.0, 1.0], [1.0, 1.01]]) == [False, True, False]
+    assert len(dedup) == 3
+
+def test_embedding_deduplicator_switches_to_lsh_index():
+    """Verifies that the approximate index still catches near-duplicates of earlier rows."""
+    rng = np.random.default_rng(1)
+    base = rng.standard_normal((300, 64))
+    dedup = EmbeddingDeduplicator(block_size=32, approximate_after=100)
+
+    assert all(dedup.add(base))
+    assert dedup.approximate
+
+    near_duplicates = base + 0.01 * rng.standard_normal(base.shape)
+    fresh = rng.standard_normal((20, 64))
+    keep = dedup.add(np.concatenate([near_duplicates, fresh]))
+    assert keep == [False] * 300 + [True] * 20
+
+def test_add_with_matches_points_duplicates_at_kept_rows():
+    """Verifies that every row maps to its own kept position or to the kept row it duplicates."""
+    dedup = EmbeddingDeduplicator(threshold=0.95)
+    assert dedup.add_with_matches([[1.0, 0.0], [0.0, 1.0], [0.99, 0.01]]) == ([True, True, False], [0, 1, 0])
+    assert dedup.add_with_matches([[1.0, 1.0], [0.01, 1.0], [1.0, 1.01]]) == ([True, False, False], [2, 1, 2])
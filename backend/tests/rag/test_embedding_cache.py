@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+from unittest.mock import patch
+
+from app.rag.embedding_cache import DocumentEmbeddingCache, EmbeddingCache, SQLiteEmbeddingStore, make_cache_key
+from app.rag.embeddings import CachedEmbeddingClient, FakeEmbeddingClient
+
+def test_cache_key_normalizes_query_text():
+    """Verifies that whitespace and case differences map to the same key, but model and task type do not."""
+    key = make_cache_key("Hvordan bestiller jeg  HMS-kort?", "models/text-embedding-004", "retrieval_query")
+    assert key == make_cache_key(" hvordan bestiller jeg HMS-kort? ", "models/text-embedding-004", "retrieval_query")
+    assert key != make_cache_key("hvordan bestiller jeg HMS-kort?", "models/other", "retrieval_query")
+    assert key != make_cache_key("hvordan bestiller jeg HMS-kort?", "models/text-embedding-004", "retrieval_document")
+
+def test_lru_eviction_and_counters():
+    """Verifies that the least recently used entry is evicted and hits/misses are counted."""
+    cache = EmbeddingCache(max_entries=2, ttl_seconds=None)
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    assert cache.get("a") == [1.0] # "a" becomes most recently used
+    cache.put("c", [3.0])
+
+    assert cache.get("b") is None
+    assert cache.get("c") == [3.0]
+    assert cache.stats() == {"hits": 2, "misses": 1, "size": 2}
+
+def test_ttl_expiry():
+    """Verifies that entries expire after the TTL."""
+    cache = EmbeddingCache(max_entries=10, ttl_seconds=60)
+    with patch('app.rag.embedding_cache.time.monotonic', return_value=1000.0):
+        cache.put("a", [1.0])
+    with patch('app.rag.embedding_cache.time.monotonic', return_value=1059.0):
+        assert cache.get("a") == [1.0]
+    with patch('app.rag.embedding_cache.time.monotonic', return_value=1061.0):
+        assert cache.get("a") is None
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    """Verifies that the on-disk tier serves entries to a fresh cache instance."""
+    path = str(tmp_path / "embeddings.sqlite3")
+    cache = EmbeddingCache(store=SQLiteEmbeddingStore(path))
+    cache.put("a", [0.5, 0.25])
+    cache.store.close()
+
+    restarted = EmbeddingCache(store=SQLiteEmbeddingStore(path))
+    assert restarted.get("a") == [0.5, 0.25]
+    assert restarted.stats()["size"] == 1 # Promoted to memory
+    restarted.store.close()
+
+@pytest.mark.asyncio
+async def test_cached_client_embeds_repeated_queries_once():
+    """Verifies that repeated queries are served from the cache."""
+    inner = FakeEmbeddingClient(dimension=8)
+    client = CachedEmbeddingClient(inner, EmbeddingCache())
+
+    first = await client.embed("Hvordan bestiller jeg HMS-kort?")
+    second = await client.embed("hvordan bestiller jeg hms-kort?")
+    batch = await client.embed_many(["hvordan bestiller jeg hms-kort?", "nytt spørsmål"], task_type="retrieval_query")
+
+    assert first == second == batch[0]
+    assert inner.calls == 2 # One single embed, one batch for the uncached text
+
+@pytest.mark.asyncio
+async def test_cached_client_reads_disk_tier_off_the_event_loop(tmp_path):
+    """Verifies that the disk tier is used from worker threads and that memory and disk hits are the same vector."""
+    path = str(tmp_path / "embeddings.sqlite3")
+    store = SQLiteEmbeddingStore(path)
+    threads = []
+    get_many, put_many = store.get_many, store.put_many
+    store.get_many = lambda *args: threads.append(threading.current_thread()) or get_many(*args)
+    store.put_many = lambda *args: threads.append(threading.current_thread()) or put_many(*args)
+
+    client = CachedEmbeddingClient(FakeEmbeddingClient(dimension=8), EmbeddingCache(store=store))
+    first = await client.embed("Hvordan bestiller jeg HMS-kort?")
+    from_memory = await client.embed("Hvordan bestiller jeg HMS-kort?")
+    store.close()
+
+    restarted = CachedEmbeddingClient(FakeEmbeddingClient(dimension=8), EmbeddingCache(store=SQLiteEmbeddingStore(path)))
+    from_disk = await restarted.embed("Hvordan bestiller jeg HMS-kort?")
+    restarted.cache.store.close()
+
+    assert first == from_memory == from_disk
+    assert restarted.inner.calls == 0
+    assert threads and threading.main_thread() not in threads
+
+def test_document_cache_only_embeds_new_text(tmp_path):
+    """Verifies that re-embedding the same chunk text is served from disk, byte for byte."""
+    store = SQLiteEmbeddingStore(str(tmp_path / "documents.sqlite3"))
+    cache = DocumentEmbeddingCache(store, "models/test")
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return [[float(len(text)), 0.5] for text in texts]
+
+    first = cache.embed(["Om HMS-kort", "Mannskapslister"], embed)
+    second = cache.embed(["Om HMS-kort", "om hms-kort", "Nytt avsnitt"], embed)
+
+    assert calls == [["Om HMS-kort", "Mannskapslister"], ["om hms-kort", "Nytt avsnitt"]]
+    assert second[0] == first[0]
+    assert (cache.hits, cache.misses) == (1, 4)
+    key = make_cache_key("Om HMS-kort", "models/test", "retrieval_document", normalize=False)
+    assert set(store.get_many([key, "missing"])) == {key}
+    store.close()
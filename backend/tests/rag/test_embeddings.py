@@ -0,0 +1,85 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import patch
+
+from app.rag.embeddings import FakeEmbeddingClient, GeminiEmbeddingClient, CachedEmbeddingClient, create_embedding_client
+
+@pytest.mark.asyncio
+async def test_fake_client_is_deterministic():
+    """Verifies that the fake client returns the same unit vector for the same text."""
+    client = FakeEmbeddingClient(dimension=16)
+    first = await client.embed("hvordan bestiller jeg HMS-kort?")
+    second = await client.embed("hvordan bestiller jeg HMS-kort?")
+    other = await client.embed("noe helt annet")
+
+    assert first == second
+    assert first != other
+    assert len(first) == 16
+    assert sum(v * v for v in first) == pytest.approx(1.0)
+
+@pytest.mark.asyncio
+async def test_gemini_client_does_not_block_event_loop():
+    """Verifies that a slow embed call runs off the event loop."""
+    def slow_embed(model, content, task_type):
+        time.sleep(0.2)
+        return {"embedding": [0.1] * 768}
+
+    with patch('app.rag.embeddings.genai.embed_content', side_effect=slow_embed):
+        client = GeminiEmbeddingClient(max_concurrency=2, timeout=5)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        embedding = await client.embed("test")
+        ticker_task.cancel()
+        client.close()
+
+    assert len(embedding) == 768
+    assert ticks > 5 # The loop kept running while the embed call was in flight
+
+@pytest.mark.asyncio
+async def test_gemini_client_timeout():
+    """Verifies that embed calls are bounded by the configured timeout."""
+    def hanging_embed(model, content, task_type):
+        time.sleep(0.5)
+        return {"embedding": [0.1] * 768}
+
+    with patch('app.rag.embeddings.genai.embed_content', side_effect=hanging_embed):
+        client = GeminiEmbeddingClient(max_concurrency=1, timeout=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await client.embed("test")
+        client.close()
+
+@pytest.mark.asyncio
+async def test_gemini_client_timed_out_calls_keep_their_slot():
+    """Verifies that a timed-out call holds its concurrency slot until its thread returns."""
+    def hanging_embed(model, content, task_type):
+        time.sleep(0.2)
+        return {"embedding": [0.1] * 768}
+
+    with patch('app.rag.embeddings.genai.embed_content', side_effect=hanging_embed):
+        client = GeminiEmbeddingClient(max_concurrency=1, timeout=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await client.embed("test")
+        assert client._semaphore.locked() # The thread is still busy
+        await asyncio.sleep(0.3)
+        assert not client._semaphore.locked()
+        client.close()
+
+def test_create_embedding_client_backends():
+    """Verifies backend selection and rejection of unknown backends."""
+    assert isinstance(create_embedding_client("fake", cached=False), FakeEmbeddingClient)
+    gemini = create_embedding_client("gemini", cached=False)
+    assert isinstance(gemini, GeminiEmbeddingClient)
+    gemini.close()
+    cached = create_embedding_client("fake", cached=True)
+    assert isinstance(cached, CachedEmbeddingClient)
+    assert isinstance(cached.inner, FakeEmbeddingClient)
+    with pytest.raises(ValueError):
+        create_embedding_client("unknown")
@@ -0,0 +1,44 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from app.rag.extraction import HTMLExtractor, extract_page
+from app.rag.ingestion import HMSREGDocumentationScraper
+
+GOLDEN_DIR = Path(__file__).parent / "golden"
+PAGES = ["article", "short_article", "malformed_article"]
+# Both backends must reproduce the golden text
+PARSERS = ["html.parser", "lxml"]
+
+def _golden(name):
+    html = (GOLDEN_DIR / f"{name}.html").read_text(encoding="utf-8")
+    expected = json.loads((GOLDEN_DIR / f"{name}.json").read_text(encoding="utf-8"))
+    return html, (expected["title"], expected["content"])
+
+@pytest.mark.parametrize("parser", PARSERS)
+@pytest.mark.parametrize("name", PAGES)
+def test_extract_page_matches_golden_files(name, parser):
+    """Verifies that title and content are byte-identical to the golden output of the extraction rules."""
+    if parser == "lxml":
+        pytest.importorskip("lxml")
+    html, expected = _golden(name)
+    page = extract_page(html, parser)
+    assert (page.title, page.content) == expected
+    # The structured blocks hold exactly the extracted text
+    assert " ".join(text for _, text in page.blocks) == page.content
+    assert (
+        HMSREGDocumentationScraper._extract_title_from_html(html),
+        HMSREGDocumentationScraper._extract_content_from_html(html),
+    ) == expected
+
+@pytest.mark.asyncio
+async def test_extractor_process_pool_matches_golden_files():
+    """Verifies that extraction in worker processes returns the same text as in-process extraction."""
+    extractor = HTMLExtractor(max_workers=1)
+    try:
+        for name in PAGES:
+            html, expected = _golden(name)
+            assert (await extractor.extract(html))[:2] == expected
+    finally:
+        extractor.close()
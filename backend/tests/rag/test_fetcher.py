@@ -0,0 +1,190 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.rag.crawl_cache import CrawlCache
+from app.rag.crawler import AsyncCrawler
+from app.rag.fetcher import StaticFetcher
+from app.rag.incremental import IngestionManifest
+from app.rag.ingestion import HMSREGDocumentationScraper
+
+STATIC_PAGE = (
+    '<html><head><title> Registrering  av HMS-kort </title></head><body>'
+    '<div data-object-id="dsProcedure" class="content"><h1>HMS-kort</h1>'
+    '<p>Slik registrerer du et HMS-kort. Denne teksten er lang nok til å bli med som innhold.</p>'
+    '<a href="/rendered">Neste</a> <a href="?ID=3#topp">Samme side</a></div></body></html>'
+)
+# Content rendered by JavaScript: the static HTML has no content div
+RENDERED_SHELL = '<html><head><title>Laster</title></head><body><div id="app"></div></body></html>'
+RENDERED_PAGE = (
+    '<html><body><div data-object-id="dsProcedure" class="content"><h1>Mannskap</h1>'
+    '<p>Om mannskapslister. Denne teksten er lang nok til å bli med som innhold.</p></div></body></html>'
+)
+ETAG = '"v1"'
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path.startswith("/static"):
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = STATIC_PAGE
+        elif self.path.startswith("/rendered"):
+            body = RENDERED_SHELL
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        if self.path.startswith("/static"):
+            self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+@pytest.mark.asyncio
+async def test_static_fetch_and_conditional_get(site, tmp_path):
+    """Verifies that server-rendered pages are fetched without a browser and refetched with a conditional GET."""
+    server, base = site
+    fetcher = StaticFetcher(cache=CrawlCache(str(tmp_path / "pages.sqlite3")))
+    try:
+        html, title, hrefs, unchanged = await fetcher.fetch(base + "/static?ID=3")
+        assert html == STATIC_PAGE
+        assert title == "Registrering av HMS-kort"
+        assert hrefs == [base + "/rendered", base + "/static?ID=3#topp"]
+        assert not unchanged
+
+        assert await fetcher.fetch(base + "/static?ID=3") == (html, title, hrefs, True)
+        assert server.requests[-1] == ("/static?ID=3", ETAG)
+        assert fetcher.stats["not_modified"] == 1
+
+        assert await fetcher.fetch(base + "/rendered") is None # Needs the browser
+        assert await fetcher.fetch(base + "/missing") is None
+        assert fetcher.stats["static"] == 1 and fetcher.stats["fallback"] == 2
+    finally:
+        await fetcher.aclose()
+
+@pytest.mark.asyncio
+async def test_static_fetch_uses_the_crawl_cache_off_the_event_loop(site, tmp_path):
+    """Verifies that crawl cache reads and writes run in worker threads."""
+    _, base = site
+    cache = CrawlCache(str(tmp_path / "pages.sqlite3"))
+    threads = []
+    get, update = cache.get, cache.update
+    cache.get = lambda *args: threads.append(threading.current_thread()) or get(*args)
+    cache.update = lambda *args: threads.append(threading.current_thread()) or update(*args)
+    fetcher = StaticFetcher(cache=cache)
+    try:
+        await fetcher.fetch(base + "/static?ID=3")
+        await fetcher.fetch(base + "/static?ID=3")
+    finally:
+        await fetcher.aclose()
+
+    assert len(threads) == 3 # Two lookups, one store (the second fetch is a 304)
+    assert threading.main_thread() not in threads
+
+class _BrowserPage:
+    def __init__(self, loaded):
+        self.loaded = loaded
+
+    async def goto(self, url, wait_until=None):
+        self.loaded.append(url)
+
+    async def wait_for_selector(self, selector, state=None, timeout=None):
+        return None
+
+    async def content(self):
+        return RENDERED_PAGE
+
+    async def title(self):
+        return "Mannskap"
+
+    async def evaluate(self, script):
+        return []
+
+class _BrowserContext:
+    def __init__(self, loaded):
+        self.loaded = loaded
+
+    async def new_page(self):
+        return _BrowserPage(self.loaded)
+
+    async def close(self):
+        pass
+
+class _Browser:
+    def __init__(self):
+        self.loaded = []
+
+    async def new_context(self):
+        return _BrowserContext(self.loaded)
+
+@pytest.mark.asyncio
+async def test_crawler_falls_back_to_browser_only_without_static_content(site):
+    """Verifies that the crawler renders a page in the browser only when its static HTML lacks the content div."""
+    _, base = site
+    scraper = HMSREGDocumentationScraper(base + "/static?ID=3", browser=None)
+    scraper.has_api_key = False
+    browser = _Browser()
+    fetcher = StaticFetcher()
+    try:
+        crawler = AsyncCrawler(scraper, browser, concurrency=1, static_fetcher=fetcher)
+        chunks = await crawler.crawl([base + "/static?ID=3"], max_depth=1)
+    finally:
+        await fetcher.aclose()
+
+    assert [c["title"] for c in chunks] == ["HMS-kort", "Mannskap"]
+    assert browser.loaded == [base + "/rendered"]
+
+@pytest.mark.asyncio
+async def test_crawl_cache_skips_unchanged_pages_and_replays_offline(site, tmp_path):
+    """Verifies that unchanged stored pages skip processing on a re-crawl and that a crawl replays from snapshots."""
+    server, base = site
+    cache = CrawlCache(str(tmp_path / "pages.sqlite3"))
+
+    async def crawl(manifest=None, from_cache=False):
+        scraper = HMSREGDocumentationScraper(base + "/static?ID=3", browser=None)
+        scraper.has_api_key = False
+        scraper.manifest = manifest
+        fetcher = None if from_cache else StaticFetcher(cache=cache)
+        crawler = AsyncCrawler(
+            scraper, None if from_cache else _Browser(), concurrency=1,
+            static_fetcher=fetcher, crawl_cache=cache, from_cache=from_cache,
+        )
+        try:
+            return await crawler.crawl([base + "/static?ID=3"], max_depth=1)
+        finally:
+            if fetcher is not None:
+                await fetcher.aclose()
+
+    first = await crawl()
+    assert len(cache) == 2
+
+    # Both pages are stored; the static one answers 304, the rendered one has an identical snapshot
+    manifest = IngestionManifest()
+    manifest.page_hashes = {chunk["url"]: chunk["page_hash"] for chunk in first}
+    manifest.page_chunkers = {chunk["url"]: chunk["chunker"] for chunk in first}
+    assert await crawl(manifest) == []
+    assert manifest.unchanged_urls == {base + "/static?ID=3", base + "/rendered"}
+
+    requests = len(server.requests)
+    replayed = await crawl(from_cache=True)
+    assert [(c["chunk_id"], c["content"]) for c in replayed] == [(c["chunk_id"], c["content"]) for c in first]
+    assert len(server.requests) == requests
@@ -0,0 +1,35 @@
+from app.rag.frontier import CrawlFrontier, canonicalize_url
+
+def test_canonicalize_url():
+    """Verifies fragment removal, tracking parameter stripping and query sorting."""
+    assert canonicalize_url("HTTPS://Docs.HMSREG.com/?ID=10379&Area-ID=10000&utm_source=mail#top") == \
+        "https://docs.hmsreg.com/?Area-ID=10000&ID=10379"
+    assert canonicalize_url("https://docs.hmsreg.com") == "https://docs.hmsreg.com/"
+
+def test_frontier_is_fifo_and_admits_each_url_once():
+    """Verifies FIFO order, deduplication of equivalent URLs and the depth limit."""
+    frontier = CrawlFrontier(max_depth=1)
+    assert frontier.add("https://docs.hmsreg.com/?ID=1&Area-ID=10000")
+    assert not frontier.add("https://docs.hmsreg.com/?Area-ID=10000&ID=1#section")
+    assert frontier.add_many(["https://docs.hmsreg.com/?ID=2", "https://docs.hmsreg.com/?ID=3"], depth=1) == 2
+    assert not frontier.add("https://docs.hmsreg.com/?ID=4", depth=2)
+
+    assert frontier.pop() == ("https://docs.hmsreg.com/?Area-ID=10000&ID=1", 0)
+    assert frontier.pop() == ("https://docs.hmsreg.com/?ID=2", 1)
+    assert len(frontier) == 1
+
+def test_frontier_checkpoint_resumes_in_flight_urls(tmp_path):
+    """Verifies that a saved frontier resumes unfinished URLs and remembers finished ones."""
+    frontier = CrawlFrontier()
+    frontier.add_many(["https://docs.hmsreg.com/?ID=1", "https://docs.hmsreg.com/?ID=2", "https://docs.hmsreg.com/?ID=3"])
+    done, _ = frontier.pop()
+    frontier.mark_done(done)
+    frontier.pop() # In flight when the crawl stops
+
+    path = str(tmp_path / "frontier.json")
+    frontier.save(path)
+    restored = CrawlFrontier.load(path)
+
+    assert [restored.pop()[0] for _ in range(len(restored))] == ["https://docs.hmsreg.com/?ID=2", "https://docs.hmsreg.com/?ID=3"]
+    assert restored.done == {"https://docs.hmsreg.com/?ID=1"}
+    assert not restored.add("https://docs.hmsreg.com/?ID=1")
@@ -0,0 +1,78 @@
+import chromadb
+import pytest
+
+from app.rag.incremental import IngestionManifest, sync_chunks
+from app.rag.ingestion import HMSREGDocumentationScraper
+from app.rag.vector_store import get_collection, get_collection_version
+
+URL_A = "https://docs.hmsreg.com/?ID=1"
+URL_B = "https://docs.hmsreg.com/?ID=2"
+
+PAGE_A = "HMS-kort bestilles i HMSREG av arbeidsgiver. " * 3
+PAGE_B = "Mannskapslister føres daglig på byggeplassen. " * 3
+
+@pytest.fixture
+def chroma_client(tmp_path):
+    return chromadb.PersistentClient(path=str(tmp_path / "chroma_data"))
+
+def _run(client, pages, embedded_texts, chunk_size=60):
+    """Runs one incremental ingestion of pages ({url: (title, content)}) and returns the sync counts."""
+    scraper = HMSREGDocumentationScraper("https://docs.hmsreg.com/", browser=None, chunk_size=chunk_size, chunk_overlap=0)
+    scraper.has_api_key = False
+    def fake_embeddings(texts):
+        embedded_texts.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+    scraper._get_embeddings = fake_embeddings
+
+    scraper.manifest = IngestionManifest.from_collection(client)
+    chunks = []
+    for url, (title, content) in pages.items():
+        chunks.extend(scraper._build_chunks(url, title, content))
+    return sync_chunks(client, chunks, scraper.manifest)
+
+def test_unchanged_refresh_makes_no_embedding_calls(chroma_client):
+    """Verifies that a second run over unchanged pages skips them without embedding or writing."""
+    first_calls, second_calls = [], []
+    counts = _run(chroma_client, {URL_A: ("HMS-kort", PAGE_A), URL_B: ("Mannskap", PAGE_B)}, first_calls)
+    version = get_collection_version(chroma_client)
+
+    assert counts["upserted"] == len(first_calls) > 0
+    assert _run(chroma_client, {URL_A: ("HMS-kort", PAGE_A), URL_B: ("Mannskap", PAGE_B)}, second_calls) == \
+        {"upserted": 0, "updated": 0, "deleted": 0}
+    assert second_calls == []
+    assert get_collection_version(chroma_client) == version
+
+def test_changed_and_removed_pages(chroma_client):
+    """Verifies that only changed chunks are re-embedded and chunks of shrunk or removed pages are deleted."""
+    _run(chroma_client, {URL_A: ("HMS-kort", PAGE_A), URL_B: ("Mannskap", PAGE_B)}, [])
+    version = get_collection_version(chroma_client)
+    stored_a = get_collection(chroma_client).get(where={"url": URL_A})["ids"]
+    stored_b = get_collection(chroma_client).get(where={"url": URL_B})["ids"]
+
+    calls = []
+    shorter_a = PAGE_A.split(". ")[0] + ". Ny tekst."
+    counts = _run(chroma_client, {URL_A: ("HMS-kort", shorter_a)}, calls)
+
+    remaining = get_collection(chroma_client).get()
+    assert set(remaining["ids"]) == {f"{URL_A}#0"}
+    assert calls == [remaining["documents"][0]]
+    assert counts["deleted"] == len(stored_a) - 1 + len(stored_b) # Shrunk page A plus all of page B
+    assert get_collection_version(chroma_client) != version
+
+def test_changed_chunker_settings_rebuild_every_page(chroma_client):
+    """Verifies that pages with unchanged content are chunked again once the chunker settings change."""
+    pages = {URL_A: ("HMS-kort", PAGE_A), URL_B: ("Mannskap", PAGE_B)}
+    _run(chroma_client, pages, [])
+
+    calls = []
+    counts = _run(chroma_client, pages, calls, chunk_size=90)
+
+    stored = get_collection(chroma_client).get()
+    assert calls and counts["upserted"] == len(calls)
+    assert {metadata["chunker"] for metadata in stored["metadatas"]} == {"character:90/0"}
+    # Skipping by unchanged HTML (without hashing the content) also needs the same chunker
+    manifest = IngestionManifest.from_collection(chroma_client)
+    assert manifest.mark_unchanged(URL_A, "character:90/0")
+    assert not manifest.mark_unchanged(URL_B, "character:60/0")
+    # And the rebuilt pages are current again
+    assert _run(chroma_client, pages, [], chunk_size=90) == {"upserted": 0, "updated": 0, "deleted": 0}
@@ -253,3 +253,17 @@ def test_full_ingestion_pipeline_integration(
         assert len(kwargs['documents']) == added_count
         assert len(kwargs['embeddings']) == added_count
         assert all(len(e) == 768 for e in kwargs['embeddings']) # Check embedding dimension
+
+def test_build_chunks_reuses_dedup_embeddings():
+    """Verifies that chunks are embedded once, for de-duplication, and those embeddings are stored."""
+    with patch.dict(os.environ, {"GOOGLE_API_KEY": "dummy_key"}), \
+         patch('app.rag.ingestion.genai') as mock_genai:
+        mock_genai.embed_content.side_effect = lambda model, content, task_type: {
+            'embedding': [[float(i), 1.0] for i, _ in enumerate(content)]
+        }
+        scraper = HMSREGDocumentationScraper(base_url="http://test.com", browser=None, chunk_size=50, chunk_overlap=0)
+        chunks = scraper._build_chunks("http://test.com/1", "Title", "Lorem ipsum dolor sit amet. " * 10)
+
+    assert mock_genai.embed_content.call_count == 1
+    assert len(chunks) > 1
+    assert all(chunk["embedding"] for chunk in chunks)
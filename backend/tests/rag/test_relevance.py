@@ -0,0 +1,11 @@
+from app.rag.relevance import select_relevant
+
+def test_select_relevant_applies_threshold_and_margin():
+    """Verifies the absolute cut-off and the adaptive margin around the best match."""
+    distances = [0.3, 0.5, 0.8, 1.2]
+
+    assert select_relevant(distances) == [0, 1, 2, 3]
+    assert select_relevant(distances, max_distance=1.0) == [0, 1, 2]
+    assert select_relevant(distances, max_distance=1.0, margin=0.25) == [0, 1]
+    assert select_relevant([1.4, 1.6], max_distance=1.0, margin=0.25) == []
+    assert select_relevant([]) == []
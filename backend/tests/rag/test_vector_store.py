@@ -0,0 +1,98 @@
+import chromadb
+import pytest
+from unittest.mock import MagicMock
+
+from app.rag.vector_store import (
+    VectorStore, get_vector_store, query_collection, query_collection_batch, delete_collection, get_collection_version
+)
+
+@pytest.fixture
+def chroma_client(tmp_path):
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma_data"))
+    collection = client.get_or_create_collection(name="hmsreg_docs")
+    collection.add(ids=["a", "b"], documents=["HMS-kort", "Mannskapsliste"], embeddings=[[1.0, 0.0], [0.0, 1.0]],
+                   metadatas=[{"url": "https://docs.hmsreg.com/?ID=1"}, {"url": "https://docs.hmsreg.com/?ID=2"}])
+    return client
+
+def test_collection_handle_is_resolved_once():
+    """Verifies that repeated lookups reuse the cached handle until it is invalidated."""
+    client = MagicMock()
+    store = VectorStore(client, revalidate_seconds=60)
+
+    assert store.get_collection("hmsreg_docs") is store.get_collection("hmsreg_docs")
+    client.get_or_create_collection.assert_called_once_with(name="hmsreg_docs")
+
+    store.delete_collection("hmsreg_docs")
+    store.get_collection("hmsreg_docs")
+    client.delete_collection.assert_called_once_with(name="hmsreg_docs")
+    assert client.get_or_create_collection.call_count == 2
+
+def test_module_helpers_share_one_store_per_client(chroma_client):
+    """Verifies that query_collection reuses the handle and sees a rebuild after delete_collection."""
+    assert get_vector_store(chroma_client) is get_vector_store(chroma_client)
+    version = get_collection_version(chroma_client)
+
+    assert query_collection(chroma_client, [1.0, 0.0], n_results=1).documents == ["HMS-kort"]
+
+    delete_collection(chroma_client)
+    assert get_collection_version(chroma_client) != version
+    assert query_collection(chroma_client, [1.0, 0.0], n_results=1).documents == []
+
+def test_stale_handle_is_retried(chroma_client):
+    """Verifies that a collection rebuilt behind the cache's back is re-resolved once."""
+    store = VectorStore(chroma_client, revalidate_seconds=60)
+    store.get_collection("hmsreg_docs")
+
+    chroma_client.delete_collection(name="hmsreg_docs")
+    chroma_client.get_or_create_collection(name="hmsreg_docs").add(
+        ids=["c"], documents=["Ny side"], embeddings=[[1.0, 0.0]], metadatas=[{"url": "https://docs.hmsreg.com/?ID=3"}]
+    )
+
+    assert store.query([1.0, 0.0], n_results=1).documents == ["Ny side"]
+
+def test_query_collection_batch_groups_filters(chroma_client):
+    """Verifies that batched queries keep input order and apply per-query filters."""
+    results = query_collection_batch(
+        chroma_client,
+        [[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]],
+        n_results=1,
+        where=[None, {"url": "https://docs.hmsreg.com/?ID=2"}, None],
+    )
+
+    assert [r.ids for r in results] == [["a"], ["b"], ["b"]]
+    assert results[0].documents == ["HMS-kort"]
+    assert results[0].distances[0] == pytest.approx(0.0)
+    assert results[1].distances[0] > results[0].distances[0]
+    assert query_collection_batch(chroma_client, []) == []
+
+def test_blue_green_swap_and_gc(chroma_client):
+    """Verifies that the alias keeps serving the old data until the swap, then the new version, and old versions are collected."""
+    store = VectorStore(chroma_client, revalidate_seconds=0)
+    staging = store.create_versioned_collection("hmsreg_docs")
+    assert staging.name == "hmsreg_docs__v1"
+    staging.add(ids=["c"], documents=["Ny side"], embeddings=[[1.0, 0.0]], metadatas=[{"url": "https://docs.hmsreg.com/?ID=3"}])
+
+    # Still the pre-alias collection while the new version is being built
+    assert store.query([1.0, 0.0], n_results=1).ids == ["a"]
+
+    store.swap_alias("hmsreg_docs", staging.name, grace_seconds=3600)
+    assert store.resolve_alias("hmsreg_docs") == "hmsreg_docs__v1"
+    assert store.query([1.0, 0.0], n_results=1).ids == ["c"]
+    assert "hmsreg_docs" in [c.name for c in chroma_client.list_collections()] # Within the grace period
+
+    second = store.create_versioned_collection("hmsreg_docs")
+    store.swap_alias("hmsreg_docs", second.name, grace_seconds=0)
+    assert {c.name for c in chroma_client.list_collections()} == {"collection-aliases", "hmsreg_docs__v2"}
+
+def test_gc_collects_staging_versions_of_failed_builds(chroma_client):
+    """Verifies that an unswapped version newer than the live one is deleted once it is older than the grace period."""
+    store = VectorStore(chroma_client, revalidate_seconds=0)
+    live = store.create_versioned_collection("hmsreg_docs")
+    store.swap_alias("hmsreg_docs", live.name, grace_seconds=0)
+    abandoned = store.create_versioned_collection("hmsreg_docs") # A build that failed before its swap
+
+    assert store.gc_versions("hmsreg_docs", grace_seconds=3600) == [] # Could still be in progress
+    assert store.gc_versions("hmsreg_docs", grace_seconds=0) == [abandoned.name]
+    assert store.resolve_alias("hmsreg_docs") == live.name
+    assert {c.name for c in chroma_client.list_collections()} == {"collection-aliases", live.name}
+    assert store.create_versioned_collection("hmsreg_docs").name == "hmsreg_docs__v2"
@@ -0,0 +1,108 @@
+import pytest
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.services.answer_cache import AnswerCache, replay_events
+from app.services.chat_service import ChatService
+from app.schemas.chat import ChatRequest, ChatResponse, SourceCitation, StreamingChatResponse, UserRole
+
+CITATIONS = [SourceCitation(title="HMS-kort", url="https://docs.hmsreg.com/?ID=1")]
+
+def test_exact_match_is_normalized_and_role_specific():
+    """Verifies that lookups ignore case/whitespace but respect the user role."""
+    cache = AnswerCache()
+    response = ChatResponse(answer="Svar", citations=CITATIONS)
+    cache.put("Hvordan bestiller jeg HMS-kort?", "Construction Worker", "v1", response)
+
+    assert cache.get("hvordan bestiller jeg  hms-kort?", "Construction Worker", "v1") == response
+    assert cache.get("hvordan bestiller jeg hms-kort?", None, "v1") is None
+
+def test_new_collection_version_invalidates_entries():
+    """Verifies that entries from an older collection version are never served."""
+    cache = AnswerCache()
+    cache.put("spørsmål", None, "v1", ChatResponse(answer="gammelt svar"))
+
+    assert cache.get("spørsmål", None, "v2") is None
+    assert cache.get("spørsmål", None, "v1") is None # Dropped when v2 was seen
+    assert cache.stats()["size"] == 0
+
+def test_similar_match_uses_threshold():
+    """Verifies approximate matching on the query embedding."""
+    cache = AnswerCache(similarity_threshold=0.95)
+    cache.put("hvordan bestiller jeg HMS-kort", None, "v1", ChatResponse(answer="Svar"), query_embedding=[1.0, 0.0])
+
+    assert cache.find_similar([0.99, 0.05], None, "v1").answer == "Svar"
+    assert cache.find_similar([0.0, 1.0], None, "v1") is None
+    assert cache.find_similar([0.99, 0.05], "Construction Worker", "v1") is None
+
+def test_replay_events_streams_tokens_then_citations():
+    """Verifies that a cached answer is replayed as tokens followed by citations."""
+    events = list(replay_events(ChatResponse(answer="Du bestiller kortet", citations=CITATIONS)))
+
+    assert "".join(content for kind, content in events if kind == "token") == "Du bestiller kortet"
+    assert events[-1] == ("citation", [c.model_dump() for c in CITATIONS])
+
+@pytest.mark.asyncio
+async def test_stream_chat_response_replays_cached_answer():
+    """Verifies that a repeated question is served from the cache without retrieval or LLM calls."""
+    with patch('app.services.chat_service.genai'), \
+         patch('app.services.chat_service.Agent'), \
+         patch('app.services.chat_service.get_collection_version', return_value="v1"):
+        service = ChatService()
+        service._prepare_context = AsyncMock(return_value=("prompt", CITATIONS))
+        calls = []
+
+        @asynccontextmanager
+        async def run_stream(*args, **kwargs):
+            calls.append(args)
+            async def stream_output(debounce_by=None):
+                yield StreamingChatResponse(confidence=0.9, answer="Du bestiller")
+                yield StreamingChatResponse(confidence=0.9, answer="Du bestiller kortet i HMSREG.")
+            result = MagicMock()
+            result.stream_output = stream_output
+            yield result
+
+        service.single_pass_agent = MagicMock()
+        service.single_pass_agent.run_stream = run_stream
+
+        request = ChatRequest(message="Hvordan bestiller jeg HMS-kort?", user_role=UserRole.CONSTRUCTION_WORKER)
+        first = [event async for event in service.stream_chat_response(request, MagicMock())]
+        second = [event async for event in service.stream_chat_response(request, MagicMock())]
+
+    def answer(events):
+        return "".join(content for kind, content in events if kind == "token")
+
+    assert answer(first) == answer(second) == "Du bestiller kortet i HMSREG."
+    assert first[-1] == second[-1] == ("citation", [c.model_dump() for c in CITATIONS])
+    service._prepare_context.assert_awaited_once()
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_stream_chat_response_does_not_cache_an_empty_stream():
+    """Verifies that a model stream that ends without any answer is not cached and replayed."""
+    with patch('app.services.chat_service.genai'), \
+         patch('app.services.chat_service.Agent'), \
+         patch('app.services.chat_service.get_collection_version', return_value="v1"):
+        service = ChatService()
+        service._prepare_context = AsyncMock(return_value=("prompt", CITATIONS))
+        calls = []
+
+        @asynccontextmanager
+        async def run_stream(*args, **kwargs):
+            calls.append(args)
+            async def stream_output(debounce_by=None):
+                yield StreamingChatResponse(confidence=0.9, answer="")
+            result = MagicMock()
+            result.stream_output = stream_output
+            yield result
+
+        service.single_pass_agent = MagicMock()
+        service.single_pass_agent.run_stream = run_stream
+
+        request = ChatRequest(message="Hvordan bestiller jeg HMS-kort?")
+        first = [event async for event in service.stream_chat_response(request, MagicMock())]
+        second = [event async for event in service.stream_chat_response(request, MagicMock())]
+
+    assert not any(kind == "token" for kind, _ in first + second)
+    assert service.answer_cache.stats()["size"] == 0
+    assert len(calls) == 2
@@ -1,7 +1,10 @@
 import pytest
+from contextlib import asynccontextmanager
 from unittest.mock import AsyncMock, MagicMock, patch
 from app.services.chat_service import ChatService, FALLBACK_MESSAGE
-from app.schemas.chat import ChatRequest, ChatResponse, SourceCitation
+from app.schemas.chat import ChatRequest, ChatResponse, SourceCitation, StreamingChatResponse
+from app.schemas.rag import QueryResult
+from app.rag.embeddings import FakeEmbeddingClient
 from app.core.config import settings
 
 @pytest.fixture
@@ -114,3 +117,84 @@ async def test_generate_chat_response_ambiguous_query_suggestions(chat_service,
     assert response.fallback_message is None
     assert response.suggested_queries == expected_suggestions
     assert response.confidence == 0.8
+
+def _single_pass_stream(*partials):
+    """Builds a run_stream replacement that yields the given partial StreamingChatResponses."""
+    @asynccontextmanager
+    async def run_stream(*args, **kwargs):
+        async def stream_output(debounce_by=None):
+            for partial in partials:
+                yield partial
+        result = MagicMock()
+        result.stream_output = stream_output
+        yield result
+    return run_stream
+
+@pytest.mark.asyncio
+async def test_stream_chat_response_single_pass_streams_answer_deltas(chat_service, mock_chroma_client):
+    """
+    Test that the single-pass stream emits answer deltas from one structured generation, then citations.
+    """
+    citations = [SourceCitation(title="Doc", url="http://doc.com")]
+    chat_service._prepare_context = AsyncMock(return_value=("dummy prompt", citations))
+    chat_service.answer_cache = None
+    chat_service.single_pass_agent = MagicMock()
+    chat_service.single_pass_agent.run_stream = _single_pass_stream(
+        StreamingChatResponse(confidence=0.9),
+        StreamingChatResponse(confidence=0.9, answer="Hello"),
+        StreamingChatResponse(confidence=0.9, answer="Hello world"),
+    )
+
+    request = ChatRequest(message="What is HMSREG?")
+    events = [event async for event in chat_service.stream_chat_response(request, mock_chroma_client)]
+
+    assert "".join(content for kind, content in events if kind == "token") == "Hello world"
+    assert events[-1] == ("citation", [c.model_dump() for c in citations])
+    chat_service.agent.run.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_stream_chat_response_single_pass_suggestions_and_fallback(chat_service, mock_chroma_client):
+    """
+    Test that suggestions are emitted before the answer, and low confidence yields the fallback message.
+    """
+    chat_service._prepare_context = AsyncMock(return_value=("dummy prompt", []))
+    chat_service.answer_cache = None
+    chat_service.single_pass_agent = MagicMock()
+    chat_service.single_pass_agent.run_stream = _single_pass_stream(
+        StreamingChatResponse(suggested_queries=["Q1", "Q2"], confidence=0.8, answer="Your query is broad."),
+    )
+
+    request = ChatRequest(message="Tell me about rules")
+    events = [event async for event in chat_service.stream_chat_response(request, mock_chroma_client)]
+    assert events[0] == ("suggestions", ["Q1", "Q2"])
+    assert events[1] == ("token", "Your query is broad.")
+
+    chat_service.single_pass_agent.run_stream = _single_pass_stream(
+        StreamingChatResponse(confidence=settings.RAG_CONFIDENCE_THRESHOLD - 0.1, answer="Made up"),
+    )
+    events = [event async for event in chat_service.stream_chat_response(request, mock_chroma_client)]
+    assert events == [("fallback", FALLBACK_MESSAGE)]
+
+@pytest.mark.asyncio
+async def test_irrelevant_context_short_circuits_to_fallback(chat_service, mock_chroma_client):
+    """
+    Test that when no retrieved chunk passes the distance cut-off, the fallback is returned without an LLM call.
+    """
+    far_result = QueryResult(
+        documents=["Om oss"], metadatas=[{"url": "http://doc.com", "title": "Doc"}],
+        ids=["doc-0"], distances=[settings.RAG_MAX_DISTANCE + 0.5],
+    )
+    chat_service.embedding_client = FakeEmbeddingClient(dimension=8)
+    chat_service.answer_cache = None
+    chat_service.single_pass_agent = MagicMock()
+
+    request = ChatRequest(message="Hva blir været i morgen?")
+    with patch('app.services.chat_service.query_collection', return_value=far_result):
+        response = await chat_service.generate_chat_response(request, mock_chroma_client)
+        events = [event async for event in chat_service.stream_chat_response(request, mock_chroma_client)]
+
+    assert response.fallback_message == FALLBACK_MESSAGE
+    assert response.answer == ""
+    assert events == [("fallback", FALLBACK_MESSAGE)]
+    chat_service.agent.run.assert_not_called()
+    chat_service.single_pass_agent.run_stream.assert_not_called()
@@ -0,0 +1,38 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from app.services.registry import ServiceRegistry
+from app.core.dependencies import get_chat_service
+
+def _request_with_registry(registry):
+    request = MagicMock()
+    request.app.state.services = registry
+    return request
+
+def test_registry_start_builds_single_chat_service():
+    """
+    Test that the registry builds the ChatService once and every request gets the same instance.
+    """
+    with patch('app.services.registry.ChatService') as MockChatService:
+        registry = ServiceRegistry()
+        registry.start()
+
+        assert registry.ready is True
+        assert registry.status()["services"]["chat_service"] is True
+        MockChatService.assert_called_once()
+
+        request = _request_with_registry(registry)
+        assert get_chat_service(request) is get_chat_service(request)
+        MockChatService.assert_called_once()
+
+def test_registry_start_failure_reports_not_ready():
+    """
+    Test that a failing ChatService construction is recorded in the readiness state.
+    """
+    with patch('app.services.registry.ChatService', side_effect=RuntimeError("missing key")):
+        registry = ServiceRegistry()
+        registry.start()
+
+    assert registry.ready is False
+    assert registry.status()["error"] == "missing key"
+    with pytest.raises(ValueError):
+        get_chat_service(_request_with_registry(registry))
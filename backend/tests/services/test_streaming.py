@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import pytest
+from unittest.mock import patch
+
+from app.services.streaming import coalesce_tokens
+
+async def _events(items):
+    for item in items:
+        if item[0] == "pause": # Simulates the model taking a while for the next delta
+            await asyncio.sleep(item[1])
+            continue
+        yield item
+
+async def _collect(events, **kwargs):
+    return [event async for event in coalesce_tokens(events, **kwargs)]
+
+@pytest.mark.asyncio
+async def test_coalesces_tokens_by_character_count():
+    """Verifies that small deltas are merged until min_chars is reached."""
+    with patch('app.services.streaming.time.monotonic', return_value=0.0):
+        events = await _collect(
+            _events([("token", "ab"), ("token", "cd"), ("token", "ef"), ("token", "g")]),
+            min_chars=4, interval_ms=1000,
+        )
+    assert events == [("token", "abcd"), ("token", "efg")]
+
+@pytest.mark.asyncio
+async def test_flushes_on_interval():
+    """Verifies that buffered text is flushed once the interval has passed."""
+    events = await _collect(
+        _events([("token", "a"), ("token", "b"), ("pause", 0.2), ("token", "c")]),
+        min_chars=100, interval_ms=100,
+    )
+    assert events == [("token", "ab"), ("token", "c")]
+
+@pytest.mark.asyncio
+async def test_flushes_on_interval_while_the_model_pauses():
+    """Verifies that text buffered before a pause is sent after interval_ms, not when the next token arrives."""
+    start = time.monotonic()
+    received = []
+    async for event in coalesce_tokens(_events([("token", "Hei"), ("pause", 0.5), ("token", " der")]), min_chars=100, interval_ms=50):
+        received.append((event, time.monotonic() - start))
+
+    assert [event for event, _ in received] == [("token", "Hei"), ("token", " der")]
+    assert received[0][1] < 0.3
+    assert received[1][1] >= 0.5
+
+@pytest.mark.asyncio
+async def test_flushes_before_other_events_and_preserves_order():
+    """Verifies that non-token events flush the buffer first and pass through unchanged."""
+    events = await _collect(
+        _events([("suggestions", ["Q1"]), ("token", "Hei"), ("token", " der"), ("citation", [])]),
+        min_chars=100, interval_ms=10_000,
+    )
+    assert events == [("suggestions", ["Q1"]), ("token", "Hei der"), ("citation", [])]
+
+@pytest.mark.asyncio
+async def test_zero_limits_pass_every_token_through():
+    """Verifies that coalescing can be disabled."""
+    events = await _collect(_events([("token", "a"), ("token", "b")]), min_chars=0, interval_ms=0)
+    assert events == [("token", "a"), ("token", "b")]
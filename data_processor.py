@@ -1,25 +1,77 @@
 import os
+import sys
 import requests
 from bs4 import BeautifulSoup
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 import google.generativeai as genai
 import numpy as np
 from dotenv import load_dotenv
 
+# Share the vectorized de-duplication and the chunking with the backend ingestion
+# (modules that don't need the backend's settings)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from app.rag.chunking import StructuredChunker
+from app.rag.dedup import greedy_dedup
+from app.rag.embedding_cache import DocumentEmbeddingCache, SQLiteEmbeddingStore
+
 load_dotenv()
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBED_BATCH_SIZE = 100 # The API's limit on texts per request
+# Chunk sizes in tokens, as in the backend ingestion (see INGEST_CHUNK_*)
+CHUNK_MAX_TOKENS = int(os.getenv("INGEST_CHUNK_MAX_TOKENS", 384))
+CHUNK_MIN_TOKENS = int(os.getenv("INGEST_CHUNK_MIN_TOKENS", 64))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("INGEST_CHUNK_OVERLAP_TOKENS", 32))
+# The same content-addressed store the backend ingestion uses (see INGEST_EMBEDDING_CACHE_PATH),
+# relative to the backend directory; opened on first use
+_embedding_cache_path = os.getenv("INGEST_EMBEDDING_CACHE_PATH", "embedding_cache/documents.sqlite3")
+if _embedding_cache_path:
+    _embedding_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", _embedding_cache_path)
+_embedding_cache = None
+
 print("Script execution started.")
 
 def calculate_cosine_similarity(embedding1, embedding2):
     """Calculates the cosine similarity between two embedding vectors."""
     return np.dot(embedding1, embedding2) / (np.linalg.norm(embedding1) * np.linalg.norm(embedding2))
 
+def _embed_with_genai(texts):
+    embeddings = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        embeddings.extend(genai.embed_content(
+            model=EMBEDDING_MODEL,
+            content=texts[start:start + EMBED_BATCH_SIZE],
+            task_type="retrieval_document"
+        )["embedding"])
+    return embeddings
+
+def embed_documents(texts):
+    """Embeds document chunks, calling the API only for text not in the embedding cache."""
+    global _embedding_cache
+    if not _embedding_cache_path:
+        return _embed_with_genai(texts)
+    if _embedding_cache is None:
+        _embedding_cache = DocumentEmbeddingCache(SQLiteEmbeddingStore(_embedding_cache_path), EMBEDDING_MODEL)
+    return _embedding_cache.embed(texts, _embed_with_genai)
+
 def get_and_chunk_text(url: str):
     """
     Fetches text content from a URL, cleans it, splits it into chunks,
     and performs semantic de-duplication on the chunks.
     """
+    pairs = get_and_chunk_text_with_embeddings(url)
+    if pairs is None:
+        return None
+    return [chunk for chunk, _ in pairs]
+
+def get_and_chunk_text_with_embeddings(url: str, embed=None):
+    """
+    Like get_and_chunk_text, but returns (chunk, embedding) pairs so the embeddings
+    computed for de-duplication can be stored without embedding the chunks again.
+
+    embed(texts) computes the embeddings (embed_documents by default); an embedding
+    may be an empty list if it failed, and such chunks are kept without one.
+    """
     SIMILARITY_THRESHOLD = 0.95  # Tune this value as needed
 
     try:
@@ -31,7 +83,8 @@ def get_and_chunk_text(url: str):
         # Try to find the main content area by its ID
         main_content_div = soup.select_one('main#main-content')
         
-        extracted_texts = []
+        # (heading level or 0, text) blocks, so the chunker can follow the headings
+        extracted_blocks = []
         if main_content_div:
             # Extract text from common content tags within the main content div
             for tag in main_content_div.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'li', 'div']):
@@ -39,59 +92,35 @@ def get_and_chunk_text(url: str):
                 # For now, let's just get all text from these tags
                 text_from_tag = tag.get_text(separator='\n', strip=True)
                 if text_from_tag:
-                    extracted_texts.append(text_from_tag)
-            text = '\n\n'.join(extracted_texts)
+                    level = int(tag.name[1]) if tag.name[0] == 'h' else 0
+                    extracted_blocks.append((level, text_from_tag))
         else:
             # Fallback if the specific main content div is not found
             print(f"Warning: Specific main content selector 'main#main-content' not found for {url}. Falling back to body.")
-            text = soup.body.get_text(separator='\n', strip=True)
-
-        # Clean up extra whitespace globally
-        text = '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+            extracted_blocks.append((0, soup.body.get_text(separator='\n', strip=True)))
 
-        # Initialize the text splitter
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=2000,
-            chunk_overlap=400,
-            length_function=len,
-        )
+        # Clean up extra whitespace in every block
+        blocks = [
+            (level, '\n'.join(line.strip() for line in text.splitlines() if line.strip()))
+            for level, text in extracted_blocks
+        ]
 
-        initial_chunks = text_splitter.split_text(text)
+        # Chunk by headings and tokens, like the backend ingestion
+        chunker = StructuredChunker(CHUNK_MAX_TOKENS, CHUNK_MIN_TOKENS, CHUNK_OVERLAP_TOKENS)
+        initial_chunks = [chunk.text for chunk in chunker.split(blocks)]
         
         # --- Semantic De-duplication ---
-        unique_chunks = []
-        unique_chunk_embeddings = []
-
         if not initial_chunks:
             return []
 
-        # Embed all initial chunks first
-        all_chunk_embeddings_response = genai.embed_content(
-            model="models/text-embedding-004",
-            content=initial_chunks,
-            task_type="retrieval_document"
-        )
-        all_chunk_embeddings = all_chunk_embeddings_response["embedding"]
-
-        # Add the first chunk unconditionally
-        unique_chunks.append(initial_chunks[0])
-        unique_chunk_embeddings.append(all_chunk_embeddings[0])
+        # Embed all initial chunks first, reusing embeddings of chunk text seen on earlier runs
+        all_chunk_embeddings = (embed or embed_documents)(initial_chunks)
 
-        for i in range(1, len(initial_chunks)):
-            current_chunk = initial_chunks[i]
-            current_embedding = all_chunk_embeddings[i]
-            
-            is_duplicate = False
-            for unique_embedding in unique_chunk_embeddings:
-                similarity = calculate_cosine_similarity(current_embedding, unique_embedding)
-                if similarity > SIMILARITY_THRESHOLD:
-                    is_duplicate = True
-                    break
-            
-            if not is_duplicate:
-                unique_chunks.append(current_chunk)
-                unique_chunk_embeddings.append(current_embedding)
-        
+        embedded = [i for i, embedding in enumerate(all_chunk_embeddings) if embedding]
+        kept = {embedded[j] for j in greedy_dedup([all_chunk_embeddings[i] for i in embedded], SIMILARITY_THRESHOLD)}
+        keep = [i for i, embedding in enumerate(all_chunk_embeddings) if i in kept or not embedding]
+        unique_chunks = [initial_chunks[i] for i in keep]
+        unique_chunk_embeddings = [all_chunk_embeddings[i] for i in keep]
         
         print(f"Successfully fetched and split content from {url}.")
         print(f"Initial chunks: {len(initial_chunks)}. Unique chunks after de-duplication: {len(unique_chunks)}.")
@@ -102,7 +131,7 @@ def get_and_chunk_text(url: str):
             print(unique_chunks[0][:200] + "...")
             print("------------------------------------")
             
-        return unique_chunks
+        return list(zip(unique_chunks, unique_chunk_embeddings))
 
     except requests.exceptions.RequestException as e:
         print(f"Error fetching URL: {e}")